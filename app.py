@@ -1,20 +1,43 @@
-import cv2, threading, time, os, base64, wave, io
+import threading, time, os, sys, base64, uuid, functools, tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, send_from_directory
 from flask_socketio import SocketIO, emit
 from sensors import Sensors
 from face_recognizer import FaceRecognizer
-from firebase_client import init_firebase, log_event, send_fcm, verify_firebase_token, upload_audio_to_storage
+from recognition_service import RecognitionService, StaleRequest
+from cameras import CameraManager, load_camera_configs, DEFAULT_TRIGGER
+from motion import MOTION_MIN_FACE, crop_roi
+from firebase_client import (init_firebase, log_event, send_fcm, verify_firebase_token, verify_session_cookie,
+                             create_session_cookie, forget_token, SESSION_DURATION, upload_file_to_storage,
+                             upload_image_to_storage, get_log_stats, flush_events, DeviceTokenCache)
+from notifier import NotificationDispatcher
+from audio_relay import AudioRelay
+from recorder import AudioRecorder
+from enrollment import BulkImporter, is_archive, ARCHIVE_EXTENSIONS
+from clips import ClipRecorder
+from visitors import VisitorTracker, thumbnail, dhash
+import metrics
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 import pyttsx3
 import pyaudio
 import numpy as np
 
-TWILIO_SID = id
-TWILIO_TOKEN = token
-TWILIO_FROM = from
+TWILIO_SID = os.environ.get("TWILIO_SID")
+TWILIO_TOKEN = os.environ.get("TWILIO_TOKEN")
+TWILIO_FROM = os.environ.get("TWILIO_FROM")
 twilio_client = None
 owner_phone_number = None
 
+NOTIFY_SOCKETIO_DEADLINE = float(os.environ.get("NOTIFY_SOCKETIO_DEADLINE", 1.0))
+NOTIFY_FCM_DEADLINE = float(os.environ.get("NOTIFY_FCM_DEADLINE", 5.0))
+NOTIFY_SMS_DEADLINE = float(os.environ.get("NOTIFY_SMS_DEADLINE", 10.0))
+NOTIFY_RETRIES = int(os.environ.get("NOTIFY_RETRIES", 2))
+THUMBNAIL_WAIT = float(os.environ.get("THUMBNAIL_WAIT", 1.5))
+
+SMS_SEND_SECONDS = metrics.histogram("doorcam_sms_send_seconds", "Time spent in Twilio messages.create", ["status"])
+ALERT_SECONDS = metrics.histogram("doorcam_alert_seconds", "Time from proximity alert to decision", ["outcome"])
+
 def load_phone_number():
     global owner_phone_number
     try:
@@ -38,7 +61,8 @@ load_phone_number()
 
 if TWILIO_SID and TWILIO_TOKEN:
     try:
-        twilio_client = Client(TWILIO_SID, TWILIO_TOKEN)
+        twilio_client = Client(TWILIO_SID, TWILIO_TOKEN,
+                               http_client=TwilioHttpClient(timeout=NOTIFY_SMS_DEADLINE))
         print("Twilio client initialized")
     except Exception as e:
         print(f"Twilio initialization failed: {e}")
@@ -56,12 +80,21 @@ except Exception as e:
     print(f"Firebase initialization failed: {e}")
 
 face_rec = FaceRecognizer()
-face_rec.load_known_faces()
 
-cap = cv2.VideoCapture(0)
-if not cap.isOpened():
-    print("Warning: camera not detected")
-    cap = None
+recognition = RecognitionService(face_rec)
+recognition.warm_up()
+recognition.start()
+
+device_tokens = DeviceTokenCache()
+device_tokens.start()
+
+STREAM_FPS = float(os.environ.get("STREAM_FPS", 10))
+STREAM_QUALITY = int(os.environ.get("STREAM_QUALITY", 75))
+STREAM_WIDTH = int(os.environ.get("STREAM_WIDTH", 0)) or None
+
+cameras = CameraManager(load_camera_configs(), stream_fps=STREAM_FPS, stream_quality=STREAM_QUALITY,
+                        stream_width=STREAM_WIDTH)
+cameras.start()
 
 tts = None
 try:
@@ -73,9 +106,6 @@ except Exception as e:
     print(f"TTS initialization failed: {e}")
 
 FORMAT = pyaudio.paInt16
-CHANNELS = 1
-RATE = 44100
-CHUNK = 1024
 RECORD_SECONDS = 5
 
 audio = None
@@ -85,16 +115,26 @@ try:
 except Exception as e:
     print(f"Audio initialization failed: {e}")
 
+def create_sms(phone_number, message):
+    start = time.perf_counter()
+    try:
+        msg = twilio_client.messages.create(
+            body=message,
+            from_=TWILIO_FROM,
+            to=phone_number
+        )
+    except Exception:
+        SMS_SEND_SECONDS.labels("error").observe(time.perf_counter() - start)
+        raise
+    SMS_SEND_SECONDS.labels("sent").observe(time.perf_counter() - start)
+    return msg
+
 def send_sms(phone_number, message):
     try:
         if twilio_client and TWILIO_FROM:
-            msg = twilio_client.messages.create(
-                body=message,
-                from_=TWILIO_FROM,
-                to=phone_number
-            )
+            msg = create_sms(phone_number, message)
             print(f"SMS sent to {phone_number}: {msg.sid}")
-            log_event("sms_sent", f"SMS sent to {phone_number}", {"sid": msg.sid, "to": phone_number})
+            log_event("sms_sent", {"sid": msg.sid, "to": phone_number})
             return True
         else:
             print("Twilio not configured")
@@ -103,24 +143,200 @@ def send_sms(phone_number, message):
         print(f"Error sending SMS: {e}")
         return False
 
-def alert_callback(distance):
+def notify_socketio(payload):
+    socketio.emit('event', payload['event'])
+
+def thumbnail_url(payload, timeout=THUMBNAIL_WAIT):
+    future = payload.get('thumbnail')
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except Exception as e:
+        print(f"Thumbnail unavailable: {e}")
+        return None
+
+def notify_fcm(payload):
+    tokens = device_tokens.tokens()
+    if not tokens:
+        return False
+    data = dict(payload['data'])
+    url = thumbnail_url(payload)
+    if url:
+        data['thumbnail_url'] = url
+    if send_fcm(tokens, payload['title'], payload['body'], data) is None:
+        raise RuntimeError("FCM send failed")
+    return len(tokens)
+
+def notify_sms(payload):
+    if not (owner_phone_number and twilio_client and TWILIO_FROM):
+        missing = []
+        if not owner_phone_number: missing.append("phone_number")
+        if not twilio_client: missing.append("twilio_client")
+        if not TWILIO_FROM: missing.append("TWILIO_FROM")
+        print(f"SMS not sent - missing: {missing}")
+        return False
+    url = thumbnail_url(payload)
+    msg = create_sms(owner_phone_number, f"{payload['sms']} Photo: {url}" if url else payload['sms'])
+    print(f"SMS Alert sent successfully to {owner_phone_number}: {msg.sid}")
+    return msg.sid
+
+def sms_retryable(error):
+    # A timed-out or dropped request may already have been accepted by Twilio; only retry when it cannot have been.
+    status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status >= 500
+    if "ConnectTimeout" in {cls.__name__ for cls in type(error).__mro__}:
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return type(reason).__name__ == "NewConnectionError"
+
+def on_notification_result(outcome, payload):
+    channel, status = outcome['channel'], outcome['status']
+    if channel == 'fcm' and status == 'sent':
+        log_event("notification_sent", {"method": "fcm", "count": outcome['result'], "latency": outcome['latency']})
+    elif channel == 'sms' and status == 'sent':
+        log_event("twilio_sms_sent", {"sid": outcome['result'], "to": owner_phone_number,
+                                      "message": payload['sms'], "latency": outcome['latency']})
+    elif channel == 'sms' and status in ('failed', 'timeout'):
+        log_event("twilio_sms_error", {"error": outcome['error'], "status": status, "phone": owner_phone_number})
+    elif status in ('failed', 'timeout'):
+        log_event("notification_error", {"method": channel, "status": status, "error": outcome['error']})
+
+notifier = NotificationDispatcher(on_result=on_notification_result)
+notifier.register('socketio', notify_socketio, deadline=NOTIFY_SOCKETIO_DEADLINE, retries=0)
+notifier.register('fcm', notify_fcm, deadline=NOTIFY_FCM_DEADLINE, retries=NOTIFY_RETRIES)
+notifier.register('sms', notify_sms, deadline=NOTIFY_SMS_DEADLINE, retries=NOTIFY_RETRIES, retryable=sms_retryable)
+
+ALERT_BURST_FRAMES = int(os.environ.get("ALERT_BURST_FRAMES", 5))
+ALERT_BURST_WINDOW = float(os.environ.get("ALERT_BURST_WINDOW", 1.0))
+ALERT_BEST_FRAMES = int(os.environ.get("ALERT_BEST_FRAMES", 2))
+DETECT_SCALE = float(os.environ.get("DETECT_SCALE", 0.5))
+DETECT_TIMEOUT = float(os.environ.get("DETECT_TIMEOUT", 10.0))
+visitor_tracker = VisitorTracker()
+thumbnail_uploads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnail")
+
+ALERT_CLIP_EVENTS = set(filter(None, os.environ.get("ALERT_CLIP_EVENTS", "unknown").split(",")))
+
+def on_clip_ready(clip, event):
+    log_event("alert_clip", dict(clip, event=event.get('type'), distance=event.get('distance')))
+    socketio.emit('alert_clip', dict(clip, type=event.get('type')))
+
+clip_recorder = ClipRecorder(None, upload_file_to_storage, on_ready=on_clip_ready)
+clip_recorder.start()
+
+def on_thumbnail_uploaded(alert_id, future):
+    if future.exception():
+        print(f"Thumbnail upload failed for alert {alert_id}: {future.exception()}")
+        return
+    socketio.emit('alert_thumbnail', {'alert_id': alert_id, 'thumbnail_url': future.result()})
+
+def capture_clip(kind, distance, rig, marks):
+    if kind in ALERT_CLIP_EVENTS:
+        return clip_recorder.capture({'type': kind, 'distance': distance, 'camera': rig.id}, rig.preroll,
+                                     marks.get(rig.id))
+    return None
+
+def mark_preroll(rigs):
+    # Pre-roll is cut when the trigger fires, so recognition latency does not push the approach out of the clip.
+    return {rig.id: clip_recorder.mark(rig.preroll) for rig in rigs if rig.preroll}
+
+def alert_callback(distance, trigger="door"):
+    start = time.perf_counter()
+    outcome = handle_alert(distance, trigger)
+    ALERT_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+
+def collect_faces(jobs):
+    faces = []
+    for rig, future in jobs:
+        try:
+            faces.extend(future.result(timeout=DETECT_TIMEOUT))
+        except StaleRequest as e:
+            print(f"Camera {rig.id} recognition skipped: {e}")
+        except Exception as e:
+            print(f"Camera {rig.id} recognition error: {e}")
+        else:
+            timing = future.timing
+            print(f"Camera {rig.id} recognized in {timing['total'] * 1000:.0f} ms "
+                  f"(queue {timing['queue'] * 1000:.0f}, detect {timing['detect'] * 1000:.0f}, "
+                  f"encode {timing['encode'] * 1000:.0f})")
+    return faces
+
+def handle_alert(distance, trigger="door"):
     print(f"Alert triggered! Distance: {distance:.1f}cm")
     
-    if not cap:
+    rigs = [rig for rig in cameras.for_trigger(trigger) if rig.hub.is_opened()]
+    if not rigs:
         print("Camera not available!")
-        return
-        
-    ret, frame = cap.read()
-    if not ret:
+        return "no_camera"
+
+    marks = mark_preroll(rigs)
+    since = time.time() - ALERT_BURST_WINDOW
+    bursts = {}
+    jobs = []
+    for rig in rigs:
+        burst = rig.hub.recent(count=ALERT_BURST_FRAMES, since=since)
+        if burst:
+            bursts[rig.id] = burst
+            frames = [frame for _, _, frame in burst]
+            jobs.append((rig, recognition.submit(rig.id, frames, best_n=ALERT_BEST_FRAMES, scale=DETECT_SCALE)))
+    if not bursts:
         print("Failed to capture frame!")
-        return
+        return "no_frame"
+
+    return respond(collect_faces(jobs), bursts, rigs, distance, marks)
+
+def on_motion(rig, burst, score):
+    if time.time() - sensors.last_alert_time < sensors.alert_cooldown:
+        return None
+    if not sensors.alert_slots.acquire(blocking=False):
+        return None
+    result = Future()
+    threading.Thread(target=run_motion_alert, args=(rig, burst, score, result), daemon=True).start()
+    return result
 
-    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    name, confidence_dist = face_rec.recognize(rgb)
+def run_motion_alert(rig, burst, score, result):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome = handle_motion(rig, burst, score)
+    except Exception as e:
+        print(f"Motion alert error on {rig.id}: {e}")
+    finally:
+        sensors.alert_slots.release()
+        ALERT_SECONDS.labels(outcome).observe(time.perf_counter() - start)
+        result.set_result(outcome)
+
+def handle_motion(rig, burst, score):
+    marks = mark_preroll([rig])
+    # Only the ROI is recognized, so passers-by outside it can neither match nor unlock.
+    burst = [(seq, ts, np.ascontiguousarray(crop_roi(frame, rig.config.roi))) for seq, ts, frame in burst]
+    frames = [frame for _, _, frame in burst]
+    job = recognition.submit(rig.id, frames, best_n=ALERT_BEST_FRAMES, scale=DETECT_SCALE)
+    faces = [f for f in collect_faces([(rig, job)]) if f['face_area'] >= MOTION_MIN_FACE ** 2]
+    if not faces:
+        return "no_face"
+    if time.time() - sensors.last_alert_time < sensors.alert_cooldown:
+        return "cooldown"
+    sensors.last_alert_time = time.time()
+    print(f"Motion on {rig.id} (score {score:.3f}): {len(faces)} face(s) in view")
+    return respond(faces, {rig.id: burst}, [rig], None, marks, door=DEFAULT_TRIGGER in rig.config.triggers)
+
+def respond(faces, bursts, rigs, distance, marks, door=True):
+    name, confidence_dist = face_rec.best_result(faces)
+    if len(faces) > 1:
+        print(f"{len(faces)} faces evaluated: {[f['name'] or 'unknown' for f in faces]}")
     
     if name:
         print(f"Face recognized: {name}")
-        log_event("face_recognized", {"name": name, "distance": distance, "confidence": confidence_dist})
+        best = min((f for f in faces if f['name'] == name), key=lambda f: f['distance'])
+        clip_id = capture_clip('recognized', distance, cameras.get(best['camera']), marks)
+        log_event("face_recognized", {"name": name, "distance": distance, "confidence": confidence_dist,
+                                      "clip_id": clip_id, "camera": best['camera'], "unlocked": door})
+        if not door:
+            socketio.emit('event', {'type': 'recognized', 'name': name, 'camera': best['camera'],
+                                    'confidence': confidence_dist, 'clip_id': clip_id, 'unlocked': False})
+            return "seen"
         
         sensors.lcd_write(f"Welcome, {name}", "Door Unlocking...")
         sensors.beep(200)
@@ -131,70 +347,102 @@ def alert_callback(distance):
             'name': name, 
             'distance': distance,
             'confidence': confidence_dist,
+            'clip_id': clip_id,
             'is_dark': sensors.is_dark,
             'light_on': sensors.light_state
         })
+        return "recognized"
         
     else:
+        face = max(faces, key=lambda f: f['sharpness'] * f['face_area']) if faces else None
+        rig = cameras.get(face['camera']) if face else next(r for r in rigs if r.id in bursts)
+        burst = bursts[rig.id]
+        frame = burst[face['frame_index']][2] if face else burst[-1][2]
+        jpeg, crop = thumbnail(frame, face['location'] if face else None)
+        alert_id = uuid.uuid4().hex[:12]
+        visit, is_new = visitor_tracker.check(alert_id, dhash(crop), face['encoding'] if face else None)
+
+        if not is_new:
+            print(f"Repeat visitor (alert {visit.alert_id}, seen {visit.count}x) - not re-notifying")
+            log_event("alert_merged", {"alert_id": visit.alert_id, "count": visit.count, "distance": distance,
+                                       "confidence": confidence_dist})
+            notifier.dispatch({'event': {
+                'type': 'unknown',
+                'alert_id': visit.alert_id,
+                'repeat': visit.count,
+                'distance': distance,
+                'confidence': confidence_dist,
+                'thumbnail_url': visit.thumbnail_url(),
+                'two_way_comm_ready': True,
+                'is_dark': sensors.is_dark,
+                'light_on': sensors.light_state
+            }}, channels=['socketio'])
+            if door:
+                sensors.lcd_write("Access Denied", "Owner Notified")
+            return "merged"
+
         print(f"Face not recognized - alerting owner")
-        log_event("alert", {"reason": "unknown_face", "distance": distance, "confidence": confidence_dist})
+        where = f"Distance: {int(distance)}cm" if distance is not None else f"Camera: {rig.config.label}"
+        if jpeg:
+            visit.thumbnail = thumbnail_uploads.submit(upload_image_to_storage, jpeg, f"alert_{alert_id}.jpg")
+            visit.thumbnail.add_done_callback(lambda future: on_thumbnail_uploaded(alert_id, future))
+        clip_id = capture_clip('unknown', distance, rig, marks)
+        log_event("alert", {"reason": "unknown_face", "alert_id": alert_id, "distance": distance,
+                            "confidence": confidence_dist, "clip_id": clip_id, "camera": rig.id})
         
+        notifier.dispatch({
+            'event': {
+                'type': 'unknown',
+                'alert_id': alert_id,
+                'camera': rig.id,
+                'distance': distance,
+                'confidence': confidence_dist,
+                'clip_id': clip_id,
+                'two_way_comm_ready': True,
+                'is_dark': sensors.is_dark,
+                'light_on': sensors.light_state
+            },
+            'title': "Unknown Visitor Alert",
+            'body': f"Unknown person detected! {where}",
+            'data': {"type": "unknown", "alert_id": alert_id, "distance": distance, "action": "two_way_comm",
+                     "clip_id": clip_id or ""},
+            'thumbnail': visit.thumbnail,
+            'sms': f"DOORCAM ALERT: Unknown visitor detected! {where}. Check live feed immediately."
+        })
+
+        if not door:
+            return "unknown"
         sensors.lcd_write("Access Denied", "Alerting Owner")
-        
+
         for _ in range(2):
             sensors.beep(200)
             time.sleep(0.12)
-        
-        socketio.emit('event', {
-            'type': 'unknown', 
-            'distance': distance,
-            'confidence': confidence_dist,
-            'two_way_comm_ready': True,
-            'is_dark': sensors.is_dark,
-            'light_on': sensors.light_state
-        })
-
-        try:
-            from firebase_admin import db
-            t_ref = db.reference('/doorcam/device_tokens')
-            tokens = t_ref.get() or []
-            if isinstance(tokens, dict):
-                tokens = list(tokens.values())
-            if tokens:
-                send_fcm(tokens, "Unknown Visitor Alert",
-                         f"Unknown person detected! Distance: {int(distance)}cm",
-                         {"type": "unknown", "distance": distance, "action": "two_way_comm"})
-                log_event("notification_sent", {"method": "fcm", "count": len(tokens)})
-        except Exception as e:
-            print("Error sending FCM:", e)
-
-        try:
-            if owner_phone_number and twilio_client and TWILIO_FROM:
-                message_text = f"DOORCAM ALERT: Unknown visitor detected! Distance: {int(distance)}cm. Check live feed immediately."
-                msg = twilio_client.messages.create(
-                    body=message_text,
-                    from_=TWILIO_FROM,
-                    to=owner_phone_number
-                )
-                print(f"SMS Alert sent successfully to {owner_phone_number}: {msg.sid}")
-                log_event("twilio_sms_sent", {"sid": msg.sid, "to": owner_phone_number, "message": message_text})
-            else:
-                missing = []
-                if not owner_phone_number: missing.append("phone_number")
-                if not twilio_client: missing.append("twilio_client")
-                if not TWILIO_FROM: missing.append("TWILIO_FROM")
-                print(f"SMS not sent - missing: {missing}")
-        except Exception as e:
-            print(f"Twilio SMS error: {e}")
-            log_event("twilio_sms_error", {"error": str(e), "phone": owner_phone_number})
+        return "unknown"
 
 sensors = Sensors(alert_callback=alert_callback)
 sensors.start()
+cameras.start_motion(on_motion, busy=recognition.busy)
+SESSION_COOKIE = "doorcam_session"
+
+def current_user():
+    cookie = request.cookies.get(SESSION_COOKIE)
+    if cookie:
+        claims = verify_session_cookie(cookie)
+        if claims:
+            return claims
+    return verify_firebase_token(request.cookies.get('firebase_token'))
+
+def login_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user():
+            return redirect(url_for('login_page'))
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/')
+@login_required
 def index():
-    token = request.cookies.get('firebase_token')
-    if not token or not verify_firebase_token(token):
-        return redirect(url_for('login_page'))
     return render_template('index.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -203,7 +451,13 @@ def login_page():
         id_token = request.form.get('idToken')
         if verify_firebase_token(id_token):
             resp = redirect(url_for('index'))
-            resp.set_cookie('firebase_token', id_token)
+            cookie = create_session_cookie(id_token)
+            if cookie:
+                resp.set_cookie(SESSION_COOKIE, cookie, max_age=SESSION_DURATION, httponly=True,
+                                secure=request.is_secure, samesite='Lax')
+                resp.delete_cookie('firebase_token')
+            else:
+                resp.set_cookie('firebase_token', id_token)
             return resp
         return "Invalid login", 401
     return render_template('login.html')
@@ -226,41 +480,68 @@ def register_face():
         else:
             return jsonify({'error':'no image provided'}), 400
 
-    person_dir = os.path.join(os.path.dirname(__file__), 'known_faces', name)
-    os.makedirs(person_dir, exist_ok=True)
-    fname = os.path.join(person_dir, f"{int(time.time())}.jpg")
-    with open(fname, 'wb') as f:
-        f.write(image_bytes)
+    try:
+        fname = face_rec.add_face(name, image_bytes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    face_rec.load_known_faces()
     log_event("face_registered", {"name": name, "file": fname})
     return jsonify({'ok': True, 'file': fname})
 
-def gen_frames():
-    while True:
-        if not cap:
-            time.sleep(1)
-            continue
-        success, frame = cap.read()
-        if not success:
-            time.sleep(0.1)
-            continue
-        cv2.putText(frame, "DoorCam Live", (10,20),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 1)
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if ret:
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+def import_progress(job):
+    payload = job.to_dict()
+    socketio.emit('face_import_progress', payload)
+    if job.status == 'done':
+        log_event("faces_imported", {"job_id": job.id, "accepted": job.accepted,
+                                     "duplicates": job.duplicates, "rejected": dict(job.rejected)})
+
+importer = BulkImporter(face_rec, on_progress=import_progress)
+importer.start()
+
+@app.route('/import_faces', methods=['POST'])
+@login_required
+def import_faces():
+    if 'archive' in request.files:
+        upload = request.files['archive']
+        suffix = next((ext for ext in ARCHIVE_EXTENSIONS if upload.filename.lower().endswith(ext)), None)
+        if suffix is None:
+            return jsonify({'error': f'archive must be one of {", ".join(ARCHIVE_EXTENSIONS)}'}), 400
+        fd, path = tempfile.mkstemp(prefix="doorcam-import-", suffix=suffix)
+        with os.fdopen(fd, 'wb') as f:
+            upload.save(f)
+        job = importer.submit(path, cleanup=True)
+    else:
+        path = (request.get_json(silent=True) or request.form).get('path')
+        if not path:
+            return jsonify({'error': 'archive or path missing'}), 400
+        if not os.path.isdir(path) and not (os.path.isfile(path) and is_archive(path)):
+            return jsonify({'error': 'path is not a directory or supported archive'}), 400
+        job = importer.submit(path)
+    return jsonify({'ok': True, 'job_id': job.id, 'status': job.status}), 202
+
+@app.route('/import_faces/<job_id>')
+@login_required
+def import_faces_status(job_id):
+    job = importer.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown import job'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(gen_frames(),
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id=None):
+    rig = cameras.get(camera_id)
+    if rig is None:
+        return jsonify({'error': f'unknown camera {camera_id}'}), 404
+    return Response(rig.broadcaster.stream(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/logout')
 def logout():
+    forget_token(request.cookies.get(SESSION_COOKIE))
+    forget_token(request.cookies.get('firebase_token'))
     resp = redirect(url_for('login_page'))
+    resp.delete_cookie(SESSION_COOKIE)
     resp.delete_cookie('firebase_token')
     return resp
 
@@ -268,24 +549,49 @@ def logout():
 def serve_static(filename):
     return send_from_directory('templates', filename)
 
+def rtc_session_id(data):
+    stream = (data or {}).get('stream') or 'call'
+    return f"{request.sid}/{stream}", stream
+
 @socketio.on('webrtc_offer')
 def handle_webrtc_offer(data):
     from webrtc_server import handle_offer
     sdp = data.get('sdp')
-    sid = request.sid
+    session_id, stream = rtc_session_id(data)
     if not sdp:
-        emit('webrtc_answer', {'error':'missing sdp'})
+        emit('webrtc_answer', {'error':'missing sdp', 'stream': stream})
         return
-    answer = handle_offer(sdp, sid)
+    rig = cameras.get(data.get('camera'))
+    if rig is None:
+        emit('webrtc_answer', {'error': 'unknown camera', 'stream': stream})
+        return
+    answer = handle_offer(sdp, session_id, video_source=rig.hub)
     if answer:
-        emit('webrtc_answer', {'sdp': answer})
+        emit('webrtc_answer', {'sdp': answer, 'stream': stream})
     else:
-        emit('webrtc_answer', {'error':'failed to create answer'})
+        emit('webrtc_answer', {'error':'failed to create answer', 'stream': stream})
+
+@socketio.on('webrtc_ice_candidate')
+def handle_webrtc_ice_candidate(data):
+    from webrtc_server import add_ice_candidate
+    add_ice_candidate(rtc_session_id(data)[0], data)
+
+@socketio.on('webrtc_hangup')
+def handle_webrtc_hangup(data=None):
+    from webrtc_server import cleanup_connection
+    cleanup_connection(rtc_session_id(data)[0])
 
 @socketio.on('connect')
 def on_connect():
     print('client connected')
 
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    audio_relay.leave(request.sid)
+    webrtc = sys.modules.get('webrtc_server')
+    if webrtc:
+        webrtc.cleanup_client(request.sid)
+
 @socketio.on('tts')
 def on_tts(data):
     text = data.get('text')
@@ -362,53 +668,58 @@ def handle_manual_light(data):
             'message': f"Error: {str(e)}"
         })
 
+def recording_progress(job):
+    payload = job.to_dict()
+    socketio.emit('audio_recording_progress', payload)
+    if job.status not in ('done', 'failed'):
+        return
+    if job.status == 'done':
+        message = 'Audio recorded and uploaded successfully'
+    else:
+        message = f'Failed to record audio: {job.error}'
+    socketio.emit('audio_recording_complete', dict(payload, success=job.status == 'done', message=message))
+    if job.origin == 'http' and job.status == 'done':
+        socketio.emit('audio_recorded', dict(payload, success=True, timestamp=job.finished))
+
+recorder = AudioRecorder(audio, FORMAT, upload_file_to_storage, on_progress=recording_progress)
+recorder.start()
+
 @socketio.on('start_audio_recording')
 def handle_start_audio_recording():
+    socketio.emit('audio_recording_status', {
+        'status': 'starting',
+        'message': 'Starting audio recording...'
+    })
+    job = recorder.submit(RECORD_SECONDS, prefix="visitor_audio", origin='socket')
+    emit('audio_recording_started', {'job_id': job.id})
+
+def send_audio(sid, data):
+    socketio.emit('audio_data', data, to=sid)
+
+def audio_backlog(sid):
     try:
-        socketio.emit('audio_recording_status', {
-            'status': 'starting',
-            'message': 'Starting audio recording...'
-        })
-        
-        def record_and_upload():
-            audio_data = record_audio(5)
-            if audio_data:
-                filename = f"visitor_audio_{int(time.time())}.wav"
-                audio_url = upload_audio_to_storage(audio_data, filename)
-                
-                if audio_url:
-                    socketio.emit('audio_recording_complete', {
-                        'success': True,
-                        'audio_url': audio_url,
-                        'filename': filename,
-                        'message': 'Audio recorded and uploaded successfully'
-                    })
-                else:
-                    socketio.emit('audio_recording_complete', {
-                        'success': False,
-                        'message': 'Failed to upload audio'
-                    })
-            else:
-                socketio.emit('audio_recording_complete', {
-                    'success': False,
-                    'message': 'Failed to record audio'
-                })
-        
-        import threading
-        thread = threading.Thread(target=record_and_upload)
-        thread.start()
-        
-    except Exception as e:
-        print(f"Error starting audio recording: {e}")
-        socketio.emit('audio_recording_complete', {
-            'success': False,
-            'message': f'Error: {str(e)}'
-        })
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
+    except Exception:
+        return 0
+
+audio_relay = AudioRelay(send_audio, backlog=audio_backlog)
+audio_relay.start()
+
+@socketio.on('audio_join')
+def handle_audio_join(data=None):
+    room = (data or {}).get('room') or 'door'
+    audio_relay.join(request.sid, room)
+    emit('audio_joined', {'room': room, 'codec': audio_relay.stats()['codec']})
+
+@socketio.on('audio_leave')
+def handle_audio_leave(data=None):
+    audio_relay.leave(request.sid)
 
 @socketio.on('audio_stream')
 def handle_audio_stream(data):
     try:
-        socketio.emit('audio_data', data, broadcast=True)
+        audio_relay.publish(request.sid, data)
     except Exception as e:
         print(f"Error handling audio stream: {e}")
 
@@ -423,7 +734,7 @@ def handle_emergency_alert():
             message = "🚨 EMERGENCY ALERT from DoorCam System! Please check the live feed immediately."
             send_sms(owner_phone_number, message)
         
-        send_fcm("Emergency Alert", "Emergency button pressed on DoorCam system", {"type": "emergency"})
+        send_fcm(device_tokens.tokens(), "Emergency Alert", "Emergency button pressed on DoorCam system", {"type": "emergency"})
         
         log_event('emergency_alert', {
             'type': 'emergency_alert',
@@ -463,6 +774,48 @@ def phone_status():
         'twilio_from': TWILIO_FROM if TWILIO_FROM else None
     })
 
+@app.route('/logger_status')
+def logger_status():
+    return jsonify(get_log_stats())
+
+@app.route('/sensor_status')
+def sensor_status():
+    return jsonify(sensors.latency_stats())
+
+@app.route('/notification_status')
+def notification_status():
+    return jsonify(notifier.stats())
+
+@app.route('/audio_status')
+def audio_status():
+    return jsonify(audio_relay.stats())
+
+@app.route('/recognition_status')
+def recognition_status():
+    return jsonify(dict(recognition.stats(), gallery=face_rec.index.stats()))
+
+@app.route('/camera_status')
+def camera_status():
+    return jsonify({'cameras': cameras.stats(), 'clip_queue': clip_recorder.queue.qsize()})
+
+@app.route('/visitor_status')
+def visitor_status():
+    return jsonify(visitor_tracker.stats())
+
+@app.route('/webrtc_status')
+def webrtc_status():
+    webrtc = sys.modules.get('webrtc_server')
+    if not webrtc:
+        return jsonify({'active': 0, 'connections': {}})
+    try:
+        return jsonify({'active': webrtc.get_active_connections(), 'connections': webrtc.get_connection_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/test_sms', methods=['POST'])
 def test_sms():
     try:
@@ -483,62 +836,19 @@ def test_sms():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-def record_audio(duration=5):
-    try:
-        frames = []
-        stream = audio.open(format=FORMAT,
-                          channels=CHANNELS,
-                          rate=RATE,
-                          input=True,
-                          frames_per_buffer=CHUNK)
-        
-        print(f"Recording audio for {duration} seconds...")
-        
-        for i in range(0, int(RATE / CHUNK * duration)):
-            data = stream.read(CHUNK)
-            frames.append(data)
-        
-        stream.stop_stream()
-        stream.close()
-        
-        audio_data = io.BytesIO()
-        wf = wave.open(audio_data, 'wb')
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(audio.get_sample_size(FORMAT))
-        wf.setframerate(RATE)
-        wf.writeframes(b''.join(frames))
-        wf.close()
-        
-        audio_data.seek(0)
-        return audio_data.getvalue()
-        
-    except Exception as e:
-        print(f"Error recording audio: {e}")
-        return None
-
 @app.route('/record_audio', methods=['POST'])
 def record_audio_endpoint():
-    try:
-        audio_data = record_audio(5)
-        if audio_data:
-            filename = f"audio_recording_{int(time.time())}.wav"
-            audio_url = upload_audio_to_storage(audio_data, filename)
-            
-            if audio_url:
-                socketio.emit('audio_recorded', {
-                    'success': True,
-                    'audio_url': audio_url,
-                    'filename': filename,
-                    'timestamp': time.time()
-                })
-                return jsonify({'success': True, 'audio_url': audio_url})
-            else:
-                return jsonify({'success': False, 'error': 'Failed to upload audio'})
-        else:
-            return jsonify({'success': False, 'error': 'Failed to record audio'})
-    except Exception as e:
-        print(f"Error in record_audio_endpoint: {e}")
-        return jsonify({'success': False, 'error': str(e)})
+    if audio is None:
+        return jsonify({'success': False, 'error': 'Audio system not available'}), 503
+    job = recorder.submit(RECORD_SECONDS, prefix="audio_recording", origin='http')
+    return jsonify({'success': True, 'job_id': job.id, 'status': job.status}), 202
+
+@app.route('/record_audio/<job_id>')
+def record_audio_status(job_id):
+    job = recorder.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown recording job'}), 404
+    return jsonify(dict(job.to_dict(), success=job.status != 'failed'))
 
 if __name__ == '__main__':
     try:
@@ -549,8 +859,19 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"Application error: {e}")
     finally:
-        if cap:
-            cap.release()
+        clip_recorder.stop()
+        cameras.stop()
+        recognition.stop()
+        notifier.shutdown()
+        thumbnail_uploads.shutdown(wait=False)
+        audio_relay.stop()
+        recorder.stop()
+        importer.stop()
+        face_rec.flush_cache()
+        if 'webrtc_server' in sys.modules:
+            sys.modules['webrtc_server'].shutdown()
+        device_tokens.stop()
+        flush_events(2.0)
         if 'sensors' in locals():
             sensors.cleanup()
         print("Application shutdown complete")
@@ -0,0 +1,309 @@
+import collections
+import struct
+import threading
+import time
+import numpy as np
+import metrics
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+RELAY_RATE = 16000
+FRAME_MS = 20
+HEADER = struct.Struct("!BBHHHd")
+VERSION = 1
+CODEC_PCM16 = 0
+CODEC_MULAW = 1
+CODEC_OPUS = 2
+CODEC_NAMES = {CODEC_PCM16: "pcm16", CODEC_MULAW: "mulaw", CODEC_OPUS: "opus"}
+
+MULAW_BIAS = 0x84
+MULAW_BIAS_14 = 0x21
+MULAW_MAX_14 = 0x1FFF
+
+RELAY_LATENCY_SECONDS = metrics.histogram("doorcam_audio_relay_seconds", "Time from frame arrival to relay emit",
+                                          buckets=(0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.15, 0.25, 0.5, 1.0))
+RELAY_FRAMES = metrics.counter("doorcam_audio_frames_total", "Audio relay frames", ["direction"])
+RELAY_DROPPED = metrics.counter("doorcam_audio_dropped_total", "Audio frames dropped by the relay", ["reason"])
+RELAY_BYTES = metrics.counter("doorcam_audio_bytes_total", "Audio bytes sent to participants")
+
+def mulaw_encode(pcm):
+    x = np.frombuffer(pcm, dtype='<i2').astype(np.int32) >> 2
+    sign = (x < 0).astype(np.int32)
+    # Clamp after biasing so full-scale samples saturate at exponent 7 like audioop.lin2ulaw.
+    x = np.minimum(np.abs(x) + MULAW_BIAS_14, MULAW_MAX_14)
+    exponent = np.floor(np.log2(x)).astype(np.int32) - 5
+    mantissa = (x >> (exponent + 1)) & 0x0F
+    return (~((sign << 7) | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+def mulaw_decode(data):
+    u = ~np.frombuffer(data, dtype=np.uint8).astype(np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    x = ((((u & 0x0F) << 3) + MULAW_BIAS) << exponent) - MULAW_BIAS
+    return np.where(u & 0x80, -x, x).astype('<i2').tobytes()
+
+def resample(pcm, rate, target=RELAY_RATE):
+    if rate == target:
+        return pcm
+    x = np.frombuffer(pcm, dtype='<i2')
+    if len(x) == 0:
+        return b""
+    n = int(round(len(x) * target / rate))
+    t = np.linspace(0, len(x) - 1, n)
+    return np.interp(t, np.arange(len(x)), x).astype('<i2').tobytes()
+
+def pack_frame(codec, seq, rate, samples, payload, sent_at=None):
+    return HEADER.pack(VERSION, codec, seq & 0xFFFF, rate, samples,
+                       time.time() if sent_at is None else sent_at) + payload
+
+def unpack_frame(data):
+    if len(data) < HEADER.size:
+        raise ValueError("audio frame too short")
+    version, codec, seq, rate, samples, sent_at = HEADER.unpack_from(data)
+    if version != VERSION or codec not in CODEC_NAMES:
+        raise ValueError(f"unsupported audio frame v{version} codec {codec}")
+    return codec, seq, rate, samples, sent_at, bytes(data[HEADER.size:])
+
+class Frame:
+    __slots__ = ("data", "duration", "received_at", "legacy")
+
+    def __init__(self, data, duration, received_at, legacy=False):
+        self.data = data
+        self.duration = duration
+        self.received_at = received_at
+        self.legacy = legacy
+
+class JitterBuffer:
+    def __init__(self, target=0.06, max_depth=0.2):
+        self.target = target
+        self.max_depth = max_depth
+        self.frames = collections.deque()
+        self.depth = 0.0
+        self.next_due = None
+        self.dropped = 0
+
+    def push(self, frame, now):
+        self.frames.append(frame)
+        self.depth += frame.duration
+        while self.depth > self.max_depth and len(self.frames) > 1:
+            stale = self.frames.popleft()
+            self.depth -= stale.duration
+            self.dropped += 1
+            RELAY_DROPPED.labels("late").inc()
+        if self.next_due is None:
+            self.next_due = now + self.target
+
+    def pop_due(self, now):
+        out = []
+        while self.frames and self.next_due is not None and now >= self.next_due:
+            frame = self.frames.popleft()
+            self.depth -= frame.duration
+            out.append(frame)
+            self.next_due += frame.duration
+        if not self.frames:
+            if self.next_due is not None and now > self.next_due + self.target:
+                self.next_due = None
+            self.depth = 0.0
+        return out
+
+class Encoder:
+    def __init__(self, codec, rate=RELAY_RATE, frame_ms=FRAME_MS):
+        self.codec = codec
+        self.rate = rate
+        self.frame_samples = rate * frame_ms // 1000
+        self.pending = b""
+        self.seq = 0
+        self.opus = None
+        if codec == CODEC_OPUS:
+            self.opus = opuslib.Encoder(rate, 1, opuslib.APPLICATION_VOIP)
+
+    def encode(self, pcm, sent_at):
+        self.pending += pcm
+        chunk = self.frame_samples * 2
+        out = []
+        while len(self.pending) >= chunk:
+            block, self.pending = self.pending[:chunk], self.pending[chunk:]
+            if self.codec == CODEC_OPUS:
+                payload = self.opus.encode(block, self.frame_samples)
+            elif self.codec == CODEC_MULAW:
+                payload = mulaw_encode(block)
+            else:
+                payload = block
+            self.seq += 1
+            out.append(Frame(pack_frame(self.codec, self.seq, self.rate, self.frame_samples, payload, sent_at),
+                             self.frame_samples / self.rate, None))
+        return out
+
+class Participant:
+    def __init__(self, sid, room):
+        self.sid = sid
+        self.room = room
+        self.joined_at = time.monotonic()
+        self.frames_in = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.encoder = None
+        self.jitter = None
+        self.window = collections.deque(maxlen=100)
+
+    def throughput(self, now):
+        while self.window and now - self.window[0][0] > 5.0:
+            self.window.popleft()
+        if not self.window:
+            return 0.0
+        return sum(n for _, n in self.window) / max(now - self.window[0][0], 1.0)
+
+class AudioRelay(threading.Thread):
+    def __init__(self, send, backlog=None, codec=None, jitter_target=0.06, jitter_max=0.2,
+                 max_backlog=8, max_age=0.3):
+        super().__init__()
+        self.daemon = True
+        self.send = send
+        self.backlog = backlog
+        if codec is None:
+            codec = CODEC_OPUS if opuslib else CODEC_MULAW
+        self.codec = codec
+        self.jitter_target = jitter_target
+        self.jitter_max = jitter_max
+        self.max_backlog = max_backlog
+        self.max_age = max_age
+        self.cond = threading.Condition()
+        self.participants = {}
+        self.rooms = collections.defaultdict(set)
+        self.immediate = collections.deque()
+        self.running = False
+
+    def join(self, sid, room="door"):
+        with self.cond:
+            self._leave(sid)
+            participant = Participant(sid, room)
+            participant.jitter = JitterBuffer(self.jitter_target, self.jitter_max)
+            self.participants[sid] = participant
+            self.rooms[room].add(sid)
+        return participant
+
+    def leave(self, sid):
+        with self.cond:
+            self._leave(sid)
+
+    def _leave(self, sid):
+        participant = self.participants.pop(sid, None)
+        if participant:
+            members = self.rooms.get(participant.room)
+            if members is not None:
+                members.discard(sid)
+                if not members:
+                    del self.rooms[participant.room]
+
+    def publish(self, sid, data, room="door"):
+        now = time.monotonic()
+        with self.cond:
+            participant = self.participants.get(sid) or self.join(sid, room)
+        participant.frames_in += 1
+        RELAY_FRAMES.labels("in").inc()
+
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            frames = [Frame(data, 0.0, now, legacy=True)]
+        else:
+            try:
+                codec, seq, rate, samples, sent_at, payload = unpack_frame(data)
+            except (ValueError, struct.error) as e:
+                RELAY_DROPPED.labels("malformed").inc()
+                print(f"Audio relay: bad frame from {sid}: {e}")
+                return False
+            if codec == CODEC_PCM16 and self.codec != CODEC_PCM16:
+                if participant.encoder is None:
+                    participant.encoder = Encoder(self.codec)
+                frames = participant.encoder.encode(resample(payload, rate), sent_at)
+            else:
+                frames = [Frame(bytes(data), samples / float(rate or RELAY_RATE), None)]
+            for frame in frames:
+                frame.received_at = now
+
+        with self.cond:
+            for frame in frames:
+                if frame.legacy:
+                    self.immediate.append((participant, frame))
+                else:
+                    participant.jitter.push(frame, now)
+            self.cond.notify()
+        return True
+
+    def fan_out(self, sender, frame, now):
+        age = now - frame.received_at
+        with self.cond:
+            recipients = [self.participants[s] for s in self.rooms.get(sender.room, ()) if s != sender.sid
+                          and s in self.participants]
+        for participant in recipients:
+            if age > self.max_age:
+                participant.dropped += 1
+                RELAY_DROPPED.labels("stale").inc()
+                continue
+            if self.backlog and self.backlog(participant.sid) > self.max_backlog:
+                participant.dropped += 1
+                RELAY_DROPPED.labels("backpressure").inc()
+                continue
+            try:
+                self.send(participant.sid, frame.data)
+            except Exception as e:
+                participant.dropped += 1
+                RELAY_DROPPED.labels("error").inc()
+                print(f"Audio relay send error to {participant.sid}: {e}")
+                continue
+            size = len(frame.data) if isinstance(frame.data, (bytes, bytearray)) else 0
+            participant.frames_sent += 1
+            participant.bytes_sent += size
+            participant.window.append((now, size))
+            RELAY_FRAMES.labels("out").inc()
+            RELAY_BYTES.inc(size)
+        RELAY_LATENCY_SECONDS.observe(time.monotonic() - frame.received_at)
+
+    def run(self):
+        self.running = True
+        while self.running:
+            now = time.monotonic()
+            next_wake = None
+            with self.cond:
+                due = list(self.immediate)
+                self.immediate.clear()
+                for participant in list(self.participants.values()):
+                    buffer = participant.jitter
+                    for frame in buffer.pop_due(now):
+                        due.append((participant, frame))
+                    if buffer.frames and buffer.next_due is not None:
+                        next_wake = buffer.next_due if next_wake is None else min(next_wake, buffer.next_due)
+                if not due:
+                    timeout = None if next_wake is None else max(0.0, next_wake - now)
+                    self.cond.wait(timeout if timeout is not None else 1.0)
+                    continue
+            for participant, frame in due:
+                self.fan_out(participant, frame, time.monotonic())
+
+    def stats(self):
+        now = time.monotonic()
+        with self.cond:
+            participants = list(self.participants.values())
+            rooms = {room: sorted(members) for room, members in self.rooms.items()}
+        return {
+            "codec": CODEC_NAMES[self.codec],
+            "rooms": rooms,
+            "participants": {
+                p.sid: {
+                    "room": p.room,
+                    "frames_in": p.frames_in,
+                    "frames_sent": p.frames_sent,
+                    "bytes_sent": p.bytes_sent,
+                    "dropped": p.dropped,
+                    "jitter_dropped": p.jitter.dropped,
+                    "throughput_bps": p.throughput(now) * 8,
+                } for p in participants
+            },
+        }
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
@@ -0,0 +1,364 @@
+import argparse
+import collections
+import json
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from simulation import Simulation, LatencyProfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GALLERY = os.path.join(BASE_DIR, "templates", "known_faces")
+MOTION_SETTLE_SECONDS = 3.0
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    index = min(len(samples) - 1, max(0, math.ceil(q / 100.0 * len(samples)) - 1))
+    return samples[index]
+
+class StageRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(lambda: collections.defaultdict(list))
+        self.scenario = None
+        self.t0 = None
+        self.marks = {}
+        self.done = threading.Event()
+
+    def begin(self, scenario):
+        with self.lock:
+            self.scenario = scenario
+            self.t0 = time.perf_counter()
+            self.marks = {}
+            self.done.clear()
+        return self.t0
+
+    def add(self, stage, seconds):
+        with self.lock:
+            if self.scenario:
+                self.samples[self.scenario][stage].append(seconds)
+
+    def mark(self, name):
+        with self.lock:
+            if self.t0 is None or name in self.marks:
+                return
+            now = time.perf_counter()
+            self.marks[name] = now
+            if self.scenario:
+                self.samples[self.scenario][name].append(now - self.t0)
+
+    def timed(self, stage, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def report(self):
+        rows = []
+        for scenario, stages in self.samples.items():
+            for stage, values in stages.items():
+                rows.append({
+                    "scenario": scenario,
+                    "stage": stage,
+                    "count": len(values),
+                    "p50_ms": percentile(values, 50) * 1000,
+                    "p90_ms": percentile(values, 90) * 1000,
+                    "p99_ms": percentile(values, 99) * 1000,
+                    "max_ms": max(values) * 1000,
+                })
+        return rows
+
+def load_image(path):
+    import cv2
+    image = cv2.imread(path)
+    if image is None:
+        raise SystemExit(f"Could not read image: {path}")
+    return image
+
+def first_image(directory):
+    for root, _, files in sorted(os.walk(directory)):
+        for fn in sorted(files):
+            if fn.lower().endswith(('.jpg', '.jpeg', '.png')):
+                return os.path.join(root, fn)
+    return None
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.sim = Simulation(LatencyProfile(
+            firebase_write=args.firebase_latency, firebase_read=args.firebase_latency,
+            fcm=args.fcm_latency, sms=args.sms_latency, i2c_char=args.i2c_latency,
+            camera_fps=args.camera_fps))
+        self.recorder = StageRecorder()
+        self.channels_done = 0
+        self.alerts_running = 0
+
+    def boot(self):
+        self.sim.install()
+        os.environ["DOORCAM_GPIO"] = "sim"
+        os.environ["DOORCAM_SENSOR_MODE"] = self.args.sensor_mode
+        os.environ["DOORCAM_KNOWN_DIR"] = self.args.gallery
+        os.environ["DOORCAM_FACE_CACHE"] = os.path.join(tempfile.mkdtemp(prefix="doorcam-bench-"), "cache.npz")
+        if self.args.scenario == "motion":
+            os.environ["DOORCAM_MOTION_TRIGGER"] = "1"
+        os.environ.setdefault("TWILIO_SID", "ACbench")
+        os.environ.setdefault("TWILIO_TOKEN", "bench")
+        os.environ.setdefault("TWILIO_FROM", "+15550000000")
+
+        started = time.perf_counter()
+        import app
+        print(f"App booted in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        self.app = app
+        self.sensors = app.sensors
+        self.gpio = app.sensors.gpio
+        app.owner_phone_number = "+15550000001"
+
+        rec = self.recorder
+        app.sensors.alert_callback = self.wrap_alert(app.sensors.alert_callback)
+        hub = app.cameras.default.hub
+        hub.recent = rec.timed("capture", hub.recent)
+        finish = app.recognition.finish
+        def record_recognition(request, results, timing):
+            for stage in ("queue", "detect", "encode", "match"):
+                rec.add(f"recog:{stage}", timing[stage])
+            finish(request, results, timing)
+        app.recognition.finish = record_recognition
+
+        on_result = app.notifier.on_result
+        def record_notification(outcome, payload):
+            rec.add(f"notify:{outcome['channel']}", outcome['latency'])
+            if on_result:
+                on_result(outcome, payload)
+            with rec.lock:
+                self.channels_done += 1
+                finished = self.channels_done >= len(app.notifier.channels)
+            if finished:
+                rec.mark("notification")
+                rec.done.set()
+        app.notifier.on_result = record_notification
+
+        def on_relay(pin, value):
+            if value == self.gpio.HIGH:
+                rec.mark("unlock")
+                rec.done.set()
+        import sensors
+        self.gpio.on_output(sensors.RELAY_PIN, on_relay)
+        self.gpio.attach_ultrasonic(sensors.TRIG_PIN, sensors.ECHO_PIN)
+        self.pir_pin = sensors.PIR_PIN
+
+        if not hub.wait_next(0, timeout=5.0):
+            raise SystemExit("Simulated camera produced no frames")
+
+    def wrap_alert(self, callback):
+        rec = self.recorder
+        def wrapper(distance):
+            rec.mark("sensing")
+            with rec.lock:
+                self.alerts_running += 1
+            start = time.perf_counter()
+            try:
+                callback(distance)
+            finally:
+                rec.add("alert_callback", time.perf_counter() - start)
+                with rec.lock:
+                    self.alerts_running -= 1
+        return wrapper
+
+    def settle(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.sensors.monitoringActive and self.sensors.door_locked and not self.alerts_running:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def trigger(self, scenario, scene, distance, timeout=15.0):
+        if scene is None:
+            self.sim.camera.set_blank()
+        else:
+            self.sim.camera.set_scene(scene)
+        time.sleep(0.3)
+        self.channels_done = 0
+        self.sensors.last_pir_time = 0
+        self.sensors.last_alert_time = 0
+        self.app.visitor_tracker.clear()
+        self.gpio.ultrasonic_distance = distance
+        self.recorder.begin(scenario)
+        self.gpio.set_input(self.pir_pin, self.gpio.HIGH)
+        finished = self.recorder.done.wait(timeout)
+        if finished:
+            self.recorder.add("total", time.perf_counter() - self.recorder.t0)
+        else:
+            print(f"[{scenario}] no outcome within {timeout}s")
+        self.gpio.set_input(self.pir_pin, self.gpio.LOW)
+        self.gpio.ultrasonic_distance = None
+        self.settle()
+
+    def run_single(self, scenario, scene, runs):
+        self.sensors.alert_cooldown = self.args.alert_cooldown
+        self.sensors.pir_cooldown = self.args.pir_cooldown
+        print(f"Running {scenario} x{runs}")
+        for _ in range(runs):
+            self.trigger(scenario, scene, self.args.distance)
+
+    def run_rapid(self, scene, triggers, interval):
+        self.sensors.alert_cooldown = self.args.alert_cooldown
+        self.sensors.pir_cooldown = self.args.pir_cooldown
+        self.sensors.last_pir_time = 0
+        self.sensors.last_alert_time = 0
+        alerts_before = self.recorder.samples["rapid_repeat"]["alert_callback"][:]
+        print(f"Running rapid_repeat x{triggers} every {interval}s")
+        self.sim.camera.set_scene(scene)
+        time.sleep(0.3)
+        self.recorder.begin("rapid_repeat")
+        self.gpio.ultrasonic_distance = self.args.distance
+        for _ in range(triggers):
+            self.gpio.set_input(self.pir_pin, self.gpio.HIGH)
+            time.sleep(interval / 2)
+            self.gpio.set_input(self.pir_pin, self.gpio.LOW)
+            time.sleep(interval / 2)
+        self.gpio.ultrasonic_distance = None
+        self.settle(timeout=30.0)
+        fired = len(self.recorder.samples["rapid_repeat"]["alert_callback"]) - len(alerts_before)
+        print(f"rapid_repeat: {triggers} triggers -> {fired} recognition runs")
+        return {"triggers": triggers, "alerts": fired}
+
+    def run_motion(self, scene, runs, idle_seconds=5.0, timeout=15.0):
+        self.sensors.alert_cooldown = self.args.alert_cooldown
+        self.sim.camera.set_blank()
+        time.sleep(2.0)
+        cpu, wall = time.process_time(), time.perf_counter()
+        time.sleep(idle_seconds)
+        idle_cpu = (time.process_time() - cpu) / (time.perf_counter() - wall)
+        print(f"motion: idle process CPU {idle_cpu * 100:.1f}% of one core")
+        print(f"Running motion x{runs}")
+        for _ in range(runs):
+            self.sim.camera.set_blank()
+            time.sleep(MOTION_SETTLE_SECONDS)
+            self.sensors.last_alert_time = 0
+            self.app.visitor_tracker.clear()
+            self.recorder.begin("motion")
+            self.sim.camera.set_scene(scene)
+            if self.recorder.done.wait(timeout):
+                self.recorder.add("total", time.perf_counter() - self.recorder.t0)
+            else:
+                print(f"[motion] no outcome within {timeout}s")
+            self.settle()
+        return {"idle_cpu": idle_cpu}
+
+def print_report(rows):
+    print(f"{'scenario':<14} {'stage':<18} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in sorted(rows, key=lambda r: (r["scenario"], r["stage"])):
+        print(f"{row['scenario']:<14} {row['stage']:<18} {row['count']:>4} {row['p50_ms']:>9.1f} "
+              f"{row['p90_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+
+def synthetic_gallery(size, per_identity, rng):
+    import numpy as np
+    identities = max(1, size // per_identity)
+    centers = rng.normal(0.0, 0.06, (identities, 128)).astype(np.float32)
+    owners = np.arange(size) % identities
+    vectors = centers[owners] + rng.normal(0.0, 0.025, (size, 128)).astype(np.float32)
+    return vectors, [f"person{i}" for i in owners], centers
+
+def run_index_benchmark(sizes, probes, k, per_identity=4, seed=0):
+    import numpy as np
+    import gallery_index
+    rng = np.random.default_rng(seed)
+    rows = []
+    for size in sizes:
+        vectors, labels, centers = synthetic_gallery(size, per_identity, rng)
+        queries = centers[rng.integers(0, len(centers), probes)]
+        queries = queries + rng.normal(0.0, 0.025, queries.shape).astype(np.float32)
+        reference = gallery_index.BruteForceIndex()
+        for index in (reference, gallery_index.IVFIndex()):
+            start = time.perf_counter()
+            index.build(vectors, labels)
+            build = time.perf_counter() - start
+
+            # One enrollment publishes a copy of the index with the new encoding added.
+            start = time.perf_counter()
+            index.copy().add(vectors[:1], labels[:1])
+            update = time.perf_counter() - start
+
+            row = gallery_index.evaluate(index, reference, queries, k)
+            row.update({"build_ms": build * 1000, "update_ms": update * 1000, "stats": index.stats()})
+            rows.append(row)
+            print(f"{size:>8} {row['index']:<6} {row['recall']:>8.3f} {row['p50_ms']:>9.3f} {row['p99_ms']:>9.3f} "
+                  f"{row['build_ms']:>10.1f} {row['update_ms']:>10.4f}")
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end DoorCam latency benchmark on simulated hardware")
+    parser.add_argument("--gallery", default=os.environ.get("DOORCAM_KNOWN_DIR", DEFAULT_GALLERY),
+                        help="known_faces directory to enroll from")
+    parser.add_argument("--resident", help="image of an enrolled resident (default: first gallery image)")
+    parser.add_argument("--unknown", help="image of an unknown visitor (default: empty scene)")
+    parser.add_argument("--scenario", choices=["resident", "unknown", "rapid", "all", "index", "motion"], default="all")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--distance", type=float, default=30.0)
+    parser.add_argument("--rapid-triggers", type=int, default=10)
+    parser.add_argument("--rapid-interval", type=float, default=0.5)
+    parser.add_argument("--alert-cooldown", type=float, default=30)
+    parser.add_argument("--pir-cooldown", type=float, default=5)
+    parser.add_argument("--sensor-mode", choices=["event", "poll"], default="event")
+    parser.add_argument("--camera-fps", type=float, default=30.0)
+    parser.add_argument("--firebase-latency", type=float, default=0.05)
+    parser.add_argument("--fcm-latency", type=float, default=0.3)
+    parser.add_argument("--sms-latency", type=float, default=0.8)
+    parser.add_argument("--i2c-latency", type=float, default=0.0005)
+    parser.add_argument("--index-sizes", default="1000,10000,100000",
+                        help="gallery sizes for --scenario index")
+    parser.add_argument("--index-probes", type=int, default=500)
+    parser.add_argument("--index-k", type=int, default=1)
+    parser.add_argument("--json", help="write the per-stage results to this file")
+    args = parser.parse_args(argv)
+
+    if args.scenario == "index":
+        print(f"{'size':>8} {'index':<6} {'recall@' + str(args.index_k):>8} {'p50 ms':>9} {'p99 ms':>9} "
+              f"{'build ms':>10} {'update ms':>10}")
+        rows = run_index_benchmark([int(s) for s in args.index_sizes.split(",")], args.index_probes, args.index_k)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"index": rows}, f, indent=2)
+        return rows
+
+    resident_path = args.resident or first_image(args.gallery)
+    if args.scenario in ("resident", "rapid", "all", "motion") and not resident_path:
+        raise SystemExit("No resident image found; pass --resident or --gallery")
+
+    bench = Bench(args)
+    bench.boot()
+    resident = load_image(resident_path) if resident_path else None
+    unknown = load_image(args.unknown) if args.unknown else None
+
+    extra = {}
+    if args.scenario in ("resident", "all"):
+        bench.run_single("resident", resident, args.runs)
+    if args.scenario in ("unknown", "all"):
+        bench.run_single("unknown", unknown, args.runs)
+    if args.scenario in ("rapid", "all"):
+        extra["rapid_repeat"] = bench.run_rapid(resident, args.rapid_triggers, args.rapid_interval)
+    if args.scenario == "motion":
+        extra["motion"] = bench.run_motion(resident, args.runs)
+
+    bench.app.recognition.stop()
+    rows = bench.recorder.report()
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"stages": rows, "extra": extra}, f, indent=2)
+    return rows
+
+if __name__ == "__main__":
+    main()
+    sys.stdout.flush()
+    os._exit(0)
@@ -0,0 +1,193 @@
+import collections
+import threading
+import time
+import cv2
+import metrics
+
+CAMERA_READ_SECONDS = metrics.histogram("doorcam_camera_read_seconds", "Time spent in cap.read()", ["camera"])
+CAMERA_FRAMES = metrics.counter("doorcam_camera_frames_total", "Frames captured", ["camera"])
+CAMERA_FAILURES = metrics.counter("doorcam_camera_read_failures_total", "Failed cap.read() calls", ["camera"])
+MJPEG_ENCODE_SECONDS = metrics.histogram("doorcam_mjpeg_encode_seconds", "Time spent encoding one MJPEG frame", ["stream"])
+MJPEG_SUBSCRIBERS = metrics.gauge("doorcam_mjpeg_subscribers", "Connected MJPEG viewers", ["stream"])
+
+class FrameHub(threading.Thread):
+    def __init__(self, source=0, buffer_size=8, reopen_interval=2.0, max_failures=30, camera_id=None):
+        super().__init__()
+        self.daemon = True
+        self.source = source
+        self.camera_id = str(source) if camera_id is None else camera_id
+        self.frames = collections.deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.reopen_interval = reopen_interval
+        self.max_failures = max_failures
+        self.cap = None
+        self.running = False
+
+    def open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        self.cap = cap
+        return True
+
+    def is_opened(self):
+        return self.cap is not None
+
+    def run(self):
+        print(f"Camera {self.camera_id} capture running on source {self.source}")
+        self.running = True
+        failures = 0
+        read_seconds = CAMERA_READ_SECONDS.labels(self.camera_id)
+        frames_total = CAMERA_FRAMES.labels(self.camera_id)
+        failures_total = CAMERA_FAILURES.labels(self.camera_id)
+        while self.running:
+            if self.cap is None:
+                if not self.open():
+                    time.sleep(self.reopen_interval)
+                    continue
+                print(f"Camera {self.camera_id} opened")
+                failures = 0
+
+            start = time.perf_counter()
+            ok, frame = self.cap.read()
+            read_seconds.observe(time.perf_counter() - start)
+            if not ok:
+                failures_total.inc()
+                failures += 1
+                if failures >= self.max_failures:
+                    print(f"Camera {self.camera_id} stopped delivering frames, reopening")
+                    self.cap.release()
+                    self.cap = None
+                else:
+                    time.sleep(0.05)
+                continue
+
+            failures = 0
+            frames_total.inc()
+            frame.setflags(write=False)
+            with self.cond:
+                self.seq += 1
+                self.frames.append((self.seq, time.time(), frame))
+                self.cond.notify_all()
+
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def latest(self, max_age=None):
+        try:
+            item = self.frames[-1]
+        except IndexError:
+            return None
+        if max_age is not None and time.time() - item[1] > max_age:
+            return None
+        return item
+
+    def wait_next(self, after_seq=0, timeout=1.0):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > after_seq, timeout):
+                return None
+        return self.latest()
+
+    def recent(self, count=None, since=None):
+        items = list(self.frames)
+        if since is not None:
+            items = [item for item in items if item[1] >= since]
+        if count is not None:
+            items = items[-count:]
+        return items
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+class MjpegBroadcaster(threading.Thread):
+    def __init__(self, hub, fps=10, quality=75, width=None, label="DoorCam Live"):
+        super().__init__()
+        self.daemon = True
+        self.hub = hub
+        self.fps = fps
+        self.quality = quality
+        self.width = width
+        self.label = label
+        self.cond = threading.Condition()
+        self.chunk = None
+        self.seq = 0
+        self.subscribers = 0
+        self.encoded_frames = 0
+        self.running = False
+
+    def encode(self, frame):
+        if self.width and frame.shape[1] != self.width:
+            height = int(frame.shape[0] * self.width / frame.shape[1])
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        else:
+            frame = frame.copy()
+        if self.label:
+            cv2.putText(frame, self.label, (10,20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,255,0), 1)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(self.quality)])
+        if not ret:
+            return None
+        return (b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+    def run(self):
+        self.running = True
+        last_seq = 0
+        next_due = 0
+        while self.running:
+            if self.subscribers == 0:
+                with self.cond:
+                    self.cond.wait_for(lambda: self.subscribers > 0 or not self.running, 1.0)
+                continue
+
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            latest = self.hub.wait_next(last_seq, timeout=1.0)
+            if latest is None:
+                continue
+            last_seq, _, frame = latest
+            next_due = time.monotonic() + 1.0 / self.fps
+
+            try:
+                with MJPEG_ENCODE_SECONDS.labels(self.label).time():
+                    chunk = self.encode(frame)
+            except Exception as e:
+                print(f"MJPEG encode error: {e}")
+                continue
+            if chunk is None:
+                continue
+            with self.cond:
+                self.chunk = chunk
+                self.seq += 1
+                self.encoded_frames += 1
+                self.cond.notify_all()
+
+    def stream(self):
+        with self.cond:
+            self.subscribers += 1
+            self.cond.notify_all()
+        MJPEG_SUBSCRIBERS.labels(self.label).inc()
+        try:
+            last_seq = 0
+            while self.running:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.seq > last_seq or not self.running, 1.0):
+                        continue
+                    last_seq, chunk = self.seq, self.chunk
+                if chunk:
+                    yield chunk
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+            MJPEG_SUBSCRIBERS.labels(self.label).dec()
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
@@ -0,0 +1,129 @@
+import json
+import os
+from camera import FrameHub, MjpegBroadcaster
+from clips import PrerollBuffer
+from motion import MotionGate, MOTION_TRIGGER, parse_roi
+
+DEFAULT_TRIGGER = "door"
+
+def parse_source(value):
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return value
+
+class CameraConfig:
+    def __init__(self, id, source, triggers=(DEFAULT_TRIGGER,), label=None, preroll=True, motion=MOTION_TRIGGER,
+                 roi=None):
+        self.id = str(id)
+        self.source = parse_source(source)
+        self.triggers = tuple(triggers)
+        self.label = label or f"DoorCam {self.id}"
+        self.preroll = preroll
+        self.motion = motion
+        self.roi = parse_roi(roi)
+
+def load_camera_configs(spec=None, fallback_source=None):
+    spec = spec if spec is not None else os.environ.get("DOORCAM_CAMERAS", "")
+    spec = spec.strip()
+    if spec and os.path.isfile(spec):
+        with open(spec) as f:
+            spec = f.read().strip()
+
+    if not spec:
+        source = fallback_source if fallback_source is not None else os.environ.get("DOORCAM_CAMERA", "0")
+        return [CameraConfig("door", source, label="DoorCam Live")]
+
+    if spec.startswith("["):
+        entries = json.loads(spec)
+        configs = [CameraConfig(e["id"], e["source"], e.get("triggers", [DEFAULT_TRIGGER]), e.get("label"),
+                                e.get("preroll", True), e.get("motion", MOTION_TRIGGER), e.get("roi"))
+                   for e in entries]
+    else:
+        configs = []
+        for entry in filter(None, (e.strip() for e in spec.split(","))):
+            camera_id, _, source = entry.partition("=")
+            if not source:
+                camera_id, source = f"cam{len(configs)}", camera_id
+            configs.append(CameraConfig(camera_id, source))
+
+    ids = [c.id for c in configs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"duplicate camera ids in DOORCAM_CAMERAS: {ids}")
+    return configs
+
+class CameraRig:
+    def __init__(self, config, stream_fps=10, stream_quality=75, stream_width=None):
+        self.config = config
+        self.id = config.id
+        self.hub = FrameHub(config.source, camera_id=config.id)
+        self.broadcaster = MjpegBroadcaster(self.hub, fps=stream_fps, quality=stream_quality,
+                                            width=stream_width, label=config.label)
+        self.preroll = PrerollBuffer(self.hub) if config.preroll else None
+        self.motion = None
+
+    def start_motion(self, on_motion, busy=None):
+        self.motion = MotionGate(self, on_motion, busy=busy, roi=self.config.roi)
+        self.motion.start()
+
+    def start(self):
+        if not self.hub.open():
+            print(f"Warning: camera {self.id} ({self.config.source}) not detected")
+        self.hub.start()
+        self.broadcaster.start()
+        if self.preroll:
+            self.preroll.start()
+
+    def stats(self):
+        latest = self.hub.latest()
+        return {
+            "source": str(self.config.source),
+            "triggers": list(self.config.triggers),
+            "opened": self.hub.is_opened(),
+            "frames": self.hub.seq,
+            "last_frame": latest[1] if latest else None,
+            "viewers": self.broadcaster.subscribers,
+            "preroll": self.preroll.stats() if self.preroll else None,
+            "motion": self.motion.stats() if self.motion else None,
+        }
+
+    def stop(self):
+        if self.motion:
+            self.motion.stop()
+        self.broadcaster.stop()
+        if self.preroll:
+            self.preroll.stop()
+        self.hub.stop()
+
+class CameraManager:
+    def __init__(self, configs, **rig_options):
+        self.rigs = {}
+        for config in configs:
+            self.rigs[config.id] = CameraRig(config, **rig_options)
+        self.default = next(iter(self.rigs.values()))
+
+    def start(self):
+        for rig in self.rigs.values():
+            rig.start()
+        print(f"Cameras running: {', '.join(f'{r.id}={r.config.source}' for r in self.rigs.values())}")
+
+    def get(self, camera_id=None):
+        if camera_id is None:
+            return self.default
+        return self.rigs.get(camera_id)
+
+    def start_motion(self, on_motion, busy=None):
+        rigs = [rig for rig in self.rigs.values() if rig.config.motion]
+        for rig in rigs:
+            rig.start_motion(on_motion, busy)
+        if rigs:
+            print(f"Motion-gated recognition on: {', '.join(rig.id for rig in rigs)}")
+
+    def for_trigger(self, trigger):
+        return [rig for rig in self.rigs.values() if trigger in rig.config.triggers]
+
+    def stats(self):
+        return {rig.id: rig.stats() for rig in self.rigs.values()}
+
+    def stop(self):
+        for rig in self.rigs.values():
+            rig.stop()
@@ -0,0 +1,241 @@
+import collections
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+import metrics
+
+PREROLL_SECONDS = float(os.environ.get("PREROLL_SECONDS", 5.0))
+POSTROLL_SECONDS = float(os.environ.get("POSTROLL_SECONDS", 3.0))
+PREROLL_FPS = float(os.environ.get("PREROLL_FPS", 8))
+PREROLL_WIDTH = int(os.environ.get("PREROLL_WIDTH", 320))
+PREROLL_QUALITY = int(os.environ.get("PREROLL_QUALITY", 70))
+PREROLL_BUDGET = int(os.environ.get("PREROLL_BUDGET_BYTES", 4 * 1024 * 1024))
+CLIP_FOURCC = os.environ.get("CLIP_FOURCC", "mp4v")
+CLIP_QUEUE_SIZE = 4
+
+PREROLL_BYTES = metrics.gauge("doorcam_preroll_bytes", "JPEG bytes held in the pre-roll buffer", ["camera"])
+PREROLL_FRAMES = metrics.gauge("doorcam_preroll_frames", "Frames held in the pre-roll buffer", ["camera"])
+PREROLL_EVICTED = metrics.counter("doorcam_preroll_evicted_total", "Pre-roll frames evicted", ["camera", "reason"])
+CLIP_SECONDS = metrics.histogram("doorcam_clip_seconds", "Alert clip worker time by phase", ["phase"])
+CLIP_JOBS = metrics.counter("doorcam_clip_jobs_total", "Alert clips by outcome", ["status"])
+
+class PrerollBuffer(threading.Thread):
+    def __init__(self, hub, seconds=PREROLL_SECONDS, fps=PREROLL_FPS, width=PREROLL_WIDTH,
+                 quality=PREROLL_QUALITY, budget=PREROLL_BUDGET):
+        super().__init__()
+        self.daemon = True
+        self.hub = hub
+        self.seconds = seconds
+        self.fps = fps
+        self.width = width
+        self.quality = quality
+        self.budget = budget
+        self.frames = collections.deque()
+        self.bytes = 0
+        self.cond = threading.Condition()
+        self.running = False
+        camera = getattr(hub, "camera_id", "default")
+        self.bytes_gauge = PREROLL_BYTES.labels(camera)
+        self.frames_gauge = PREROLL_FRAMES.labels(camera)
+        self.evicted_age = PREROLL_EVICTED.labels(camera, "age")
+        self.evicted_budget = PREROLL_EVICTED.labels(camera, "budget")
+
+    def encode(self, frame):
+        if self.width and frame.shape[1] > self.width:
+            height = int(frame.shape[0] * self.width / frame.shape[1]) & ~1
+            frame = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        return buffer.tobytes() if ok else None
+
+    def add(self, timestamp, jpeg):
+        with self.cond:
+            self.frames.append((timestamp, jpeg))
+            self.bytes += len(jpeg)
+            while self.frames and timestamp - self.frames[0][0] > self.seconds:
+                self.bytes -= len(self.frames.popleft()[1])
+                self.evicted_age.inc()
+            while self.bytes > self.budget and len(self.frames) > 1:
+                self.bytes -= len(self.frames.popleft()[1])
+                self.evicted_budget.inc()
+            self.bytes_gauge.set(self.bytes)
+            self.frames_gauge.set(len(self.frames))
+            self.cond.notify_all()
+
+    def run(self):
+        self.running = True
+        last_seq = 0
+        next_due = 0
+        while self.running:
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            latest = self.hub.wait_next(last_seq, timeout=1.0)
+            if latest is None:
+                continue
+            last_seq, timestamp, frame = latest
+            next_due = time.monotonic() + 1.0 / self.fps
+            try:
+                jpeg = self.encode(frame)
+            except Exception as e:
+                print(f"Pre-roll encode error: {e}")
+                continue
+            if jpeg:
+                self.add(timestamp, jpeg)
+
+    def snapshot(self, since=None, until=None):
+        with self.cond:
+            items = list(self.frames)
+        return [(t, jpeg) for t, jpeg in items
+                if (since is None or t >= since) and (until is None or t <= until)]
+
+    def wait_until(self, timestamp, timeout):
+        with self.cond:
+            return self.cond.wait_for(
+                lambda: not self.running or (self.frames and self.frames[-1][0] >= timestamp), timeout)
+
+    def stats(self):
+        with self.cond:
+            span = self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0
+            return {"frames": len(self.frames), "bytes": self.bytes, "budget": self.budget,
+                    "seconds": round(span, 2)}
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+class ClipJob:
+    def __init__(self, preroll, trigger_at, pre_frames, event):
+        self.id = uuid.uuid4().hex[:12]
+        self.preroll = preroll
+        self.trigger_at = trigger_at
+        self.pre_frames = pre_frames
+        self.event = event
+
+class ClipRecorder(threading.Thread):
+    def __init__(self, preroll, upload, on_ready=None, post_roll=POSTROLL_SECONDS,
+                 fourcc=CLIP_FOURCC, maxsize=CLIP_QUEUE_SIZE):
+        super().__init__()
+        self.daemon = True
+        self.preroll = preroll
+        self.upload = upload
+        self.on_ready = on_ready
+        self.post_roll = post_roll
+        self.fourcc = fourcc
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.running = False
+
+    def mark(self, preroll=None):
+        preroll = preroll or self.preroll
+        if preroll is None:
+            return None
+        now = time.time()
+        return now, preroll.snapshot(until=now)
+
+    def capture(self, event=None, preroll=None, mark=None):
+        preroll = preroll or self.preroll
+        if preroll is None:
+            return None
+        trigger_at, pre_frames = mark or self.mark(preroll)
+        job = ClipJob(preroll, trigger_at, pre_frames, event or {})
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            CLIP_JOBS.labels("dropped").inc()
+            print("Clip queue full, skipping alert clip")
+            return None
+        return job.id
+
+    def writer(self, path, fourcc, size, fps):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            return writer
+        writer.release()
+        return None
+
+    def encode(self, frames, fps):
+        first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+        size = (first.shape[1], first.shape[0])
+        for fourcc, ext, content_type in ((self.fourcc, ".mp4", "video/mp4"), ("MJPG", ".avi", "video/x-msvideo")):
+            fd, path = tempfile.mkstemp(prefix="doorcam-clip-", suffix=ext)
+            os.close(fd)
+            writer = self.writer(path, fourcc, size, fps)
+            if writer is not None:
+                break
+            os.remove(path)
+        else:
+            raise RuntimeError("no usable video codec")
+
+        try:
+            for _, jpeg in frames:
+                frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                if frame is None:
+                    continue
+                if (frame.shape[1], frame.shape[0]) != size:
+                    frame = cv2.resize(frame, size)
+                writer.write(frame)
+        finally:
+            writer.release()
+        return path, ext, content_type
+
+    def process(self, job):
+        end = job.trigger_at + self.post_roll
+        job.preroll.wait_until(end, self.post_roll + 2.0)
+        frames = job.pre_frames + job.preroll.snapshot(since=job.trigger_at + 1e-6, until=end)
+        if not frames:
+            raise RuntimeError("no frames buffered")
+
+        start = time.perf_counter()
+        path, ext, content_type = self.encode(frames, job.preroll.fps)
+        CLIP_SECONDS.labels("encode").observe(time.perf_counter() - start)
+        try:
+            size = os.path.getsize(path)
+            filename = f"alert_{int(job.trigger_at)}_{job.id}{ext}"
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                url = self.upload(f, filename, content_type, size, folder="clips")
+            CLIP_SECONDS.labels("upload").observe(time.perf_counter() - start)
+        finally:
+            os.remove(path)
+        if not url:
+            raise RuntimeError("upload failed")
+        return {
+            "clip_id": job.id,
+            "url": url,
+            "filename": filename,
+            "frames": len(frames),
+            "pre_roll": round(job.trigger_at - frames[0][0], 2),
+            "post_roll": round(frames[-1][0] - job.trigger_at, 2),
+            "size": size,
+        }
+
+    def run(self):
+        self.running = True
+        while self.running:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                clip = self.process(job)
+            except Exception as e:
+                print(f"Alert clip {job.id} failed: {e}")
+                CLIP_JOBS.labels("failed").inc()
+                continue
+            CLIP_JOBS.labels("done").inc()
+            if self.on_ready:
+                try:
+                    self.on_ready(clip, job.event)
+                except Exception as e:
+                    print(f"Alert clip handler error: {e}")
+
+    def stop(self):
+        self.running = False
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
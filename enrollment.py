@@ -0,0 +1,384 @@
+import argparse
+import collections
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import cv2
+import face_recognition
+import numpy as np
+import metrics
+from face_recognizer import valid_name
+
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", os.cpu_count() or 1))
+IMPORT_MAX_SIDE = int(os.environ.get("IMPORT_MAX_SIDE", 1024))
+IMPORT_MIN_FACE = int(os.environ.get("IMPORT_MIN_FACE", 48))
+IMPORT_MIN_SHARPNESS = float(os.environ.get("IMPORT_MIN_SHARPNESS", 15.0))
+IMPORT_DUP_DISTANCE = float(os.environ.get("IMPORT_DUP_DISTANCE", 0.15))
+IMPORT_BATCH = 64
+SHARPNESS_SIZE = 128
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+START_METHOD = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+PUBLISH_INTERVAL = 0.5
+MAX_JOBS = 20
+
+IMPORT_IMAGES = metrics.counter("doorcam_import_images_total", "Bulk-imported images by outcome", ["outcome"])
+IMPORT_IMAGE_SECONDS = metrics.histogram("doorcam_import_image_seconds", "Worker time to decode, detect and encode one image")
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def safe_member(name):
+    parts = name.replace("\\", "/").split("/")
+    return not name.startswith(("/", "\\")) and ".." not in parts and not any(p.startswith(".") for p in parts if p)
+
+def extract_archive(path, dest):
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not safe_member(info.filename) or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                target = os.path.join(dest, *info.filename.replace("\\", "/").split("/"))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with zf.open(info) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+        return
+    with tarfile.open(path) as tf:
+        for member in tf:
+            if not member.isfile() or not safe_member(member.name) or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            target = os.path.join(dest, *member.name.split("/"))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with tf.extractfile(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+
+@contextlib.contextmanager
+def open_source(source):
+    if os.path.isdir(source):
+        yield source
+        return
+    if not os.path.isfile(source) or not is_archive(source):
+        raise ValueError(f"not a directory or supported archive: {source}")
+    tmp = tempfile.mkdtemp(prefix="doorcam-import-")
+    try:
+        extract_archive(source, tmp)
+        yield tmp
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def person_root(root):
+    while True:
+        entries = [e for e in os.listdir(root) if not e.startswith(".")]
+        dirs = [e for e in entries if os.path.isdir(os.path.join(root, e))]
+        if len(dirs) != 1 or len(entries) != 1:
+            return root
+        inner = os.path.join(root, dirs[0])
+        if not any(os.path.isdir(os.path.join(inner, e)) for e in os.listdir(inner)):
+            return root
+        root = inner
+
+def collect_images(root):
+    root = person_root(root)
+    images, loose = [], []
+    for entry in sorted(os.listdir(root)):
+        path = os.path.join(root, entry)
+        if entry.startswith("."):
+            continue
+        if os.path.isfile(path):
+            if entry.lower().endswith(IMAGE_EXTENSIONS):
+                loose.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for fn in sorted(filenames):
+                if fn.lower().endswith(IMAGE_EXTENSIONS) and not fn.startswith("."):
+                    images.append((entry, os.path.join(dirpath, fn)))
+    return images, loose
+
+def sharpness(image_rgb, location):
+    top, right, bottom, left = location
+    crop = image_rgb[top:bottom, left:right]
+    if crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(cv2.resize(crop, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA),
+                        cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+def analyze_image(path, max_side=IMPORT_MAX_SIDE, min_face=IMPORT_MIN_FACE, min_sharpness=IMPORT_MIN_SHARPNESS):
+    start = time.perf_counter()
+    result = {"status": "rejected", "reason": None, "encoding": None, "sharpness": None}
+    try:
+        image = face_recognition.load_image_file(path)
+    except Exception:
+        result["reason"] = "unreadable"
+        return dict(result, seconds=time.perf_counter() - start)
+
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / float(max(height, width)))
+    if scale < 1.0:
+        image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    locations = face_recognition.face_locations(image, model="hog")
+    if not locations:
+        result["reason"] = "no_face"
+    elif len(locations) > 1:
+        result["reason"] = "multiple_faces"
+    else:
+        top, right, bottom, left = locations[0]
+        result["sharpness"] = sharpness(image, locations[0])
+        if min(bottom - top, right - left) / scale < min_face:
+            result["reason"] = "face_too_small"
+        elif result["sharpness"] < min_sharpness:
+            result["reason"] = "blurry"
+        else:
+            encoding = face_recognition.face_encodings(image, locations)[0]
+            result.update(status="ok", encoding=np.asarray(encoding, dtype=np.float32).tolist())
+    return dict(result, seconds=time.perf_counter() - start)
+
+def analyze(images, workers=IMPORT_WORKERS):
+    if workers <= 0:
+        for name, path in images:
+            yield name, path, analyze_image(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD)) as pool:
+        futures = {pool.submit(analyze_image, path): (name, path) for name, path in images}
+        try:
+            for future in as_completed(futures):
+                name, path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"status": "rejected", "reason": "error", "error": str(e), "encoding": None}
+                yield name, path, result
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+class ImportJob:
+    def __init__(self, source, cleanup=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.cleanup = cleanup
+        self.status = "queued"
+        self.total = 0
+        self.processed = 0
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = collections.Counter()
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def progress(self):
+        return self.processed / self.total if self.total else 0.0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "total": self.total,
+            "processed": self.processed,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": dict(self.rejected),
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+class Enroller:
+    def __init__(self, face_rec, dup_distance=IMPORT_DUP_DISTANCE, batch_size=IMPORT_BATCH):
+        self.face_rec = face_rec
+        self.dup_distance = dup_distance
+        self.batch_size = batch_size
+        self.pending = []
+        self.seen = collections.defaultdict(list)
+
+    def offer(self, name, path, encoding):
+        encoding = np.asarray(encoding, dtype=np.float32)
+        known = [self.face_rec.gallery.encodings_for(name)] + [np.asarray(self.seen[name]).reshape(-1, len(encoding))]
+        known = np.vstack(known)
+        if len(known) and float(np.linalg.norm(known - encoding, axis=1).min()) < self.dup_distance:
+            return False
+        self.seen[name].append(encoding)
+        self.pending.append((name, path, encoding))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        return self.face_rec.add_encodings(pending) if pending else []
+
+def run_import(job, images, loose, results, enroller=None, on_progress=None):
+    job.total = len(images) + len(loose)
+    job.processed = len(loose)
+    if loose:
+        job.rejected["no_person_folder"] += len(loose)
+        IMPORT_IMAGES.labels("no_person_folder").inc(len(loose))
+    if on_progress:
+        on_progress(job)
+    last_publish = time.monotonic()
+    for name, path, result in results:
+        if result.get("seconds") is not None:
+            IMPORT_IMAGE_SECONDS.observe(result["seconds"])
+        if not valid_name(name):
+            outcome = "invalid_name"
+        elif result["status"] != "ok":
+            outcome = result["reason"]
+        elif enroller is None or enroller.offer(name, path, result["encoding"]):
+            outcome = "accepted"
+        else:
+            outcome = "duplicate"
+
+        job.processed += 1
+        if outcome == "accepted":
+            job.accepted += 1
+        elif outcome == "duplicate":
+            job.duplicates += 1
+        else:
+            job.rejected[outcome] += 1
+        IMPORT_IMAGES.labels(outcome).inc()
+        if on_progress and time.monotonic() - last_publish >= PUBLISH_INTERVAL:
+            last_publish = time.monotonic()
+            on_progress(job)
+    if enroller is not None:
+        enroller.flush()
+
+class BulkImporter(threading.Thread):
+    def __init__(self, face_rec, on_progress=None, workers=IMPORT_WORKERS, max_jobs=MAX_JOBS):
+        super().__init__()
+        self.daemon = True
+        self.face_rec = face_rec
+        self.on_progress = on_progress
+        self.workers = workers
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+        self.max_jobs = max_jobs
+        self.proc = None
+        self.running = False
+
+    def submit(self, source, cleanup=False):
+        job = ImportJob(source, cleanup)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self.queue.put(job)
+        self.publish(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def publish(self, job):
+        if self.on_progress:
+            try:
+                self.on_progress(job)
+            except Exception as e:
+                print(f"Import progress handler error: {e}")
+
+    def results(self, proc):
+        for line in proc.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            yield message["name"], message["path"], message["result"]
+
+    def run_job(self, job):
+        with open_source(job.source) as root:
+            images, loose = collect_images(root)
+            # Analysis runs in a separate interpreter so a dlib crash or a large import's memory stays out of the app.
+            self.proc = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--analyze-only", "--workers", str(self.workers), root],
+                stdout=subprocess.PIPE, text=True)
+            try:
+                run_import(job, images, loose, self.results(self.proc), Enroller(self.face_rec), self.publish)
+            finally:
+                self.proc.stdout.close()
+                returncode = self.proc.wait()
+                self.proc = None
+            if returncode != 0:
+                raise RuntimeError(f"analysis exited with status {returncode}")
+
+    def run(self):
+        self.running = True
+        while self.running:
+            job = self.queue.get()
+            if job is None:
+                break
+            job.status = "running"
+            self.publish(job)
+            start = time.perf_counter()
+            try:
+                self.run_job(job)
+                job.status = "done"
+            except Exception as e:
+                print(f"Face import {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished = time.time()
+                if job.cleanup:
+                    with contextlib.suppress(OSError):
+                        os.remove(job.source)
+            print(f"Face import {job.id} {job.status}: {job.accepted} accepted, {job.duplicates} duplicates, "
+                  f"{sum(job.rejected.values())} rejected in {time.perf_counter() - start:.1f}s")
+            self.publish(job)
+
+    def stop(self):
+        self.running = False
+        proc = self.proc
+        if proc is not None:
+            proc.kill()
+        self.queue.put(None)
+
+def print_progress(job):
+    print(f"Imported {job.processed}/{job.total}: {job.accepted} accepted, {job.duplicates} duplicates, "
+          f"{sum(job.rejected.values())} rejected", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-enroll faces from a known_faces-style directory tree or archive")
+    parser.add_argument("source", help="directory of <Name>/ folders, or a .zip/.tar(.gz) archive of one")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="analysis processes (0 = in-process)")
+    parser.add_argument("--dry-run", action="store_true", help="analyze and report without enrolling")
+    parser.add_argument("--analyze-only", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    with open_source(args.source) as root:
+        images, loose = collect_images(root)
+        if args.analyze_only:
+            for name, path, result in analyze(images, args.workers):
+                print(json.dumps({"name": name, "path": path, "result": result}), flush=True)
+            return
+
+        enroller = None
+        if not args.dry_run:
+            from face_recognizer import FaceRecognizer
+            enroller = Enroller(FaceRecognizer())
+        job = ImportJob(args.source)
+        start = time.perf_counter()
+        run_import(job, images, loose, analyze(images, args.workers), enroller, print_progress)
+        if enroller:
+            enroller.face_rec.flush_cache()
+        print_progress(job)
+        print(f"Done in {time.perf_counter() - start:.1f}s with {max(args.workers, 1)} worker(s); "
+              f"rejected: {dict(job.rejected) or 'none'}")
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,461 @@
 import os
+import io
+import bisect
+import shutil
+import time
+import threading
+import cv2
 import face_recognition
 import numpy as np
+import metrics
+from gallery_index import make_index, index_kind
 
-KNOWN_DIR = os.path.join(os.path.dirname(__file__), "known_faces")
+KNOWN_DIR = os.environ.get("DOORCAM_KNOWN_DIR", os.path.join(os.path.dirname(__file__), "known_faces"))
+CACHE_PATH = os.environ.get("DOORCAM_FACE_CACHE", os.path.join(os.path.dirname(__file__), "known_faces_cache.npz"))
+ENCODING_SIZE = 128
+MATCH_THRESHOLD = 0.5
+DETECT_SCALE = 0.5
+INDEX_NEIGHBOURS = 32
+CACHE_FLUSH_DELAY = float(os.environ.get("FACE_CACHE_FLUSH_DELAY", 5.0))
+
+FACE_DETECT_SECONDS = metrics.histogram("doorcam_face_detect_seconds", "Time spent in face_locations (HOG)")
+FACE_ENCODE_SECONDS = metrics.histogram("doorcam_face_encode_seconds", "Time spent in face_encodings")
+FACE_MATCH_SECONDS = metrics.histogram("doorcam_face_match_seconds", "Time spent matching probes against the gallery",
+                                       buckets=metrics.FAST_BUCKETS)
+GALLERY_ENCODINGS = metrics.gauge("doorcam_gallery_encodings", "Encodings in the active gallery")
+
+def detect_face_locations(frame_rgb, scale=DETECT_SCALE):
+    if not scale or scale >= 1:
+        return face_recognition.face_locations(frame_rgb, model="hog")
+
+    height, width = frame_rgb.shape[:2]
+    small = cv2.resize(frame_rgb, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small, model="hog"):
+        locations.append((max(0, int(top / scale)), min(width, int(right / scale)),
+                          min(height, int(bottom / scale)), max(0, int(left / scale))))
+    return locations
+
+def valid_name(name):
+    return bool(name) and os.path.basename(name) == name and not name.startswith('.')
+
+def face_quality(frame_rgb, location):
+    top, right, bottom, left = location
+    crop = frame_rgb[top:bottom, left:right]
+    if crop.size == 0:
+        return 0.0, 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    area = float((bottom - top) * (right - left))
+    return sharpness, area
+
+def same_visitor(a, b, threshold=MATCH_THRESHOLD):
+    if a["frame_index"] == b["frame_index"]:
+        return False
+    if a["name"] and b["name"]:
+        return a["name"] == b["name"]
+    diff = np.asarray(a["encoding"], dtype=np.float32) - np.asarray(b["encoding"], dtype=np.float32)
+    return float(np.sqrt(np.dot(diff, diff))) < threshold
+
+def merge_burst_results(results, threshold=MATCH_THRESHOLD):
+    # The best frames of a burst usually show the same visitors; keep each visitor's best-distance face once.
+    ranked = sorted(results, key=lambda r: (r["distance"] is None, r["distance"] or 0.0,
+                                            -r["sharpness"] * r["face_area"]))
+    merged = []
+    for result in ranked:
+        if not any(same_visitor(kept, result, threshold) for kept in merged):
+            merged.append(result)
+    return merged
+
+class Gallery:
+    def __init__(self, encodings=(), names=()):
+        names = list(names)
+        enc = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        order = sorted(range(len(names)), key=lambda i: names[i])
+        self.encodings = np.ascontiguousarray(enc[order])
+        self.encodings.setflags(write=False)
+        self.names = tuple(names[i] for i in order)
+        self.sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        if self.names:
+            identities, starts, counts = np.unique(np.array(self.names), return_index=True, return_counts=True)
+        else:
+            identities, starts, counts = np.array([], dtype=str), np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        self.identities = tuple(str(n) for n in identities)
+        self.starts = starts
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.names)
+
+    def encodings_for(self, name):
+        i = bisect.bisect_left(self.identities, name)
+        if i == len(self.identities) or self.identities[i] != name:
+            return self.encodings[:0]
+        return self.encodings[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def extended(self, encodings, names):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        return Gallery(np.vstack([self.encodings, encodings]), self.names + tuple(names))
+
+    def distances(self, probes):
+        probes = np.asarray(probes, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        p_sq = np.einsum('ij,ij->i', probes, probes)
+        d2 = p_sq[:, None] + self.sq_norms[None, :] - 2.0 * (probes @ self.encodings.T)
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def identity_distances(self, probes, aggregate="min"):
+        d = self.distances(probes)
+        if aggregate == "mean":
+            return np.add.reduceat(d, self.starts, axis=1) / self.counts[None, :]
+        if aggregate == "min":
+            return np.minimum.reduceat(d, self.starts, axis=1)
+        raise ValueError(f"unknown aggregate: {aggregate}")
 
 class FaceRecognizer:
-    def __init__(self):
-        self.known_encodings = []
-        self.known_names = []
+    def __init__(self, cache_path=CACHE_PATH):
+        self._snapshot = (Gallery(), make_index(size=0))
+        self.cache_path = cache_path
+        self._cache_entries = {}
+        self._cache_timer = None
+        self._retraining = False
+        self._write_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
         self.load_known_faces()
 
+    @property
+    def gallery(self):
+        return self._snapshot[0]
+
+    @property
+    def index(self):
+        return self._snapshot[1]
+
+    @property
+    def known_encodings(self):
+        return list(self.gallery.encodings)
+
+    @property
+    def known_names(self):
+        return list(self.gallery.names)
+
+    def _load_cache(self):
+        entries = {}
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return entries
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                rows = zip(data["paths"], data["sizes"], data["mtimes"],
+                           data["names"], data["has_face"], data["encodings"])
+                for path, size, mtime, name, has_face, enc in rows:
+                    entries[str(path)] = (int(size), int(mtime), str(name), bool(has_face), enc)
+        except Exception as e:
+            print("Error reading face cache:", e)
+            return {}
+        return entries
+
+    def _save_cache(self, entries):
+        if not self.cache_path:
+            return
+        with self._cache_lock:
+            self._write_cache(entries)
+
+    def _write_cache(self, entries):
+        keys = sorted(entries)
+        encodings = np.zeros((len(keys), ENCODING_SIZE), dtype=np.float32)
+        for i, key in enumerate(keys):
+            encodings[i] = entries[key][4]
+        tmp_path = self.cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f,
+                         paths=np.array(keys, dtype=str),
+                         sizes=np.array([entries[k][0] for k in keys], dtype=np.int64),
+                         mtimes=np.array([entries[k][1] for k in keys], dtype=np.int64),
+                         names=np.array([entries[k][2] for k in keys], dtype=str),
+                         has_face=np.array([entries[k][3] for k in keys], dtype=bool),
+                         encodings=encodings)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            print("Error writing face cache:", e)
+
+    def _schedule_cache_save(self):
+        # Enrollments within CACHE_FLUSH_DELAY share one rewrite of the .npz instead of one each.
+        if self._cache_timer is None and self.cache_path:
+            self._cache_timer = threading.Timer(CACHE_FLUSH_DELAY, self.flush_cache)
+            self._cache_timer.daemon = True
+            self._cache_timer.start()
+
+    def flush_cache(self):
+        with self._write_lock:
+            timer, self._cache_timer = self._cache_timer, None
+            if timer is None:
+                return
+            timer.cancel()
+            entries = dict(self._cache_entries)
+        self._save_cache(entries)
+
+    def _encode_file(self, path):
+        img = face_recognition.load_image_file(path)
+        encs = face_recognition.face_encodings(img)
+        if len(encs) == 0:
+            return False, np.zeros(ENCODING_SIZE, dtype=np.float32)
+        return True, np.asarray(encs[0], dtype=np.float32)
+
     def load_known_faces(self):
+        with self._write_lock:
+            self._load_known_faces()
+
+    def _load_known_faces(self):
         print("Loading known faces...")
-        self.known_encodings = []
-        self.known_names = []
-        
+        known_encodings = []
+        known_names = []
+
         if not os.path.exists(KNOWN_DIR):
             os.makedirs(KNOWN_DIR)
+            self._cache_entries = {}
+            self._publish(Gallery())
             print("No known faces yet. Add images under known_faces/<Name>/")
             return
-            
-        for person_name in os.listdir(KNOWN_DIR):
+
+        cache = self._load_cache()
+        entries = {}
+        encoded = 0
+
+        for person_name in sorted(os.listdir(KNOWN_DIR)):
             person_dir = os.path.join(KNOWN_DIR, person_name)
             if not os.path.isdir(person_dir):
                 continue
-            for fn in os.listdir(person_dir):
+            for fn in sorted(os.listdir(person_dir)):
                 if not fn.lower().endswith(('.jpg', '.jpeg', '.png')):
                     continue
                 path = os.path.join(person_dir, fn)
+                key = os.path.join(person_name, fn)
                 try:
-                    img = face_recognition.load_image_file(path)
-                    encs = face_recognition.face_encodings(img)
-                    if len(encs) > 0:
-                        self.known_encodings.append(encs[0])
-                        self.known_names.append(person_name)
-                        print("Loaded", person_name, fn)
+                    st = os.stat(path)
+                    entry = cache.get(key)
+                    if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+                        has_face, enc = self._encode_file(path)
+                        entry = (st.st_size, st.st_mtime_ns, person_name, has_face, enc)
+                        encoded += 1
+                        if has_face:
+                            print("Loaded", person_name, fn)
+                    entries[key] = entry
+                    if entry[3]:
+                        known_encodings.append(entry[4])
+                        known_names.append(person_name)
                 except Exception as e:
                     print("Error loading", path, e)
 
-    def recognize(self, frame_rgb):
-        face_locations = face_recognition.face_locations(frame_rgb, model="hog")
-        
+        evicted = len(set(cache) - set(entries))
+        if self.cache_path and (encoded or evicted or not os.path.exists(self.cache_path)):
+            self._save_cache(entries)
+
+        self._cache_entries = entries
+        self._publish(Gallery(known_encodings, known_names))
+        GALLERY_ENCODINGS.set(len(self.gallery))
+        print(f"Known faces ready: {len(known_names)} encodings "
+              f"({encoded} encoded, {len(entries) - encoded} cached, {evicted} evicted, {self.index.kind} index)")
+
+    @staticmethod
+    def _build_index(gallery):
+        index = make_index(size=len(gallery))
+        index.build(gallery.encodings, gallery.names)
+        return index
+
+    def _publish(self, gallery, index=None):
+        # Readers take the (gallery, index) pair with one reference read; a published pair is never mutated.
+        if index is None:
+            index = self._build_index(gallery)
+        self._snapshot = (gallery, index)
+
+    def add_face(self, name, image_bytes):
+        if not valid_name(name):
+            raise ValueError("invalid name")
+
+        try:
+            img = face_recognition.load_image_file(io.BytesIO(image_bytes))
+        except Exception as e:
+            raise ValueError(f"could not decode image: {e}")
+        locations = face_recognition.face_locations(img, model="hog")
+        if len(locations) == 0:
+            raise ValueError("no face found in image")
+        if len(locations) > 1:
+            raise ValueError(f"expected one face, found {len(locations)}")
+        enc = np.asarray(face_recognition.face_encodings(img, locations)[0], dtype=np.float32)
+
+        with self._write_lock:
+            person_dir = os.path.join(KNOWN_DIR, name)
+            os.makedirs(person_dir, exist_ok=True)
+            fn = f"{int(time.time() * 1000)}.jpg"
+            path = os.path.join(person_dir, fn)
+            with open(path, 'wb') as f:
+                f.write(image_bytes)
+            self._commit([(name, fn, enc)])
+
+        print("Enrolled", name, fn)
+        return path
+
+    def add_encodings(self, faces):
+        added = []
+        with self._write_lock:
+            for name, source_path, enc in faces:
+                if not valid_name(name):
+                    raise ValueError(f"invalid name: {name!r}")
+                person_dir = os.path.join(KNOWN_DIR, name)
+                os.makedirs(person_dir, exist_ok=True)
+                stem, ext = os.path.splitext(os.path.basename(source_path))
+                fn, n = stem + ext.lower(), 1
+                while os.path.exists(os.path.join(person_dir, fn)):
+                    fn, n = f"{stem}_{n}{ext.lower()}", n + 1
+                shutil.copyfile(source_path, os.path.join(person_dir, fn))
+                added.append((name, fn, np.asarray(enc, dtype=np.float32)))
+            if added:
+                self._commit(added)
+        return [os.path.join(KNOWN_DIR, name, fn) for name, fn, _ in added]
+
+    def _commit(self, added):
+        for name, fn, enc in added:
+            st = os.stat(os.path.join(KNOWN_DIR, name, fn))
+            self._cache_entries[os.path.join(name, fn)] = (st.st_size, st.st_mtime_ns, name, True, enc)
+        self._schedule_cache_save()
+        encodings = [enc for _, _, enc in added]
+        names = [name for name, _, _ in added]
+        gallery, index = self._snapshot
+        gallery = gallery.extended(encodings, names)
+        if index_kind(len(gallery)) != index.kind:
+            self._publish(gallery)
+        else:
+            index = index.copy()
+            index.add(encodings, names)
+            self._publish(gallery, index)
+            if index.needs_training() and not self._retraining:
+                self._retraining = True
+                threading.Thread(target=self._retrain, daemon=True).start()
+        GALLERY_ENCODINGS.set(len(gallery))
+
+    def _retrain(self):
+        # k-means runs on a copy; matching keeps using the published index until the swap.
+        with self._write_lock:
+            try:
+                gallery, index = self._snapshot
+                if index.needs_training():
+                    index = index.copy()
+                    index.train()
+                    self._publish(gallery, index)
+            finally:
+                self._retraining = False
+
+    def match(self, encodings, aggregate="min", top_k=3, threshold=MATCH_THRESHOLD):
+        with FACE_MATCH_SECONDS.time():
+            return self._match(encodings, aggregate, top_k, threshold)
+
+    def _match(self, encodings, aggregate, top_k, threshold):
+        probes = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        if len(probes) == 0:
+            return []
+        gallery, index = self._snapshot
+        if len(gallery) and aggregate == "min" and index.approximate:
+            return self._match_index(index, probes, top_k, threshold)
+        if len(gallery) == 0:
+            return [{"name": None, "distance": None, "candidates": []} for _ in range(len(probes))]
+
+        per_identity = gallery.identity_distances(probes, aggregate)
+        k = min(top_k, per_identity.shape[1])
+        if k < per_identity.shape[1]:
+            top = np.argpartition(per_identity, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(k), (len(probes), k))
+        top_dist = np.take_along_axis(per_identity, top, axis=1)
+        order = np.argsort(top_dist, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_dist = np.take_along_axis(top_dist, order, axis=1)
+
+        results = []
+        for idx, dist in zip(top, top_dist):
+            candidates = [(gallery.identities[i], float(d)) for i, d in zip(idx, dist)]
+            best_name, best_distance = candidates[0]
+            results.append({
+                "name": best_name if best_distance < threshold else None,
+                "distance": best_distance,
+                "candidates": candidates,
+            })
+        return results
+
+    def _match_index(self, index, probes, top_k, threshold):
+        distances, ids = index.search(probes, max(INDEX_NEIGHBOURS, top_k))
+        results = []
+        for row_dist, row_ids in zip(distances, ids):
+            best = {}
+            for id, d in zip(row_ids.tolist(), row_dist.tolist()):
+                name = index.label(id) if id >= 0 else None
+                if name is not None and name not in best:
+                    best[name] = d
+            candidates = list(best.items())[:top_k]
+            if not candidates:
+                results.append({"name": None, "distance": None, "candidates": []})
+                continue
+            best_name, best_distance = candidates[0]
+            results.append({
+                "name": best_name if best_distance < threshold else None,
+                "distance": best_distance,
+                "candidates": candidates,
+            })
+        return results
+
+    def detect_faces(self, frame_rgb, scale=DETECT_SCALE):
+        with FACE_DETECT_SECONDS.time():
+            return self._detect_faces(frame_rgb, scale)
+
+    def _detect_faces(self, frame_rgb, scale):
+        return detect_face_locations(frame_rgb, scale)
+
+    @staticmethod
+    def face_quality(frame_rgb, location):
+        return face_quality(frame_rgb, location)
+
+    def recognize_faces(self, frame_rgb, aggregate="min", top_k=3, scale=None):
+        face_locations = self.detect_faces(frame_rgb, scale)
         if len(face_locations) == 0:
+            return []
+
+        with FACE_ENCODE_SECONDS.time():
+            encodings = face_recognition.face_encodings(frame_rgb, face_locations)
+        results = self.match(encodings, aggregate=aggregate, top_k=top_k)
+        for location, encoding, result in zip(face_locations, encodings, results):
+            result.update({"location": location, "encoding": encoding})
+        return results
+
+    def recognize_burst(self, frames_rgb, best_n=2, scale=DETECT_SCALE, aggregate="min", top_k=3):
+        candidates = []
+        for index, frame_rgb in enumerate(frames_rgb):
+            locations = self.detect_faces(frame_rgb, scale)
+            if not locations:
+                continue
+            qualities = [self.face_quality(frame_rgb, loc) for loc in locations]
+            score = max(sharpness * area for sharpness, area in qualities)
+            candidates.append((score, index, locations, qualities))
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        results = []
+        for score, index, locations, qualities in candidates[:best_n]:
+            with FACE_ENCODE_SECONDS.time():
+                encodings = face_recognition.face_encodings(frames_rgb[index], locations)
+            matched = self.match(encodings, aggregate=aggregate, top_k=top_k)
+            for location, encoding, (sharpness, area), result in zip(locations, encodings, qualities, matched):
+                result.update({"location": location, "encoding": encoding, "frame_index": index,
+                               "sharpness": sharpness, "face_area": area})
+                results.append(result)
+        return merge_burst_results(results)
+
+    @staticmethod
+    def best_result(results):
+        scored = [r for r in results if r["distance"] is not None]
+        if not scored:
             return None, None
-            
-        if len(self.known_encodings) == 0:
-            return None, None
-        
-        encodings = face_recognition.face_encodings(frame_rgb, face_locations)
-        
-        for face_encoding in encodings:
-            distances = face_recognition.face_distance(self.known_encodings, face_encoding)
-            best_idx = np.argmin(distances)
-            best_distance = float(distances[best_idx])
-            
-            if best_distance < 0.5:
-                return self.known_names[best_idx], best_distance
-            else:
-                return None, best_distance
-        
-        return None, None
+        recognized = [r for r in scored if r["name"]]
+        best = min(recognized or scored, key=lambda r: r["distance"])
+        return best["name"], best["distance"]
+
+    def recognize(self, frame_rgb):
+        return self.best_result(self.recognize_faces(frame_rgb))
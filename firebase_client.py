@@ -3,9 +3,230 @@ from firebase_admin import credentials, auth, db, messaging, storage
 import os
 import time
 import base64
+import collections
+import datetime
+import hashlib
+import json
+import queue
+import random
+import threading
+import metrics
 
 _firebase_app = None
 
+LOG_PATH = "/doorcam/logs"
+LOG_QUEUE_SIZE = 1000
+LOG_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL = 1.0
+LOG_RETRY_INTERVAL = 30.0
+SPOOL_PATH = os.path.join(os.path.dirname(__file__), "event_spool.jsonl")
+SPOOL_MAX_BYTES = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 256 * 1024
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 512))
+SESSION_DURATION = int(os.environ.get("SESSION_DURATION", 5 * 24 * 3600))
+
+LOG_EVENT_SECONDS = metrics.histogram("doorcam_log_event_seconds", "Time log_event() blocks the caller",
+                                      buckets=metrics.FAST_BUCKETS)
+LOG_BATCH_SECONDS = metrics.histogram("doorcam_log_batch_write_seconds", "Time to write one event batch to Firebase")
+LOG_EVENTS = metrics.gauge("doorcam_log_events", "Event writer counters", ["state"])
+FCM_SEND_SECONDS = metrics.histogram("doorcam_fcm_send_seconds", "Time spent in send_fcm", ["status"])
+TOKEN_VERIFY_SECONDS = metrics.histogram("doorcam_token_verify_seconds", "Firebase token verification time by kind",
+                                         ["kind"], buckets=metrics.FAST_BUCKETS)
+TOKEN_CACHE_LOOKUPS = metrics.counter("doorcam_token_cache_lookups_total", "Token cache lookups", ["kind", "result"])
+UPLOAD_SECONDS = metrics.histogram("doorcam_storage_upload_seconds", "Time to upload a file to Firebase Storage")
+
+PUSH_CHARS = "-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+_push_lock = threading.Lock()
+_last_push_ms = 0
+_last_rand = []
+
+def make_push_id(timestamp=None):
+    global _last_push_ms, _last_rand
+    now_ms = int((timestamp if timestamp is not None else time.time()) * 1000)
+    with _push_lock:
+        if now_ms <= _last_push_ms and _last_rand:
+            now_ms = _last_push_ms
+            for i in range(11, -1, -1):
+                if _last_rand[i] != 63:
+                    _last_rand[i] += 1
+                    break
+                _last_rand[i] = 0
+        else:
+            _last_rand = [random.randrange(64) for _ in range(12)]
+        _last_push_ms = now_ms
+        rand = list(_last_rand)
+
+    ts_chars = []
+    for _ in range(8):
+        ts_chars.append(PUSH_CHARS[now_ms % 64])
+        now_ms //= 64
+    return "".join(reversed(ts_chars)) + "".join(PUSH_CHARS[r] for r in rand)
+
+class EventWriter(threading.Thread):
+    def __init__(self, path=LOG_PATH, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, retry_interval=LOG_RETRY_INTERVAL,
+                 spool_path=SPOOL_PATH, spool_max_bytes=SPOOL_MAX_BYTES):
+        super().__init__()
+        self.daemon = True
+        self.path = path
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+        self.online = True
+        self.retry_at = 0
+        self.stats_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.failures = 0
+
+    def enqueue(self, event, data=None):
+        record = {"event": event, "data": data, "timestamp": time.time()}
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped += 1
+            return False
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "dropped": self.dropped,
+                "written": self.written,
+                "spooled": self.spooled,
+                "replayed": self.replayed,
+                "failures": self.failures,
+                "online": self.online,
+                "spool_bytes": self.spool_size(),
+            }
+
+    def spool_size(self):
+        try:
+            return os.path.getsize(self.spool_path)
+        except OSError:
+            return 0
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, records):
+        updates = {make_push_id(r["timestamp"]): r for r in records}
+        with LOG_BATCH_SECONDS.time():
+            db.reference(self.path).update(json.loads(json.dumps(updates, default=str)))
+
+    def spool(self, records):
+        lines = "".join(json.dumps(r, default=str) + "\n" for r in records)
+        if self.spool_size() + len(lines) > self.spool_max_bytes:
+            with self.stats_lock:
+                self.dropped += len(records)
+            return
+        try:
+            with open(self.spool_path, "a") as f:
+                f.write(lines)
+            with self.stats_lock:
+                self.spooled += len(records)
+        except Exception as e:
+            print("Event spool error:", e)
+            with self.stats_lock:
+                self.dropped += len(records)
+
+    def replay_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        records = []
+        with open(self.spool_path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        sent = 0
+        try:
+            while sent < len(records):
+                chunk = records[sent:sent + self.batch_size]
+                self.write(chunk)
+                sent += len(chunk)
+        finally:
+            remaining = records[sent:]
+            if remaining:
+                tmp_path = self.spool_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.writelines(json.dumps(r, default=str) + "\n" for r in remaining)
+                os.replace(tmp_path, self.spool_path)
+            else:
+                os.remove(self.spool_path)
+            with self.stats_lock:
+                self.replayed += sent
+        if sent:
+            print(f"Replayed {sent} spooled events")
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if not self.online and time.time() >= self.retry_at:
+                try:
+                    self.replay_spool()
+                    self.online = True
+                except Exception as e:
+                    print("Firebase still unreachable:", e)
+                    self.retry_at = time.time() + self.retry_interval
+            if batch:
+                if self.online:
+                    try:
+                        self.write(batch)
+                        with self.stats_lock:
+                            self.written += len(batch)
+                    except Exception as e:
+                        print("Firebase log error, spooling events:", e)
+                        with self.stats_lock:
+                            self.failures += 1
+                        self.online = False
+                        self.retry_at = time.time() + self.retry_interval
+                        self.spool(batch)
+                else:
+                    self.spool(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self, timeout=5.0):
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return self.queue.unfinished_tasks == 0
+
+_event_writer = None
+_event_writer_lock = threading.Lock()
+
+def get_event_writer():
+    global _event_writer
+    if _event_writer is None:
+        with _event_writer_lock:
+            if _event_writer is None:
+                writer = EventWriter()
+                if os.path.exists(writer.spool_path):
+                    writer.online = False
+                writer.start()
+                _event_writer = writer
+    return _event_writer
+
 def init_firebase():
     global _firebase_app
     if _firebase_app: return _firebase_app
@@ -20,22 +241,166 @@ def init_firebase():
     })
     return _firebase_app
 
-def verify_firebase_token(token):
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token, now=None):
+        now = time.time() if now is None else now
+        key = self.key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, token, claims):
+        exp = claims.get("exp") if isinstance(claims, dict) else None
+        if not exp or exp <= time.time():
+            return
+        key = self.key(token)
+        with self.lock:
+            self.entries[key] = (float(exp), claims)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, token):
+        with self.lock:
+            self.entries.pop(self.key(token), None)
+
+    def __len__(self):
+        return len(self.entries)
+
+_token_cache = TokenCache()
+
+def _verify_cached(token, kind, verify):
+    if not token:
+        return None
+    claims = _token_cache.get(token)
+    if claims is not None:
+        TOKEN_CACHE_LOOKUPS.labels(kind, "hit").inc()
+        return claims
+    TOKEN_CACHE_LOOKUPS.labels(kind, "miss").inc()
     try:
-        decoded = auth.verify_id_token(token)
-        return decoded
+        with TOKEN_VERIFY_SECONDS.labels(kind).time():
+            claims = verify(token)
     except Exception as e:
-        print("Invalid Firebase token:", e)
+        print(f"Invalid Firebase {kind.replace('_', ' ')}:", e)
         return None
+    _token_cache.put(token, claims)
+    return claims
 
-def log_event(event, data=None):
+def verify_firebase_token(token):
+    return _verify_cached(token, "id_token", auth.verify_id_token)
+
+def verify_session_cookie(cookie):
+    return _verify_cached(cookie, "session", auth.verify_session_cookie)
+
+def create_session_cookie(id_token, expires_in=SESSION_DURATION):
     try:
-        ref = db.reference("/doorcam/logs")
-        ref.push({"event": event, "data": data, "timestamp": time.time()})
+        return auth.create_session_cookie(id_token, expires_in=datetime.timedelta(seconds=expires_in))
     except Exception as e:
-        print("Firebase log error:", e)
+        print("Error creating session cookie:", e)
+        return None
+
+def forget_token(token):
+    if token:
+        _token_cache.invalidate(token)
+
+def log_event(event, data=None):
+    with LOG_EVENT_SECONDS.time():
+        return get_event_writer().enqueue(event, data)
+
+def get_log_stats():
+    return get_event_writer().stats()
+
+def flush_events(timeout=5.0):
+    return get_event_writer().flush(timeout)
+
+def collect_log_metrics():
+    if _event_writer is None:
+        return
+    for state, value in _event_writer.stats().items():
+        if not isinstance(value, bool):
+            LOG_EVENTS.labels(state).set(value)
+
+metrics.add_collector(collect_log_metrics)
+
+class DeviceTokenCache:
+    def __init__(self, path="/doorcam/device_tokens", refresh_interval=300.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.loaded_at = 0
+        self.listener = None
+
+    def start(self):
+        try:
+            self.refresh()
+            self.listener = db.reference(self.path).listen(self.on_change)
+            print("Device token listener started")
+        except Exception as e:
+            print("Device token listener unavailable:", e)
+
+    def refresh(self):
+        self.replace(db.reference(self.path).get())
+
+    def replace(self, value):
+        if isinstance(value, dict):
+            entries = dict(value)
+        elif isinstance(value, list):
+            entries = {str(i): v for i, v in enumerate(value) if v}
+        else:
+            entries = {}
+        with self.lock:
+            self.entries = entries
+            self.loaded_at = time.time()
+
+    def on_change(self, event):
+        key = event.path.strip("/").split("/")[0]
+        if not key:
+            if event.event_type == "patch":
+                with self.lock:
+                    self.entries.update(event.data or {})
+                    self.entries = {k: v for k, v in self.entries.items() if v}
+            else:
+                self.replace(event.data)
+            return
+        with self.lock:
+            if event.data is None:
+                self.entries.pop(key, None)
+            elif event.event_type == "put":
+                self.entries[key] = event.data
+            self.loaded_at = time.time()
+
+    def tokens(self):
+        if self.listener is None and time.time() - self.loaded_at > self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Device token refresh error:", e)
+        with self.lock:
+            return [t for t in self.entries.values() if isinstance(t, str)]
+
+    def stop(self):
+        if self.listener:
+            self.listener.close()
+            self.listener = None
 
 def send_fcm(tokens, title, body, data=None):
+    start = time.perf_counter()
     try:
         msg = messaging.MulticastMessage(
             notification=messaging.Notification(title=title, body=body),
@@ -43,9 +408,13 @@ def send_fcm(tokens, title, body, data=None):
             data={k:str(v) for k,v in (data or {}).items()}
         )
         resp = messaging.send_multicast(msg)
+        FCM_SEND_SECONDS.labels("sent").observe(time.perf_counter() - start)
         print("FCM sent:", resp.success_count)
+        return resp.success_count
     except Exception as e:
+        FCM_SEND_SECONDS.labels("error").observe(time.perf_counter() - start)
         print("Error sending FCM:", e)
+        return None
 
 def upload_audio_to_storage(audio_data, filename):
     try:
@@ -67,3 +436,36 @@ def upload_audio_to_storage(audio_data, filename):
     except Exception as e:
         print("Error uploading audio:", e)
         return None
+
+def upload_image_to_storage(image_data, filename, folder="thumbnails"):
+    with UPLOAD_SECONDS.time():
+        bucket = storage.bucket()
+        blob = bucket.blob(f"{folder}/{filename}")
+        blob.cache_control = "public, max-age=86400"
+        blob.upload_from_string(image_data, content_type='image/jpeg')
+        blob.make_public()
+    return blob.public_url
+
+def upload_file_to_storage(file_obj, filename, content_type, size, folder="audio_recordings",
+                           chunk_size=UPLOAD_CHUNK_SIZE):
+    try:
+        bucket = storage.bucket()
+        blob = bucket.blob(f"{folder}/{filename}")
+        blob.chunk_size = chunk_size
+        with UPLOAD_SECONDS.time():
+            blob.upload_from_file(file_obj, content_type=content_type, size=size)
+        blob.make_public()
+
+        db.reference(f'/doorcam/{folder}').push({
+            'filename': filename,
+            'url': blob.public_url,
+            'content_type': content_type,
+            'timestamp': time.time(),
+            'size': size
+        })
+
+        print(f"Uploaded {folder}/{filename} ({size} bytes)")
+        return blob.public_url
+    except Exception as e:
+        print(f"Error uploading {folder}/{filename}:", e)
+        return None
@@ -0,0 +1,309 @@
+import copy
+import math
+import os
+import threading
+import time
+import numpy as np
+import metrics
+
+ENCODING_SIZE = 128
+GALLERY_INDEX = os.environ.get("GALLERY_INDEX", "auto")
+GALLERY_IVF_MIN = int(os.environ.get("GALLERY_IVF_MIN", 5000))
+GALLERY_NPROBE = int(os.environ.get("GALLERY_NPROBE", 0))
+GALLERY_PROBE_FRACTION = 0.1
+MIN_NPROBE = 8
+KMEANS_ITERATIONS = 12
+KMEANS_SAMPLES_PER_LIST = 64
+SEARCH_CHUNK = 8192
+SCAN_BUDGET = 1 << 24
+
+INDEX_SEARCH_SECONDS = metrics.histogram("doorcam_gallery_index_search_seconds", "Gallery index search time",
+                                         ["index"], buckets=metrics.FAST_BUCKETS)
+INDEX_CANDIDATES = metrics.histogram("doorcam_gallery_index_candidates", "Encodings scanned per probe",
+                                     ["index"], buckets=(64, 256, 1024, 4096, 16384, 65536, 262144))
+INDEX_TRAIN_SECONDS = metrics.histogram("doorcam_gallery_index_train_seconds", "IVF k-means training time")
+
+def as_vectors(vectors, dim=ENCODING_SIZE):
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, dim))
+
+def squared_distances(probes, vectors, sq_norms):
+    d2 = np.einsum('ij,ij->i', probes, probes)[:, None] + sq_norms[None, :] - 2.0 * (probes @ vectors.T)
+    np.maximum(d2, 0.0, out=d2)
+    return d2
+
+def nearest(probes, vectors, sq_norms):
+    assigned = np.empty(len(probes), dtype=np.intp)
+    for start in range(0, len(probes), SEARCH_CHUNK):
+        chunk = probes[start:start + SEARCH_CHUNK]
+        assigned[start:start + len(chunk)] = squared_distances(chunk, vectors, sq_norms).argmin(axis=1)
+    return assigned
+
+def top_k(d2, ids, k):
+    if d2.shape[1] > k:
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        d2 = np.take_along_axis(d2, part, axis=1)
+        ids = ids[part]
+    else:
+        ids = np.broadcast_to(ids, d2.shape)
+    order = np.argsort(d2, axis=1)
+    return np.take_along_axis(d2, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assigned = nearest(sample, centroids, np.einsum('ij,ij->i', centroids, centroids))
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assigned, sample)
+        counts = np.bincount(assigned, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = sums / counts[:, None].astype(np.float32)
+    return np.ascontiguousarray(centroids, dtype=np.float32)
+
+class VectorList:
+    def __init__(self, dim=ENCODING_SIZE, capacity=64):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.sq_norms = np.zeros(capacity, dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+
+    def append(self, ids, vectors):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids))
+            for attr in ("vectors", "sq_norms", "ids"):
+                old = getattr(self, attr)
+                new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self.size] = old[:self.size]
+                setattr(self, attr, new)
+        rows = np.arange(self.size, needed)
+        self.vectors[rows] = vectors
+        self.sq_norms[rows] = np.einsum('ij,ij->i', vectors, vectors)
+        self.ids[rows] = ids
+        self.size = needed
+        return rows
+
+    def view(self):
+        return self.vectors[:self.size], self.sq_norms[:self.size], self.ids[:self.size]
+
+    def copy(self):
+        other = copy.copy(self)
+        other.vectors, other.sq_norms, other.ids = self.vectors.copy(), self.sq_norms.copy(), self.ids.copy()
+        return other
+
+class GalleryIndex:
+    kind = None
+    approximate = False
+
+    def __init__(self, dim=ENCODING_SIZE):
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.labels = []
+        self.search_seconds = INDEX_SEARCH_SECONDS.labels(self.kind)
+        self.candidates = INDEX_CANDIDATES.labels(self.kind)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def build(self, vectors, labels):
+        with self.lock:
+            self.reset()
+            return self.add(vectors, labels)
+
+    def add(self, vectors, labels):
+        vectors = as_vectors(vectors, self.dim)
+        labels = list(labels)
+        if len(labels) != len(vectors):
+            raise ValueError(f"{len(vectors)} vectors but {len(labels)} labels")
+        with self.lock:
+            ids = np.arange(len(self.labels), len(self.labels) + len(vectors), dtype=np.int64)
+            self.labels.extend(labels)
+            self.insert(ids, vectors)
+        return ids
+
+    def label(self, id):
+        id = int(id)
+        return self.labels[id] if 0 <= id < len(self.labels) else None
+
+    def copy(self):
+        with self.lock:
+            other = copy.copy(self)
+            other.lock = threading.RLock()
+            other.labels = list(self.labels)
+            other.lists = [lst.copy() for lst in self.lists]
+        return other
+
+    def needs_training(self):
+        return False
+
+    def place(self, list_no, ids, vectors):
+        self.lists[list_no].append(ids, vectors)
+
+    def search(self, probes, k=1):
+        probes = as_vectors(probes, self.dim)
+        distances = np.full((len(probes), k), np.inf, dtype=np.float32)
+        ids = np.full((len(probes), k), -1, dtype=np.int64)
+        start = time.perf_counter()
+        with self.lock:
+            if self.labels and len(probes):
+                for i, (d2, found) in enumerate(self.scan(probes, k)):
+                    distances[i, :len(found)] = np.sqrt(d2)
+                    ids[i, :len(found)] = found
+        self.search_seconds.observe(time.perf_counter() - start)
+        return distances, ids
+
+    def stats(self):
+        with self.lock:
+            return {"index": self.kind, "encodings": len(self.labels), "lists": len(self.lists)}
+
+class BruteForceIndex(GalleryIndex):
+    kind = "brute"
+
+    def __init__(self, dim=ENCODING_SIZE):
+        super().__init__(dim)
+        self.reset()
+
+    def reset(self):
+        self.lists = [VectorList(self.dim)]
+        self.labels = []
+
+    def insert(self, ids, vectors):
+        self.place(0, ids, vectors)
+
+    def scan(self, probes, k):
+        vectors, sq_norms, ids = self.lists[0].view()
+        self.candidates.observe(len(ids))
+        step = max(1, SCAN_BUDGET // max(1, len(ids)))
+        for start in range(0, len(probes), step):
+            d2, found = top_k(squared_distances(probes[start:start + step], vectors, sq_norms), ids, min(k, len(ids)))
+            yield from zip(d2, found)
+
+class IVFIndex(GalleryIndex):
+    kind = "ivf"
+    approximate = True
+
+    def __init__(self, dim=ENCODING_SIZE, nlist=None, nprobe=GALLERY_NPROBE, retrain_growth=2.0):
+        super().__init__(dim)
+        self.fixed_nlist = nlist
+        self.nprobe = nprobe
+        self.retrain_growth = retrain_growth
+        self.reset()
+
+    def reset(self):
+        self.centroids = np.zeros((1, self.dim), dtype=np.float32)
+        self.centroid_norms = np.zeros(1, dtype=np.float32)
+        self.lists = [VectorList(self.dim)]
+        self.trained_size = 0
+        self.labels = []
+
+    def nlist_for(self, size):
+        if self.fixed_nlist:
+            return self.fixed_nlist
+        return max(1, int(math.sqrt(size)))
+
+    def build(self, vectors, labels):
+        with self.lock:
+            ids = super().build(vectors, labels)
+            if self.needs_training():
+                self.train()
+        return ids
+
+    def needs_training(self):
+        size = len(self.labels)
+        return size >= max(self.nlist_for(size) * 8, self.trained_size * self.retrain_growth)
+
+    def insert(self, ids, vectors):
+        # Incremental adds go to the nearest existing list; the owner retrains a copy when needs_training().
+        assigned = nearest(vectors, self.centroids, self.centroid_norms)
+        for list_no in np.unique(assigned).tolist():
+            mask = assigned == list_no
+            self.place(list_no, ids[mask], vectors[mask])
+
+    def train(self):
+        with self.lock:
+            parts = [lst.view() for lst in self.lists]
+            vectors = np.vstack([p[0] for p in parts])
+            ids = np.concatenate([p[2] for p in parts])
+            nlist = min(self.nlist_for(len(ids)), len(ids))
+            start = time.perf_counter()
+            self.centroids = kmeans(vectors, nlist)
+            INDEX_TRAIN_SECONDS.observe(time.perf_counter() - start)
+            self.centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+            self.lists = [VectorList(self.dim) for _ in range(nlist)]
+            assigned = nearest(vectors, self.centroids, self.centroid_norms)
+            order = np.argsort(assigned, kind="stable")
+            bounds = np.searchsorted(assigned[order], np.arange(nlist + 1))
+            for list_no in range(nlist):
+                chosen = order[bounds[list_no]:bounds[list_no + 1]]
+                if len(chosen):
+                    self.place(list_no, ids[chosen], vectors[chosen])
+            self.trained_size = len(ids)
+
+    def probes_for(self, nlist):
+        if self.nprobe:
+            return min(self.nprobe, nlist)
+        return min(nlist, max(MIN_NPROBE, int(math.ceil(nlist * GALLERY_PROBE_FRACTION))))
+
+    def scan(self, probes, k):
+        nprobe = self.probes_for(len(self.lists))
+        coarse = squared_distances(probes, self.centroids, self.centroid_norms)
+        if nprobe < len(self.lists):
+            probe_lists = np.argpartition(coarse, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probe_lists = np.broadcast_to(np.arange(nprobe), coarse.shape)
+        for probe, lists in zip(probes, probe_lists):
+            parts = [self.lists[list_no].view() for list_no in lists.tolist() if self.lists[list_no].size]
+            if not parts:
+                yield np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+                continue
+            vectors = np.vstack([p[0] for p in parts])
+            sq_norms = np.concatenate([p[1] for p in parts])
+            ids = np.concatenate([p[2] for p in parts])
+            self.candidates.observe(len(ids))
+            d2, found = top_k(squared_distances(probe[None, :], vectors, sq_norms), ids, min(k, len(ids)))
+            yield d2[0], found[0]
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            sizes = [lst.size for lst in self.lists]
+            stats.update({"nprobe": self.probes_for(len(self.lists)), "trained_size": self.trained_size,
+                          "largest_list": max(sizes) if sizes else 0})
+        return stats
+
+def index_kind(size, kind=GALLERY_INDEX):
+    if kind == "auto":
+        return "ivf" if size >= GALLERY_IVF_MIN else "brute"
+    return kind
+
+def make_index(kind=GALLERY_INDEX, size=0, dim=ENCODING_SIZE):
+    kind = index_kind(size, kind)
+    if kind == "brute":
+        return BruteForceIndex(dim)
+    if kind == "ivf":
+        return IVFIndex(dim)
+    raise ValueError(f"unknown gallery index: {kind}")
+
+def evaluate(index, reference, probes, k=1):
+    probes = as_vectors(probes, index.dim)
+    _, expected = reference.search(probes, k)
+    latencies = []
+    hits = 0
+    for probe, truth in zip(probes, expected):
+        start = time.perf_counter()
+        _, found = index.search(probe, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(np.intersect1d(found[0], truth[truth >= 0]))
+    latencies.sort()
+    return {
+        "index": index.kind,
+        "encodings": len(index),
+        "recall": hits / max(1, int((expected >= 0).sum())),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+
+GPIO_BACKEND = os.environ.get("DOORCAM_GPIO", "rpi")
+
+def load_gpio(name=None):
+    name = (name or GPIO_BACKEND).lower()
+    if name == "sim":
+        return SimulatedGPIO()
+    import RPi.GPIO as GPIO
+    return GPIO
+
+class SimulatedGPIO:
+    BCM = 11
+    BOARD = 10
+    IN = 1
+    OUT = 0
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.edges = {}
+        self.callbacks = {}
+        self.bouncetimes = {}
+        self.last_fired = {}
+        self.output_listeners = {}
+        self.ultrasonic_distance = None
+        self.events = queue.Queue()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        with self.lock:
+            self.directions[pin] = direction
+            if initial is not None:
+                self.levels[pin] = int(bool(initial))
+            elif pull_up_down == self.PUD_UP:
+                self.levels[pin] = self.HIGH
+            else:
+                self.levels.setdefault(pin, self.LOW)
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        value = int(bool(value))
+        with self.lock:
+            self.levels[pin] = value
+            listeners = list(self.output_listeners.get(pin, ()))
+        for listener in listeners:
+            listener(pin, value)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            if pin in self.edges:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self.edges[pin] = edge
+            self.callbacks[pin] = [callback] if callback else []
+            self.bouncetimes[pin] = bouncetime or 0
+
+    def add_event_callback(self, pin, callback):
+        with self.lock:
+            if pin not in self.edges:
+                raise RuntimeError("Add event detection using add_event_detect first before adding a callback")
+            self.callbacks[pin].append(callback)
+
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.edges.pop(pin, None)
+            self.callbacks.pop(pin, None)
+            self.bouncetimes.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        with self.lock:
+            pins = [pin] if pin is not None else list(self.directions)
+            for p in pins:
+                self.directions.pop(p, None)
+                self.edges.pop(p, None)
+                self.callbacks.pop(p, None)
+
+    def on_output(self, pin, listener):
+        with self.lock:
+            self.output_listeners.setdefault(pin, []).append(listener)
+
+    def attach_ultrasonic(self, trig_pin, echo_pin, distance=None):
+        self.ultrasonic_distance = distance
+        state = {"armed": False}
+
+        def echo(distance_cm):
+            time.sleep(0.0005)
+            self.set_input(echo_pin, self.HIGH)
+            time.sleep(distance_cm * 2 / 34300)
+            self.set_input(echo_pin, self.LOW)
+
+        def on_trigger(pin, value):
+            if value == self.HIGH:
+                state["armed"] = True
+            elif state["armed"]:
+                state["armed"] = False
+                distance_cm = self.ultrasonic_distance
+                if distance_cm is not None:
+                    threading.Thread(target=echo, args=(distance_cm,), daemon=True).start()
+
+        self.on_output(trig_pin, on_trigger)
+
+    def set_input(self, pin, value):
+        value = int(bool(value))
+        now = time.monotonic()
+        with self.lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = value
+            edge = self.edges.get(pin)
+            if edge is None or previous == value:
+                return
+            rising = value == self.HIGH
+            if edge == self.RISING and not rising or edge == self.FALLING and rising:
+                return
+            bounce = self.bouncetimes.get(pin, 0) / 1000.0
+            if bounce and now - self.last_fired.get(pin, -bounce) < bounce:
+                return
+            self.last_fired[pin] = now
+            callbacks = list(self.callbacks.get(pin, ()))
+        for callback in callbacks:
+            self.events.put((callback, pin))
+
+    def _dispatch(self):
+        while True:
+            callback, pin = self.events.get()
+            try:
+                callback(pin)
+            except Exception as e:
+                print(f"Simulated GPIO callback error on pin {pin}: {e}")
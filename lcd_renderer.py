@@ -0,0 +1,146 @@
+import threading
+import time
+import metrics
+
+LCD_RENDER_SECONDS = metrics.histogram("doorcam_lcd_render_seconds", "Time spent pushing one LCD update over I2C")
+LCD_CELLS = metrics.counter("doorcam_lcd_cells_written_total", "LCD character cells written")
+LCD_ERRORS = metrics.counter("doorcam_lcd_errors_total", "LCD write errors")
+
+class LcdRenderer(threading.Thread):
+    def __init__(self, open_display, cols=16, rows=2, min_interval=0.2, max_errors=3, reopen_interval=30.0,
+                 merge_gap=1):
+        super().__init__()
+        self.daemon = True
+        self.open_display = open_display
+        self.cols = cols
+        self.rows = rows
+        self.min_interval = min_interval
+        self.max_errors = max_errors
+        self.reopen_interval = reopen_interval
+        self.merge_gap = merge_gap
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = None
+        self.desired = [" " * cols] * rows
+        self.shown = None
+        self.display = None
+        self.error_count = 0
+        self.last_open_attempt = 0
+        self.last_write = 0
+        self.cells_written = 0
+        self.updates = 0
+        self.running = False
+        self.final_message = None
+
+    def show(self, *lines):
+        lines = [str(line)[:self.cols].ljust(self.cols) for line in lines[:self.rows]]
+        lines += [" " * self.cols] * (self.rows - len(lines))
+        with self.lock:
+            self.pending = lines
+        self.wake.set()
+
+    def invalidate(self):
+        with self.lock:
+            self.shown = None
+        self.wake.set()
+
+    def ensure_display(self):
+        if self.display is not None:
+            return True
+        if self.last_open_attempt and time.monotonic() - self.last_open_attempt < self.reopen_interval:
+            return False
+        self.last_open_attempt = time.monotonic()
+        self.display = self.open_display()
+        with self.lock:
+            self.shown = None
+        self.error_count = 0
+        return self.display is not None
+
+    def render(self):
+        with self.lock:
+            if self.pending is not None:
+                self.desired = self.pending
+                self.pending = None
+            desired = list(self.desired)
+            shown = self.shown
+
+        if shown == desired or not self.ensure_display():
+            return
+
+        shown = shown or [None] * self.rows
+        t0 = time.perf_counter()
+        cells = self.cells_written
+        try:
+            for row, line in enumerate(desired):
+                current = shown[row]
+                col = 0
+                while col < self.cols:
+                    if current is not None and current[col] == line[col]:
+                        col += 1
+                        continue
+                    start = end = col
+                    while col < self.cols:
+                        if current is None or current[col] != line[col]:
+                            end = col + 1
+                        elif col - end >= self.merge_gap:
+                            break
+                        col += 1
+                    self.display.cursor_pos = (row, start)
+                    self.display.write_string(line[start:end])
+                    self.cells_written += end - start
+                    col = end
+            with self.lock:
+                self.shown = desired
+            LCD_RENDER_SECONDS.observe(time.perf_counter() - t0)
+            LCD_CELLS.inc(self.cells_written - cells)
+            self.updates += 1
+            self.error_count = 0
+        except Exception as e:
+            print(f"LCD write error: {e}")
+            LCD_ERRORS.inc()
+            self.error_count += 1
+            with self.lock:
+                self.shown = None
+            if self.error_count >= self.max_errors:
+                print("Too many LCD errors, reinitializing...")
+                self.close_display()
+                self.last_open_attempt = 0
+            self.wake.set()
+
+    def run(self):
+        self.running = True
+        while self.running:
+            self.wake.wait(self.reopen_interval if self.display is None else None)
+            self.wake.clear()
+            if not self.running:
+                break
+            delay = self.last_write + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.render()
+            self.last_write = time.monotonic()
+
+        if self.display is not None and self.final_message is not None:
+            try:
+                self.display.clear()
+                self.display.write_string(self.final_message[:self.cols])
+                time.sleep(1)
+            except Exception:
+                pass
+        self.close_display()
+
+    def close_display(self):
+        if self.display is None:
+            return
+        try:
+            self.display.close(clear=True)
+        except Exception:
+            pass
+        self.display = None
+
+    def stop(self, final_message=None, timeout=3.0):
+        self.final_message = final_message
+        self.running = False
+        self.wake.set()
+        if self.is_alive():
+            self.join(timeout)
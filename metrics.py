@@ -0,0 +1,223 @@
+import bisect
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in pairs) + "}"
+
+class Timer:
+    __slots__ = ("target", "start")
+
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+class CounterValue:
+    def __init__(self, metric):
+        self.lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [("", None, self.value)]
+
+class GaugeValue:
+    def __init__(self, metric):
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.fn = None
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    def samples(self):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception as e:
+                print(f"Metrics gauge error: {e}")
+                return []
+        return [("", None, value)]
+
+class HistogramValue:
+    def __init__(self, metric):
+        self.lock = threading.Lock()
+        self.buckets = metric.buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def samples(self):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            cumulative += n
+            out.append(("_bucket", ("le", format_value(float(bound))), cumulative))
+        out.append(("_sum", None, total))
+        out.append(("_count", None, count))
+        return out
+
+class Metric:
+    kind = "untyped"
+    value_class = None
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets) if buckets else DEFAULT_BUCKETS
+        self.lock = threading.Lock()
+        self.children = {}
+        self.root = None if self.label_names else self.labels()
+
+    def labels(self, *values):
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.get(key)
+                if child is None:
+                    child = self.value_class(self)
+                    self.children[key] = child
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, attr):
+        root = self.__dict__.get("root")
+        if root is None:
+            raise AttributeError(attr)
+        return getattr(root, attr)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            for suffix, extra, value in child.samples():
+                lines.append(f"{self.name}{suffix}{format_labels(self.label_names, key, extra)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+    value_class = CounterValue
+
+class Gauge(Metric):
+    kind = "gauge"
+    value_class = GaugeValue
+
+class Histogram(Metric):
+    kind = "histogram"
+    value_class = HistogramValue
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+        self.scrapes = 0
+
+    def get_or_create(self, cls, name, help, labels=(), **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, cls) or metric.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def add_collector(self, fn):
+        with self.lock:
+            self.collectors.append(fn)
+
+    def render(self):
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+            self.scrapes += 1
+        for fn in collectors:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name, help, labels=()):
+    return REGISTRY.get_or_create(Counter, name, help, labels)
+
+def gauge(name, help, labels=()):
+    return REGISTRY.get_or_create(Gauge, name, help, labels)
+
+def histogram(name, help, labels=(), buckets=None):
+    return REGISTRY.get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+def add_collector(fn):
+    REGISTRY.add_collector(fn)
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,200 @@
+import collections
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import metrics
+
+MOTION_TRIGGER = os.environ.get("DOORCAM_MOTION_TRIGGER", "0").lower() in ("1", "true", "yes", "on")
+MOTION_FPS = float(os.environ.get("MOTION_FPS", 5))
+MOTION_IDLE_FPS = float(os.environ.get("MOTION_IDLE_FPS", 2))
+MOTION_WIDTH = int(os.environ.get("MOTION_WIDTH", 160))
+MOTION_THRESHOLD = int(os.environ.get("MOTION_THRESHOLD", 25))
+MOTION_MIN_AREA = float(os.environ.get("MOTION_MIN_AREA", 0.01))
+MOTION_ROI = os.environ.get("MOTION_ROI", "0,0,1,1")
+MOTION_CONFIRM_FRAMES = int(os.environ.get("MOTION_CONFIRM_FRAMES", 2))
+MOTION_BURST = int(os.environ.get("MOTION_BURST", 3))
+MOTION_RETRY = float(os.environ.get("MOTION_RETRY", 1.0))
+MOTION_MAX_BACKOFF = float(os.environ.get("MOTION_MAX_BACKOFF", 8.0))
+MOTION_CPU_BUDGET = float(os.environ.get("MOTION_CPU_BUDGET", 0.05))
+MOTION_MIN_FACE = int(os.environ.get("MOTION_MIN_FACE", 60))
+MOTION_SETTLE = 2.0
+MOTION_MIN_FPS = 0.2
+BACKGROUND_ALPHA = 0.05
+
+MOTION_FRAMES = metrics.counter("doorcam_motion_frames_total", "Frames analyzed by the motion gate", ["camera", "result"])
+MOTION_TRIGGERS = metrics.counter("doorcam_motion_triggers_total", "Motion-gated recognition attempts by outcome",
+                                  ["camera", "outcome"])
+MOTION_DETECT_SECONDS = metrics.histogram("doorcam_motion_detect_seconds", "Frame differencing time per frame",
+                                          buckets=metrics.FAST_BUCKETS)
+MOTION_RATE = metrics.gauge("doorcam_motion_fps", "Current motion analysis rate", ["camera"])
+
+def parse_roi(value):
+    if value is None:
+        value = MOTION_ROI
+    if isinstance(value, str):
+        value = [float(v) for v in value.split(",")]
+    x0, y0, x1, y1 = (min(1.0, max(0.0, float(v))) for v in value)
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"empty motion ROI: {value}")
+    return x0, y0, x1, y1
+
+def crop_roi(frame, roi):
+    height, width = frame.shape[:2]
+    x0, y0, x1, y1 = roi
+    top, left = int(y0 * height), int(x0 * width)
+    return frame[top:max(int(y1 * height), top + 1), left:max(int(x1 * width), left + 1)]
+
+class MotionDetector:
+    def __init__(self, width=MOTION_WIDTH, threshold=MOTION_THRESHOLD, min_area=MOTION_MIN_AREA, roi=None,
+                 alpha=BACKGROUND_ALPHA):
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.roi = parse_roi(roi)
+        self.alpha = alpha
+        self.background = None
+
+    def prepare(self, frame):
+        height = max(1, int(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        return crop_roi(gray, self.roi).astype(np.float32)
+
+    def update(self, frame):
+        region = self.prepare(frame)
+        if self.background is None or self.background.shape != region.shape:
+            self.background = region
+            return False, 0.0
+        # Compensate global gain so exposure and lighting changes do not count as motion.
+        gain = float(self.background.mean()) / max(1.0, float(region.mean()))
+        diff = cv2.absdiff(region * gain, self.background)
+        score = float(np.count_nonzero(diff > self.threshold)) / diff.size
+        cv2.accumulateWeighted(region, self.background, self.alpha)
+        return score >= self.min_area, score
+
+class MotionGate(threading.Thread):
+    def __init__(self, rig, on_motion, busy=None, roi=None, fps=MOTION_FPS, idle_fps=MOTION_IDLE_FPS,
+                 confirm=MOTION_CONFIRM_FRAMES, burst=MOTION_BURST, retry=MOTION_RETRY,
+                 max_backoff=MOTION_MAX_BACKOFF, cpu_budget=MOTION_CPU_BUDGET):
+        if fps <= 0 or idle_fps <= 0:
+            raise ValueError(f"motion rates must be positive: fps={fps} idle_fps={idle_fps}")
+        super().__init__()
+        self.daemon = True
+        self.rig = rig
+        self.hub = rig.hub
+        self.on_motion = on_motion
+        self.busy = busy
+        self.detector = MotionDetector(roi=roi)
+        self.fps = fps
+        self.idle_fps = idle_fps
+        self.confirm = confirm
+        self.burst = collections.deque(maxlen=burst)
+        self.retry = retry
+        self.max_backoff = max_backoff
+        self.cpu_budget = cpu_budget
+        self.backoff = retry
+        self.retry_at = 0.0
+        self.streak = 0
+        self.last_motion = 0.0
+        self.pending = None
+        self.cost = 0.0
+        self.rate = idle_fps
+        self.score = 0.0
+        self.running = False
+        self.still_frames = MOTION_FRAMES.labels(rig.id, "still")
+        self.motion_frames = MOTION_FRAMES.labels(rig.id, "motion")
+        self.rate_gauge = MOTION_RATE.labels(rig.id)
+
+    def interval(self, now):
+        self.rate = self.fps if now - self.last_motion < MOTION_SETTLE else self.idle_fps
+        if self.pending is not None or (self.busy and self.busy()):
+            self.rate = min(self.rate, self.idle_fps)
+        if self.cost > 0 and self.cpu_budget > 0:
+            self.rate = min(self.rate, self.cpu_budget / self.cost)
+        # Never stall the gate entirely, even when one frame costs more than the whole CPU budget.
+        self.rate = max(self.rate, MOTION_MIN_FPS)
+        self.rate_gauge.set(self.rate)
+        return 1.0 / self.rate
+
+    def run(self):
+        self.running = True
+        last_seq = 0
+        next_due = 0
+        while self.running:
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            latest = self.hub.wait_next(last_seq, timeout=1.0)
+            if latest is None:
+                continue
+            last_seq, _, frame = latest
+
+            start = time.perf_counter()
+            try:
+                moving, self.score = self.detector.update(frame)
+            except Exception as e:
+                print(f"Motion detector error on {self.rig.id}: {e}")
+                next_due = time.monotonic() + 1.0
+                continue
+            elapsed = time.perf_counter() - start
+            self.cost = 0.8 * self.cost + 0.2 * elapsed
+            MOTION_DETECT_SECONDS.observe(elapsed)
+
+            now = time.monotonic()
+            self.step(moving, latest, now)
+            next_due = now + self.interval(now)
+
+    def step(self, moving, item, now):
+        self.collect()
+        if not moving:
+            self.still_frames.inc()
+            self.streak = 0
+            self.burst.clear()
+            if now - self.last_motion > MOTION_SETTLE:
+                self.backoff = self.retry
+            return
+
+        self.motion_frames.inc()
+        self.streak += 1
+        self.last_motion = now
+        self.burst.append(item)
+        if self.streak < self.confirm:
+            return
+        if self.pending is not None:
+            MOTION_TRIGGERS.labels(self.rig.id, "busy").inc()
+        elif now < self.retry_at:
+            MOTION_TRIGGERS.labels(self.rig.id, "backoff").inc()
+        elif self.busy and self.busy():
+            MOTION_TRIGGERS.labels(self.rig.id, "load").inc()
+        else:
+            self.pending = self.on_motion(self.rig, list(self.burst), self.score)
+            MOTION_TRIGGERS.labels(self.rig.id, "submitted" if self.pending else "cooldown").inc()
+
+    def collect(self):
+        if self.pending is None or not self.pending.done():
+            return
+        try:
+            outcome = self.pending.result()
+        except Exception:
+            outcome = "error"
+        self.pending = None
+        if outcome in ("no_face", "error"):
+            self.retry_at = time.monotonic() + self.backoff
+            self.backoff = min(self.max_backoff, self.backoff * 2)
+        else:
+            self.backoff = self.retry
+            self.retry_at = time.monotonic() + self.retry
+
+    def stats(self):
+        return {
+            "fps": round(self.rate, 2),
+            "score": round(self.score, 4),
+            "cost_ms": round(self.cost * 1000, 3),
+            "backoff": self.backoff,
+            "pending": self.pending is not None,
+        }
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,118 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import metrics
+
+NOTIFY_SECONDS = metrics.histogram("doorcam_notification_seconds", "Notification delivery latency including retries",
+                                   ["channel", "status"])
+
+class Channel:
+    def __init__(self, name, send, deadline=5.0, retries=1, backoff=0.5, retryable=None, workers=2, history=200):
+        self.name = name
+        self.send = send
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.retryable = retryable
+        # Each channel has its own small pool, so sends that hang past their deadline only tie up this channel.
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"notify-{name}")
+        self.latencies = collections.deque(maxlen=history)
+        self.sent = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.skipped = 0
+
+class NotificationDispatcher:
+    def __init__(self, max_workers=8, on_result=None):
+        self.channels = {}
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.supervisors = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="notify")
+
+    def register(self, name, send, deadline=5.0, retries=1, backoff=0.5, retryable=None, workers=2):
+        self.channels[name] = Channel(name, send, deadline, retries, backoff, retryable, workers)
+
+    def dispatch(self, payload, channels=None):
+        names = channels or list(self.channels)
+        return {name: self.supervisors.submit(self._deliver, self.channels[name], payload)
+                for name in names if name in self.channels}
+
+    def _deliver(self, channel, payload):
+        start = time.monotonic()
+        deadline = start + channel.deadline
+        attempts = 0
+        error = None
+        result = None
+        status = "failed"
+
+        while attempts <= channel.retries:
+            attempts += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                status = "timeout"
+                break
+            future = channel.pool.submit(channel.send, payload)
+            try:
+                result = future.result(timeout=remaining)
+            except Exception as e:
+                # FutureTimeout is the builtin TimeoutError, so a send's own timeout only counts as an error.
+                if isinstance(e, FutureTimeout) and not future.done():
+                    future.cancel()
+                    status = "timeout"
+                    error = f"no response within {channel.deadline}s"
+                    break
+                error = str(e)
+                if channel.retryable and not channel.retryable(e):
+                    break
+                if attempts <= channel.retries:
+                    time.sleep(min(channel.backoff * attempts, max(0, deadline - time.monotonic())))
+                continue
+            status = "skipped" if result is False else "sent"
+            error = None
+            break
+
+        latency = time.monotonic() - start
+        NOTIFY_SECONDS.labels(channel.name, status).observe(latency)
+        with self.lock:
+            channel.latencies.append(latency)
+            if status == "sent":
+                channel.sent += 1
+            elif status == "skipped":
+                channel.skipped += 1
+            elif status == "timeout":
+                channel.timeouts += 1
+            else:
+                channel.failed += 1
+
+        outcome = {"channel": channel.name, "status": status, "attempts": attempts,
+                   "latency": latency, "error": error, "result": result}
+        if status in ("failed", "timeout"):
+            print(f"Notification via {channel.name} {status}: {error}")
+        if self.on_result:
+            try:
+                self.on_result(outcome, payload)
+            except Exception as e:
+                print(f"Notification result handler error: {e}")
+        return outcome
+
+    def stats(self):
+        out = {}
+        with self.lock:
+            for name, channel in self.channels.items():
+                samples = sorted(channel.latencies)
+                out[name] = {
+                    "sent": channel.sent,
+                    "failed": channel.failed,
+                    "timeouts": channel.timeouts,
+                    "skipped": channel.skipped,
+                    "last_latency": channel.latencies[-1] if channel.latencies else None,
+                    "p50_latency": samples[len(samples) // 2] if samples else None,
+                    "p95_latency": samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else None,
+                }
+        return out
+
+    def shutdown(self):
+        self.supervisors.shutdown(wait=False)
+        for channel in self.channels.values():
+            channel.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,134 @@
+import threading
+import time
+
+SPEED_OF_SOUND_CM_PER_NS = 34300 / 1e9
+
+class Rangefinder(threading.Thread):
+    def __init__(self, gpio, trig_pin, echo_pin, rate=5.0, samples=5, sample_gap=0.02,
+                 echo_timeout=0.03, min_distance=2.0, max_distance=400.0, outlier_cm=5.0,
+                 on_reading=None):
+        super().__init__()
+        self.daemon = True
+        self.gpio = gpio
+        self.trig_pin = trig_pin
+        self.echo_pin = echo_pin
+        self.rate = rate
+        self.samples = samples
+        self.sample_gap = sample_gap
+        self.echo_timeout = echo_timeout
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.outlier_cm = outlier_cm
+        self.on_reading = on_reading
+        self.edges = []
+        self.echo_done = threading.Event()
+        self.active = threading.Event()
+        self.cond = threading.Condition()
+        self.distance = -1
+        self.updated_at = 0
+        self.seq = 0
+        self.use_edges = False
+
+    def setup(self):
+        try:
+            self.gpio.add_event_detect(self.echo_pin, self.gpio.BOTH, callback=self.on_echo_edge)
+            self.use_edges = True
+        except Exception as e:
+            print(f"Echo edge detection unavailable, using polled timing: {e}")
+            self.use_edges = False
+        return self.use_edges
+
+    def on_echo_edge(self, channel):
+        self.edges.append(time.monotonic_ns())
+        if len(self.edges) >= 2:
+            self.echo_done.set()
+
+    def trigger(self):
+        self.gpio.output(self.trig_pin, False)
+        # Let TRIG settle low and the previous ping die out before the next 10 us pulse.
+        time.sleep(0.002)
+        self.gpio.output(self.trig_pin, True)
+        time.sleep(0.00001)
+        self.gpio.output(self.trig_pin, False)
+
+    def measure_edges(self):
+        self.edges = []
+        self.echo_done.clear()
+        self.trigger()
+        if not self.echo_done.wait(self.echo_timeout):
+            return None
+        rise, fall = self.edges[0], self.edges[1]
+        return (fall - rise) * SPEED_OF_SOUND_CM_PER_NS / 2
+
+    def measure_polled(self):
+        self.trigger()
+        pulse_start = pulse_end = None
+        timeout = time.monotonic_ns() + int(self.echo_timeout * 1e9)
+        while self.gpio.input(self.echo_pin) == 0 and time.monotonic_ns() < timeout:
+            pulse_start = time.monotonic_ns()
+        while self.gpio.input(self.echo_pin) == 1 and time.monotonic_ns() < timeout:
+            pulse_end = time.monotonic_ns()
+        if pulse_start is None or pulse_end is None:
+            return None
+        return (pulse_end - pulse_start) * SPEED_OF_SOUND_CM_PER_NS / 2
+
+    def measure(self):
+        values = []
+        for i in range(self.samples):
+            if i:
+                time.sleep(self.sample_gap)
+            d = self.measure_edges() if self.use_edges else self.measure_polled()
+            if d is not None and self.min_distance <= d <= self.max_distance:
+                values.append(d)
+        return self.filter(values)
+
+    def filter(self, values):
+        if not values:
+            return -1
+        values = sorted(values)
+        median = values[len(values) // 2]
+        deviations = sorted(abs(v - median) for v in values)
+        mad = deviations[len(deviations) // 2]
+        limit = max(self.outlier_cm, 3 * mad)
+        kept = [v for v in values if abs(v - median) <= limit]
+        return kept[len(kept) // 2]
+
+    def run(self):
+        self.setup()
+        period = 1.0 / self.rate
+        while True:
+            self.active.wait()
+            started = time.monotonic()
+            try:
+                distance = self.measure()
+            except Exception as e:
+                print(f"Ranging error: {e}")
+                distance = -1
+            with self.cond:
+                self.distance = distance
+                self.updated_at = time.monotonic()
+                self.seq += 1
+                self.cond.notify_all()
+            if self.on_reading:
+                self.on_reading(distance)
+            remaining = period - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def resume(self):
+        with self.cond:
+            self.seq = 0
+            self.distance = -1
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def read(self, max_age=1.0, wait=0.0):
+        with self.cond:
+            fresh = lambda: self.seq and time.monotonic() - self.updated_at <= max_age
+            if not fresh() and wait > 0:
+                self.cond.wait_for(fresh, wait)
+            if not fresh():
+                return -1
+            return self.distance
@@ -0,0 +1,239 @@
+import collections
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+import face_recognition
+import numpy as np
+import metrics
+from face_recognizer import detect_face_locations, face_quality, merge_burst_results, DETECT_SCALE
+
+RECOGNITION_WORKERS = int(os.environ.get("RECOGNITION_WORKERS", max(1, (os.cpu_count() or 1) - 1)))
+RECOGNITION_QUEUE_SIZE = int(os.environ.get("RECOGNITION_QUEUE_SIZE", 4))
+RECOGNITION_MAX_AGE = float(os.environ.get("RECOGNITION_MAX_AGE", 3.0))
+# warm_up() forks every worker before the app starts its other threads; the workers share the loaded dlib models.
+START_METHOD = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+
+RECOGNITION_REQUESTS = metrics.counter("doorcam_recognition_requests_total", "Recognition requests by outcome",
+                                       ["camera", "outcome"])
+RECOGNITION_STAGE_SECONDS = metrics.histogram("doorcam_recognition_stage_seconds",
+                                              "Recognition service time per request stage", ["stage"])
+RECOGNITION_QUEUE_DEPTH = metrics.gauge("doorcam_recognition_queue_depth", "Recognition requests waiting for a worker")
+
+class StaleRequest(Exception):
+    pass
+
+def _watch_parent():
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1.0)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+def _warmup():
+    return os.getpid()
+
+def _detect(frame_bgr, scale):
+    start = time.perf_counter()
+    frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    locations = detect_face_locations(frame_rgb, scale)
+    qualities = [face_quality(frame_rgb, loc) for loc in locations]
+    return locations, qualities, time.perf_counter() - start
+
+def _encode(frame_bgr, locations):
+    start = time.perf_counter()
+    frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    encodings = [np.asarray(e, dtype=np.float32) for e in face_recognition.face_encodings(frame_rgb, locations)]
+    return encodings, time.perf_counter() - start
+
+class RecognitionRequest:
+    def __init__(self, key, frames, best_n, scale):
+        self.key = key
+        self.frames = frames
+        self.best_n = best_n
+        self.scale = scale
+        self.submitted = time.monotonic()
+        self.future = Future()
+        self.future.timing = None
+        self.coalesced = 0
+
+class RecognitionService(threading.Thread):
+    def __init__(self, face_rec, workers=RECOGNITION_WORKERS, max_pending=RECOGNITION_QUEUE_SIZE,
+                 max_age=RECOGNITION_MAX_AGE):
+        super().__init__()
+        self.daemon = True
+        self.face_rec = face_rec
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD),
+                                        initializer=_watch_parent) if workers > 0 else None
+        self.cond = threading.Condition()
+        self.pending = collections.OrderedDict()
+        self.active = {}
+        self.completed = 0
+        self.running = False
+
+    def drop_pool(self, broken):
+        # Re-forking now would copy locks held by the app's threads, so keep recognizing in-process instead.
+        with self.cond:
+            if self.pool is not broken:
+                return
+            self.pool = None
+        print("Recognition worker crashed - continuing with in-process recognition")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        if self.pool is None:
+            return []
+        pids = set(f.result() for f in [self.pool.submit(_warmup) for _ in range(self.workers)])
+        print(f"Recognition service ready: {len(pids)} worker process(es)")
+        return sorted(pids)
+
+    def submit(self, key, frames, best_n=2, scale=DETECT_SCALE):
+        request = RecognitionRequest(key, frames, best_n, scale)
+        with self.cond:
+            queued = self.pending.get(key)
+            if queued is not None:
+                queued.frames, queued.best_n, queued.scale = frames, best_n, scale
+                queued.submitted = request.submitted
+                queued.coalesced += 1
+                self.pending.move_to_end(key)
+                RECOGNITION_REQUESTS.labels(key, "coalesced").inc()
+                return queued.future
+            while len(self.pending) >= self.max_pending:
+                _, stale = self.pending.popitem(last=False)
+                print(f"Recognition request on {stale.key} dropped for newer request on {key}")
+                stale.future.set_exception(StaleRequest(f"dropped for newer request on {key}"))
+                RECOGNITION_REQUESTS.labels(stale.key, "dropped").inc()
+            self.pending[key] = request
+            RECOGNITION_QUEUE_DEPTH.set(len(self.pending))
+            self.cond.notify()
+        return request.future
+
+    def map(self, fn, *iterables):
+        pool = self.pool
+        if pool is None:
+            return [fn(*args) for args in zip(*iterables)]
+        try:
+            return list(pool.map(fn, *iterables))
+        except BrokenProcessPool:
+            self.drop_pool(pool)
+            raise
+
+    def process(self, request):
+        frames = request.frames
+        timing = {"queue": time.monotonic() - request.submitted}
+
+        start = time.perf_counter()
+        detections = self.map(_detect, frames, [request.scale] * len(frames))
+        timing["detect"] = time.perf_counter() - start
+        timing["detect_cpu"] = sum(d[2] for d in detections)
+
+        candidates = []
+        for index, (locations, qualities, _) in enumerate(detections):
+            if locations:
+                score = max(sharpness * area for sharpness, area in qualities)
+                candidates.append((score, index, locations, qualities))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        candidates = candidates[:request.best_n]
+
+        start = time.perf_counter()
+        encoded = self.map(_encode, [frames[c[1]] for c in candidates], [c[2] for c in candidates])
+        timing["encode"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = []
+        for (score, index, locations, qualities), (encodings, _) in zip(candidates, encoded):
+            matched = self.face_rec.match(encodings)
+            for location, encoding, (sharpness, area), result in zip(locations, encodings, qualities, matched):
+                result.update({"location": location, "encoding": encoding, "frame_index": index,
+                               "sharpness": sharpness, "face_area": area, "camera": request.key})
+                results.append(result)
+        results = merge_burst_results(results)
+        timing["match"] = time.perf_counter() - start
+        timing["total"] = time.monotonic() - request.submitted
+        return results, timing
+
+    def finish(self, request, results, timing):
+        for stage in ("queue", "detect", "encode", "match", "total"):
+            RECOGNITION_STAGE_SECONDS.labels(stage).observe(timing[stage])
+        RECOGNITION_REQUESTS.labels(request.key, "done").inc()
+        request.future.timing = timing
+        request.future.set_result(results)
+
+    def next_request(self):
+        for key in self.pending:
+            if key not in self.active:
+                return self.pending.pop(key)
+        return None
+
+    def run(self):
+        # One request per camera runs at a time; different cameras share the worker pool concurrently.
+        self.running = True
+        while self.running:
+            with self.cond:
+                self.cond.wait_for(lambda: not self.running or any(k not in self.active for k in self.pending))
+                if not self.running:
+                    break
+                request = self.next_request()
+                self.active[request.key] = request
+                RECOGNITION_QUEUE_DEPTH.set(len(self.pending))
+            threading.Thread(target=self.work, args=(request,), name=f"recognition-{request.key}",
+                             daemon=True).start()
+
+    def work(self, request):
+        try:
+            self.handle(request)
+        finally:
+            with self.cond:
+                del self.active[request.key]
+                self.completed += 1
+                self.cond.notify_all()
+
+    def handle(self, request):
+        if not request.future.set_running_or_notify_cancel():
+            return
+        age = time.monotonic() - request.submitted
+        if age > self.max_age:
+            request.future.set_exception(StaleRequest(f"request waited {age:.2f}s"))
+            RECOGNITION_REQUESTS.labels(request.key, "stale").inc()
+            return
+        try:
+            results, timing = self.process(request)
+        except Exception as e:
+            print(f"Recognition error on {request.key}: {e}")
+            RECOGNITION_REQUESTS.labels(request.key, "error").inc()
+            request.future.set_exception(e)
+            return
+        self.finish(request, results, timing)
+
+    def busy(self):
+        with self.cond:
+            return bool(self.pending) or bool(self.active)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "workers": self.workers,
+                "mode": "process" if self.pool else "inline",
+                "pending": list(self.pending),
+                "active": list(self.active),
+                "completed": self.completed,
+                "max_pending": self.max_pending,
+            }
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            for request in self.pending.values():
+                request.future.cancel()
+            self.pending.clear()
+            self.cond.notify_all()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,210 @@
+import collections
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+import wave
+import numpy as np
+import metrics
+from audio_relay import resample
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+RECORD_RATE = int(os.environ.get("DOORCAM_RECORD_RATE", 16000))
+CAPTURE_RATES = (RECORD_RATE, 48000, 44100)
+CHUNK_SECONDS = 0.1
+MAX_JOBS = 50
+
+RECORD_PHASE_SECONDS = metrics.histogram("doorcam_recording_job_seconds", "Recording job duration by phase", ["phase"])
+RECORD_BYTES = metrics.counter("doorcam_recording_bytes_total", "Encoded recording bytes uploaded")
+RECORD_JOBS = metrics.counter("doorcam_recording_jobs_total", "Recording jobs by outcome", ["status"])
+
+class RecordingJob:
+    def __init__(self, duration, prefix, origin):
+        self.id = uuid.uuid4().hex[:12]
+        self.duration = duration
+        self.prefix = prefix
+        self.origin = origin
+        self.status = "queued"
+        self.progress = 0.0
+        self.filename = None
+        self.url = None
+        self.size = 0
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "duration": self.duration,
+            "filename": self.filename,
+            "audio_url": self.url,
+            "size": self.size,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+class StreamEncoder:
+    def __init__(self, rate=RECORD_RATE):
+        self.rate = rate
+        self.file = tempfile.NamedTemporaryFile(prefix="doorcam-rec-", suffix=self.extension, delete=False)
+        self.path = self.file.name
+        self.file.close()
+        if soundfile is not None:
+            self.writer = soundfile.SoundFile(self.path, mode="w", samplerate=rate, channels=1,
+                                              format="FLAC", subtype="PCM_16")
+        else:
+            self.writer = wave.open(self.path, "wb")
+            self.writer.setnchannels(1)
+            self.writer.setsampwidth(2)
+            self.writer.setframerate(rate)
+
+    @property
+    def extension(self):
+        return ".flac" if soundfile is not None else ".wav"
+
+    @property
+    def content_type(self):
+        return "audio/flac" if soundfile is not None else "audio/wav"
+
+    def write(self, pcm):
+        if soundfile is not None:
+            self.writer.write(np.frombuffer(pcm, dtype='<i2'))
+        else:
+            self.writer.writeframes(pcm)
+
+    def close(self):
+        self.writer.close()
+        return os.path.getsize(self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class AudioRecorder(threading.Thread):
+    def __init__(self, audio, fmt, upload, on_progress=None, rate=RECORD_RATE, max_jobs=MAX_JOBS):
+        super().__init__()
+        self.daemon = True
+        self.audio = audio
+        self.format = fmt
+        self.upload = upload
+        self.on_progress = on_progress
+        self.rate = rate
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = collections.OrderedDict()
+        self.max_jobs = max_jobs
+        self.capture_rate = None
+        self.running = False
+
+    def submit(self, duration=5, prefix="audio_recording", origin=None):
+        job = RecordingJob(duration, prefix, origin)
+        with self.lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self.queue.put(job)
+        self.publish(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def publish(self, job):
+        if self.on_progress:
+            try:
+                self.on_progress(job)
+            except Exception as e:
+                print(f"Recording progress handler error: {e}")
+
+    def open_stream(self):
+        rates = [self.capture_rate] if self.capture_rate else CAPTURE_RATES
+        last_error = None
+        for rate in rates:
+            try:
+                stream = self.audio.open(format=self.format, channels=1, rate=rate, input=True,
+                                         frames_per_buffer=int(rate * CHUNK_SECONDS))
+                self.capture_rate = rate
+                return stream, rate
+            except Exception as e:
+                last_error = e
+        raise RuntimeError(f"no usable capture rate: {last_error}")
+
+    def record(self, job, encoder):
+        stream, rate = self.open_stream()
+        chunk = int(rate * CHUNK_SECONDS)
+        total = int(rate * job.duration)
+        captured = 0
+        print(f"Recording audio for {job.duration} seconds at {rate} Hz...")
+        try:
+            while captured < total:
+                frames = min(chunk, total - captured)
+                pcm = stream.read(frames, exception_on_overflow=False)
+                encoder.write(resample(pcm, rate, self.rate))
+                captured += frames
+                job.progress = 0.8 * captured / total
+                if captured % (chunk * 5) < chunk:
+                    self.publish(job)
+        finally:
+            stream.stop_stream()
+            stream.close()
+
+    def run_job(self, job):
+        if self.audio is None:
+            raise RuntimeError("audio system not available")
+        encoder = StreamEncoder(self.rate)
+        try:
+            job.status = "recording"
+            self.publish(job)
+            start = time.perf_counter()
+            self.record(job, encoder)
+            job.size = encoder.close()
+            RECORD_PHASE_SECONDS.labels("record").observe(time.perf_counter() - start)
+
+            job.status = "uploading"
+            job.progress = 0.8
+            job.filename = f"{job.prefix}_{int(job.created)}{encoder.extension}"
+            self.publish(job)
+            start = time.perf_counter()
+            with open(encoder.path, "rb") as f:
+                job.url = self.upload(f, job.filename, encoder.content_type, job.size)
+            RECORD_PHASE_SECONDS.labels("upload").observe(time.perf_counter() - start)
+            if not job.url:
+                raise RuntimeError("upload failed")
+            RECORD_BYTES.inc(job.size)
+        finally:
+            encoder.discard()
+
+    def run(self):
+        self.running = True
+        while self.running:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                self.run_job(job)
+                job.status = "done"
+                job.progress = 1.0
+            except Exception as e:
+                print(f"Recording job {job.id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            job.finished = time.time()
+            RECORD_JOBS.labels(job.status).inc()
+            self.publish(job)
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)
@@ -1,11 +1,20 @@
 import threading
 import time
-import smbus2
-from RPLCD import i2c
-import RPi.GPIO as GPIO
+import collections
+from gpio_backend import load_gpio
+from ranging import Rangefinder
+from lcd_renderer import LcdRenderer
 from firebase_client import log_event
+import metrics
 import os
 
+try:
+    import smbus2
+    from RPLCD import i2c
+except ImportError:
+    smbus2 = None
+    i2c = None
+
 PIR_PIN = 23
 TRIG_PIN = 25
 ECHO_PIN = 24
@@ -14,11 +23,37 @@ RELAY_PIN = 19
 LDR_PIN = 22
 LIGHT_PIN = 17
 
+SENSOR_MODE = os.environ.get("DOORCAM_SENSOR_MODE", "event")
+RANGE_RATE = float(os.environ.get("DOORCAM_RANGE_RATE", 5))
+RANGE_SAMPLES = int(os.environ.get("DOORCAM_RANGE_SAMPLES", 5))
+LCD_MIN_INTERVAL = float(os.environ.get("DOORCAM_LCD_MIN_INTERVAL", 0.2))
+MAX_ALERTS_IN_FLIGHT = int(os.environ.get("DOORCAM_MAX_ALERTS", 2))
+
+SENSOR_LOOP_SECONDS = metrics.histogram("doorcam_sensor_loop_seconds", "Sensor loop iteration time", ["mode"],
+                                        buckets=metrics.FAST_BUCKETS + (0.1, 0.25, 0.5, 1.0))
+SENSOR_LATENCY_SECONDS = metrics.histogram("doorcam_sensor_latency_seconds", "Latency from PIR edge to session start or alert",
+                                           ["stage"])
+SENSOR_ALERTS = metrics.counter("doorcam_sensor_alerts_total", "Proximity alerts raised")
+SENSOR_ALERTS_SKIPPED = metrics.counter("doorcam_sensor_alerts_skipped_total",
+                                        "Proximity alerts skipped because too many were still running")
+
 class Sensors(threading.Thread):
-    def __init__(self, alert_callback=None, pir_cooldown=5, alert_cooldown=30):
+    def __init__(self, alert_callback=None, pir_cooldown=5, alert_cooldown=30, gpio=None,
+                 mode=SENSOR_MODE, pir_debounce_ms=50, ldr_debounce_ms=300, range_interval=0.2):
         super().__init__()
         self.daemon = True
+        self.gpio = gpio or load_gpio()
+        self.mode = mode
+        self.pir_debounce_ms = pir_debounce_ms
+        self.ldr_debounce_ms = ldr_debounce_ms
+        self.range_interval = range_interval
+        self.wake = threading.Event()
+        self.pir_edge_time = None
+        self.session_start_time = None
+        self.motion_latencies = collections.deque(maxlen=100)
+        self.trigger_latencies = collections.deque(maxlen=100)
         self.alert_callback = alert_callback
+        self.alert_slots = threading.BoundedSemaphore(MAX_ALERTS_IN_FLIGHT)
         self.monitoringActive = False
         self.lcd = None
         self.lcd_addr = None
@@ -29,38 +64,43 @@ class Sensors(threading.Thread):
         self.is_dark = False
         self.light_state = False
         self.door_locked = True
-        self.lcd_refresh_counter = 0
-        self.lcd_refresh_interval = 300
+        self.last_lcd_refresh = time.time()
+        self.lcd_refresh_period = 150
         self.last_lcd_content = ["", ""]
         self.lcd_error_count = 0
         self.max_lcd_errors = 3
         self.setup_gpio()
+        self.range_max_age = 2.0 / RANGE_RATE
+        self.rangefinder = Rangefinder(self.gpio, TRIG_PIN, ECHO_PIN, rate=RANGE_RATE,
+                                       samples=RANGE_SAMPLES, on_reading=self.on_range_reading)
         self.init_lcd()
 
     def setup_gpio(self):
         try:
-            GPIO.cleanup()
+            self.gpio.cleanup()
             time.sleep(0.1)
             
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setwarnings(False)
+            self.gpio.setmode(self.gpio.BCM)
+            self.gpio.setwarnings(False)
             
-            GPIO.setup(RELAY_PIN, GPIO.OUT, initial=GPIO.LOW)
+            self.gpio.setup(RELAY_PIN, self.gpio.OUT, initial=self.gpio.LOW)
             self.door_locked = True
             print("Door initialized: LOCKED")
             
-            GPIO.setup(PIR_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-            GPIO.setup(TRIG_PIN, GPIO.OUT, initial=GPIO.LOW)
-            GPIO.setup(ECHO_PIN, GPIO.IN)
-            GPIO.setup(BUZZER_PIN, GPIO.OUT, initial=GPIO.LOW)
-            GPIO.setup(LDR_PIN, GPIO.IN)
-            GPIO.setup(LIGHT_PIN, GPIO.OUT, initial=GPIO.LOW)
+            self.gpio.setup(PIR_PIN, self.gpio.IN, pull_up_down=self.gpio.PUD_DOWN)
+            self.gpio.setup(TRIG_PIN, self.gpio.OUT, initial=self.gpio.LOW)
+            self.gpio.setup(ECHO_PIN, self.gpio.IN)
+            self.gpio.setup(BUZZER_PIN, self.gpio.OUT, initial=self.gpio.LOW)
+            self.gpio.setup(LDR_PIN, self.gpio.IN)
+            self.gpio.setup(LIGHT_PIN, self.gpio.OUT, initial=self.gpio.LOW)
             
             print("GPIO setup complete")
         except Exception as e:
             print(f"GPIO setup error: {e}")
 
     def scan_i2c(self):
+        if smbus2 is None:
+            return None
         try:
             bus = smbus2.SMBus(1)
             for addr in [0x27, 0x3f, 0x20, 0x21, 0x22, 0x23, 0x24, 0x25, 0x26]:
@@ -75,82 +115,50 @@ class Sensors(threading.Thread):
             print(f"I2C bus error: {e}")
         return None
 
-    def init_lcd(self):
+    def open_lcd(self):
         try:
             addr = self.scan_i2c()
-            if addr:
+            if addr and i2c:
                 self.lcd_addr = addr
                 time.sleep(0.2)
-                
-                if self.lcd:
-                    try:
-                        self.lcd.close(clear=True)
-                        time.sleep(0.1)
-                    except:
-                        pass
-                
-                self.lcd = i2c.CharLCD('PCF8574', address=addr, port=1, cols=16, rows=2, 
-                                     dotsize=8, charmap='A02', auto_linebreaks=True)
+
+                lcd = i2c.CharLCD('PCF8574', address=addr, port=1, cols=16, rows=2, 
+                                  dotsize=8, charmap='A02', auto_linebreaks=True)
                 time.sleep(0.5)
-                
-                self.lcd.clear()
+
+                lcd.clear()
                 time.sleep(0.3)
-                self.lcd.cursor_mode = 'hide'
+                lcd.cursor_mode = 'hide'
                 time.sleep(0.1)
-                
+
+                self.lcd = lcd
                 self.lcd_error_count = 0
-                self.lcd_refresh_counter = 0
-                
-                self.lcd_write("System Ready", "LCD Initialized")
+                self.last_lcd_refresh = time.time()
                 print(f"LCD initialized at address 0x{addr:02x}")
+                return lcd
             else:
                 print("No I2C LCD found.")
-                self.lcd = None
         except Exception as e:
             print(f"LCD init error: {e}")
-            self.lcd = None
             self.lcd_error_count += 1
+        self.lcd = None
+        return None
+
+    def init_lcd(self):
+        self.lcd_renderer = LcdRenderer(self.open_lcd, cols=16, rows=2,
+                                        min_interval=LCD_MIN_INTERVAL, max_errors=self.max_lcd_errors)
+        self.lcd_renderer.start()
+        self.lcd_write("System Ready", "LCD Initialized")
 
     def lcd_write(self, line1="", line2=""):
-        if not self.lcd:
-            if self.lcd_error_count < self.max_lcd_errors:
-                self.init_lcd()
+        line1_clean = self.sanitize_lcd_text(str(line1))[:16]
+        line2_clean = self.sanitize_lcd_text(str(line2))[:16]
+
+        if self.last_lcd_content[0] == line1_clean and self.last_lcd_content[1] == line2_clean:
             return
-        
-        try:
-            line1_clean = self.sanitize_lcd_text(str(line1))[:16]
-            line2_clean = self.sanitize_lcd_text(str(line2))[:16]
-            
-            if self.last_lcd_content[0] == line1_clean and self.last_lcd_content[1] == line2_clean:
-                return
-            
-            self.lcd.clear()
-            time.sleep(0.1)
-            
-            if line1_clean:
-                self.lcd.cursor_pos = (0, 0)
-                self.lcd.write_string(line1_clean.ljust(16))
-                time.sleep(0.05)
-            
-            if line2_clean:
-                self.lcd.cursor_pos = (1, 0)
-                self.lcd.write_string(line2_clean.ljust(16))
-                time.sleep(0.05)
-            
-            self.last_lcd_content = [line1_clean, line2_clean]
-            self.lcd_error_count = 0
-                
-        except Exception as e:
-            print(f"LCD write error: {e}")
-            self.lcd_error_count += 1
-            
-            if self.lcd_error_count >= self.max_lcd_errors:
-                print("Too many LCD errors, reinitializing...")
-                self.lcd = None
-                time.sleep(0.2)
-                self.init_lcd()
-            else:
-                time.sleep(0.1)
+
+        self.last_lcd_content = [line1_clean, line2_clean]
+        self.lcd_renderer.show(line1_clean, line2_clean)
 
     def sanitize_lcd_text(self, text):
         if not text:
@@ -168,48 +176,16 @@ class Sensors(threading.Thread):
         return clean_text.strip()
 
     def refresh_lcd_display(self):
-        if self.lcd and self.last_lcd_content[0]:
-            try:
-                self.lcd.clear()
-                time.sleep(0.2)
-                
-                self.lcd.cursor_pos = (0, 0)
-                self.lcd.write_string(self.last_lcd_content[0].ljust(16))
-                time.sleep(0.05)
-                
-                if self.last_lcd_content[1]:
-                    self.lcd.cursor_pos = (1, 0)
-                    self.lcd.write_string(self.last_lcd_content[1].ljust(16))
-                    time.sleep(0.05)
-                    
-                print("LCD display refreshed")
-                
-            except Exception as e:
-                print(f"LCD refresh error: {e}")
-                self.lcd_error_count += 1
+        if self.last_lcd_content[0]:
+            self.lcd_renderer.invalidate()
+            print("LCD display refreshed")
 
     def get_distance(self):
-        GPIO.output(TRIG_PIN, False)
-        time.sleep(0.002)
-        GPIO.output(TRIG_PIN, True)
-        time.sleep(0.00001)
-        GPIO.output(TRIG_PIN, False)
-
-        pulse_start = pulse_end = None
-        timeout = time.time() + 0.03
-        while GPIO.input(ECHO_PIN) == 0 and time.time() < timeout:
-            pulse_start = time.time()
-        while GPIO.input(ECHO_PIN) == 1 and time.time() < timeout:
-            pulse_end = time.time()
-
-        if pulse_start is None or pulse_end is None:
-            return -1
-        duration = pulse_end - pulse_start
-        return duration * 34300 / 2
+        return self.rangefinder.read(max_age=self.range_max_age, wait=self.range_max_age)
 
     def check_light_level(self):
         try:
-            ldr_value = GPIO.input(LDR_PIN)
+            ldr_value = self.gpio.input(LDR_PIN)
             self.is_dark = ldr_value == 0
             return self.is_dark
         except Exception as e:
@@ -219,7 +195,7 @@ class Sensors(threading.Thread):
     def control_light(self, state):
         try:
             if state != self.light_state:
-                GPIO.output(LIGHT_PIN, GPIO.HIGH if state else GPIO.LOW)
+                self.gpio.output(LIGHT_PIN, self.gpio.HIGH if state else self.gpio.LOW)
                 self.light_state = state
                 status = "ON" if state else "OFF"
                 print(f"Light turned {status}")
@@ -229,7 +205,7 @@ class Sensors(threading.Thread):
 
     def turn_on_light(self, reason="Manual control"):
         try:
-            GPIO.output(LIGHT_PIN, GPIO.HIGH)
+            self.gpio.output(LIGHT_PIN, self.gpio.HIGH)
             self.light_state = True
             print(f"Light turned ON: {reason}")
             self.lcd_write("Light ON", reason[:15])
@@ -239,7 +215,7 @@ class Sensors(threading.Thread):
 
     def turn_off_light(self, reason="Manual control"):
         try:
-            GPIO.output(LIGHT_PIN, GPIO.LOW)
+            self.gpio.output(LIGHT_PIN, self.gpio.LOW)
             self.light_state = False
             print(f"Light turned OFF: {reason}")
             self.lcd_write("Light OFF", reason[:15])
@@ -249,9 +225,9 @@ class Sensors(threading.Thread):
 
     def beep(self, ms=300):
         try:
-            GPIO.output(BUZZER_PIN, GPIO.HIGH)
+            self.gpio.output(BUZZER_PIN, self.gpio.HIGH)
             time.sleep(ms / 1000.0)
-            GPIO.output(BUZZER_PIN, GPIO.LOW)
+            self.gpio.output(BUZZER_PIN, self.gpio.LOW)
         except Exception as e:
             print(f"Beep error: {e}")
 
@@ -259,20 +235,20 @@ class Sensors(threading.Thread):
         try:
             print(f"Unlocking door for {seconds} seconds")
             self.lcd_write("Door Unlocked", "")
-            GPIO.output(RELAY_PIN, GPIO.HIGH)
+            self.gpio.output(RELAY_PIN, self.gpio.HIGH)
             self.door_locked = False
             log_event("door_unlocked", {"duration": seconds})
             
             time.sleep(seconds)
             
-            GPIO.output(RELAY_PIN, GPIO.LOW)
+            self.gpio.output(RELAY_PIN, self.gpio.LOW)
             self.door_locked = True
             self.lcd_write("Door Locked", "")
             log_event("door_locked", {"auto_lock": True})
             print("Door locked again")
         except Exception as e:
             print(f"Unlock error: {e}")
-            GPIO.output(RELAY_PIN, GPIO.LOW)
+            self.gpio.output(RELAY_PIN, self.gpio.LOW)
             self.door_locked = True
 
     def manual_unlock(self, seconds=5):
@@ -283,7 +259,7 @@ class Sensors(threading.Thread):
 
     def lock_door(self):
         try:
-            GPIO.output(RELAY_PIN, GPIO.LOW)
+            self.gpio.output(RELAY_PIN, self.gpio.LOW)
             self.door_locked = True
             self.lcd_write("Door Locked", "Manual Lock")
             log_event("door_locked", {"manual": True})
@@ -291,82 +267,202 @@ class Sensors(threading.Thread):
         except Exception as e:
             print(f"Lock error: {e}")
 
+    def maybe_refresh_lcd(self):
+        if time.time() - self.last_lcd_refresh >= self.lcd_refresh_period:
+            self.refresh_lcd_display()
+            self.last_lcd_refresh = time.time()
+
+    def update_light(self):
+        is_dark = self.check_light_level()
+        if is_dark:
+            self.control_light(True)
+        else:
+            self.control_light(False)
+
+    def start_session(self, pir, current_time):
+        if pir == self.gpio.HIGH and not self.monitoringActive:
+            if current_time - self.last_pir_time >= self.pir_cooldown:
+                self.monitoringActive = True
+                self.last_pir_time = current_time
+                self.session_start_time = time.monotonic()
+                self.rangefinder.resume()
+                if self.pir_edge_time is not None:
+                    self.motion_latencies.append(self.session_start_time - self.pir_edge_time)
+                    SENSOR_LATENCY_SECONDS.labels("motion").observe(self.motion_latencies[-1])
+                print("PIR triggered: monitoring active")
+                self.lcd_write("Motion Detected", "Scanning...")
+                log_event("motion", {"msg": "PIR triggered"})
+
+    def monitor_step(self, pir, current_time):
+        dist = self.get_distance()
+        if 0 < dist <= 40:
+            self.lcd_write("Verification...", f"Range: {int(dist)}cm")
+            if self.alert_callback and (current_time - self.last_alert_time >= self.alert_cooldown):
+                if self.pir_edge_time is not None:
+                    self.trigger_latencies.append(time.monotonic() - self.pir_edge_time)
+                    SENSOR_LATENCY_SECONDS.labels("trigger").observe(self.trigger_latencies[-1])
+                if self.alert_slots.acquire(blocking=False):
+                    SENSOR_ALERTS.inc()
+                    threading.Thread(target=self.run_alert, args=(dist,), daemon=True).start()
+                else:
+                    SENSOR_ALERTS_SKIPPED.inc()
+                    print("Alert skipped: previous alerts still running")
+                self.last_alert_time = current_time
+        else:
+            self.lcd_write("Scanning Area", "No Person")
+            if pir == self.gpio.LOW:
+                self.monitoringActive = False
+                self.pir_edge_time = None
+                self.rangefinder.pause()
+                self.lcd_write("System Ready", "Monitoring...")
+                log_event("motion_reset", {"msg": "monitor reset"})
+
+    def run_alert(self, distance):
+        try:
+            self.alert_callback(distance)
+        finally:
+            self.alert_slots.release()
+
+    def show_idle(self):
+        current_hour = time.localtime().tm_hour
+        time_str = f"{current_hour:02d}:{time.localtime().tm_min:02d}"
+        status = "Dark" if self.is_dark else "Light"
+        self.lcd_write(f"DoorCam {time_str}", f"Ready - {status}")
+
+    def on_pir_edge(self, channel):
+        if self.gpio.input(PIR_PIN) == self.gpio.HIGH and not self.monitoringActive:
+            self.pir_edge_time = time.monotonic()
+        self.wake.set()
+
+    def on_ldr_edge(self, channel):
+        self.wake.set()
+
+    def on_range_reading(self, distance):
+        self.wake.set()
+
+    def setup_edge_detection(self):
+        try:
+            self.gpio.add_event_detect(PIR_PIN, self.gpio.BOTH, callback=self.on_pir_edge,
+                                       bouncetime=self.pir_debounce_ms)
+            self.gpio.add_event_detect(LDR_PIN, self.gpio.BOTH, callback=self.on_ldr_edge,
+                                       bouncetime=self.ldr_debounce_ms)
+            return True
+        except Exception as e:
+            print(f"Edge detection unavailable, falling back to polling: {e}")
+            for pin in (PIR_PIN, LDR_PIN):
+                try:
+                    self.gpio.remove_event_detect(pin)
+                except Exception:
+                    pass
+            return False
+
+    def idle_timeout(self, pir, current_time):
+        timeout = 60 - time.localtime().tm_sec
+        timeout = min(timeout, self.lcd_refresh_period - (current_time - self.last_lcd_refresh))
+        if pir == self.gpio.HIGH:
+            timeout = min(timeout, self.pir_cooldown - (current_time - self.last_pir_time))
+        return max(0.05, timeout)
+
+    def latency_stats(self):
+        def summary(samples):
+            samples = sorted(samples)
+            if not samples:
+                return None
+            return {
+                "count": len(samples),
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "max": samples[-1],
+            }
+        return {
+            "mode": self.mode,
+            "motion": summary(self.motion_latencies),
+            "trigger": summary(self.trigger_latencies),
+        }
+
     def run(self):
         print("Sensors thread running.")
+        self.rangefinder.start()
         try:
-            while True:
-                try:
-                    pir = GPIO.input(PIR_PIN)
-                    current_time = time.time()
-                    
-                    self.lcd_refresh_counter += 1
-                    if self.lcd_refresh_counter >= self.lcd_refresh_interval:
-                        self.refresh_lcd_display()
-                        self.lcd_refresh_counter = 0
-                    
-                    is_dark = self.check_light_level()
-                    if is_dark:
-                        self.control_light(True)
-                    else:
-                        self.control_light(False)
-
-                    if pir == GPIO.HIGH and not self.monitoringActive:
-                        if current_time - self.last_pir_time >= self.pir_cooldown:
-                            self.monitoringActive = True
-                            self.last_pir_time = current_time
-                            print("PIR triggered: monitoring active")
-                            self.lcd_write("Motion Detected", "Scanning...")
-                            log_event("motion", {"msg": "PIR triggered"})
-
-                    if self.monitoringActive:
-                        dist = self.get_distance()
-                        if 0 < dist <= 40:
-                            self.lcd_write("Verification...", f"Range: {int(dist)}cm")
-                            if self.alert_callback and (current_time - self.last_alert_time >= self.alert_cooldown):
-                                threading.Thread(target=self.alert_callback, args=(dist,), daemon=True).start()
-                                self.last_alert_time = current_time
-                        else:
-                            self.lcd_write("Scanning Area", "No Person")
-                            if pir == GPIO.LOW:
-                                self.monitoringActive = False
-                                self.lcd_write("System Ready", "Monitoring...")
-                                log_event("motion_reset", {"msg": "monitor reset"})
-                        time.sleep(0.5)
-                    else:
-                        current_hour = time.localtime().tm_hour
-                        time_str = f"{current_hour:02d}:{time.localtime().tm_min:02d}"
-                        status = "Dark" if self.is_dark else "Light"
-                        self.lcd_write(f"DoorCam {time_str}", f"Ready - {status}")
-                        time.sleep(0.5)
-                except Exception as e:
-                    print(f"Sensor loop error: {e}")
-                    time.sleep(1)
+            if self.mode == "event" and self.setup_edge_detection():
+                print("Sensors using edge detection")
+                self.run_events()
+            else:
+                self.mode = "poll"
+                self.run_polling()
         except KeyboardInterrupt:
             print("Sensors stopped by user")
         except Exception as e:
             print(f"Fatal sensor error: {e}")
         finally:
             self.cleanup()
-    
+
+    def run_polling(self):
+        loop_seconds = SENSOR_LOOP_SECONDS.labels("poll")
+        while True:
+            try:
+                start = time.perf_counter()
+                pir = self.gpio.input(PIR_PIN)
+                current_time = time.time()
+
+                self.maybe_refresh_lcd()
+                self.update_light()
+                self.start_session(pir, current_time)
+
+                if self.monitoringActive:
+                    self.monitor_step(pir, current_time)
+                else:
+                    self.show_idle()
+                loop_seconds.observe(time.perf_counter() - start)
+                time.sleep(0.5)
+            except Exception as e:
+                print(f"Sensor loop error: {e}")
+                time.sleep(1)
+
+    def run_events(self):
+        loop_seconds = SENSOR_LOOP_SECONDS.labels("event")
+        timeout = 0
+        while True:
+            try:
+                self.wake.wait(timeout)
+                self.wake.clear()
+                start = time.perf_counter()
+
+                self.maybe_refresh_lcd()
+                self.update_light()
+
+                pir = self.gpio.input(PIR_PIN)
+                self.start_session(pir, time.time())
+
+                while self.monitoringActive:
+                    self.monitor_step(self.gpio.input(PIR_PIN), time.time())
+                    loop_seconds.observe(time.perf_counter() - start)
+                    woke = self.wake.wait(self.range_interval)
+                    start = time.perf_counter()
+                    if woke:
+                        self.wake.clear()
+                        self.update_light()
+
+                self.show_idle()
+                loop_seconds.observe(time.perf_counter() - start)
+                timeout = self.idle_timeout(self.gpio.input(PIR_PIN), time.time())
+            except Exception as e:
+                print(f"Sensor loop error: {e}")
+                time.sleep(1)
+                timeout = 0
+
     def cleanup(self):
         try:
             print("Starting cleanup...")
             self.control_light(False)
-            GPIO.output(RELAY_PIN, GPIO.LOW)
+            self.gpio.output(RELAY_PIN, self.gpio.LOW)
             self.door_locked = True
             print("Door locked on cleanup")
             
-            if self.lcd:
-                try:
-                    self.lcd.clear()
-                    self.lcd.write_string("System Shutdown")
-                    time.sleep(1)
-                    self.lcd.close(clear=True)
-                    print("LCD cleanup complete")
-                except:
-                    pass
-            
-            GPIO.cleanup()
+            self.lcd_renderer.stop("System Shutdown")
+            print("LCD cleanup complete")
+
+            self.gpio.cleanup()
             print("GPIO cleanup complete")
         except Exception as e:
             print(f"Cleanup error: {e}")
@@ -0,0 +1,377 @@
+import sys
+import threading
+import time
+import types
+import uuid
+
+import numpy as np
+
+class LatencyProfile:
+    def __init__(self, firebase_write=0.05, firebase_read=0.05, fcm=0.3, sms=0.8,
+                 storage_upload=0.5, i2c_char=0.0005, camera_fps=30.0):
+        self.firebase_write = firebase_write
+        self.firebase_read = firebase_read
+        self.fcm = fcm
+        self.sms = sms
+        self.storage_upload = storage_upload
+        self.i2c_char = i2c_char
+        self.camera_fps = camera_fps
+
+class FakeCamera:
+    def __init__(self, fps=30.0, size=(640, 480)):
+        self.fps = fps
+        self.size = size
+        self.lock = threading.Lock()
+        self.scene = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        self.next_frame = 0
+        self.opened = True
+        self.frames_served = 0
+
+    def set_scene(self, frame_bgr):
+        import cv2
+        width, height = self.size
+        if frame_bgr.shape[1] != width or frame_bgr.shape[0] != height:
+            scale = min(width / frame_bgr.shape[1], height / frame_bgr.shape[0])
+            resized = cv2.resize(frame_bgr, (int(frame_bgr.shape[1] * scale), int(frame_bgr.shape[0] * scale)))
+            canvas = np.full((height, width, 3), 100, dtype=np.uint8)
+            top = (height - resized.shape[0]) // 2
+            left = (width - resized.shape[1]) // 2
+            canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+            frame_bgr = canvas
+        with self.lock:
+            self.scene = frame_bgr
+
+    def set_blank(self):
+        rng = np.random.default_rng()
+        self.set_scene(rng.integers(90, 110, (self.size[1], self.size[0], 3), dtype=np.uint8))
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame, time.monotonic()) + 1.0 / self.fps
+        with self.lock:
+            frame = self.scene.copy()
+        self.frames_served += 1
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        return 0
+
+class FakeCharLCD:
+    def __init__(self, i2c_expander=None, address=None, port=1, cols=16, rows=2, char_delay=0.0, **kwargs):
+        self.cols = cols
+        self.rows = rows
+        self.char_delay = char_delay
+        self.buffer = [[" "] * cols for _ in range(rows)]
+        self._cursor_pos = (0, 0)
+        self.cursor_mode = "hide"
+        self.chars_written = 0
+
+    @property
+    def cursor_pos(self):
+        return self._cursor_pos
+
+    @cursor_pos.setter
+    def cursor_pos(self, pos):
+        time.sleep(self.char_delay)
+        self._cursor_pos = pos
+
+    def write_string(self, text):
+        row, col = self._cursor_pos
+        for ch in text:
+            if col >= self.cols:
+                break
+            self.buffer[row][col] = ch
+            col += 1
+        self._cursor_pos = (row, col)
+        self.chars_written += len(text)
+        time.sleep(self.char_delay * len(text))
+
+    def clear(self):
+        self.buffer = [[" "] * self.cols for _ in range(self.rows)]
+        self._cursor_pos = (0, 0)
+        time.sleep(self.char_delay * 4)
+
+    def close(self, clear=False):
+        if clear:
+            self.clear()
+
+    def lines(self):
+        return ["".join(row) for row in self.buffer]
+
+class FakeSMBus:
+    def __init__(self, bus=1, addresses=(0x27,)):
+        self.addresses = addresses
+
+    def write_quick(self, addr):
+        if addr not in self.addresses:
+            raise OSError(121, "Remote I/O error")
+
+    def close(self):
+        pass
+
+class FakeDatabase:
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.root = {}
+        self.writes = 0
+        self.reads = 0
+
+    def reference(self, path="/"):
+        return FakeReference(self, path)
+
+    def split(self, path):
+        return [p for p in path.strip("/").split("/") if p]
+
+    def get(self, path):
+        with self.lock:
+            node = self.root
+            for part in self.split(path):
+                if not isinstance(node, dict) or part not in node:
+                    return None
+                node = node[part]
+            return node
+
+    def set(self, path, value):
+        parts = self.split(path)
+        with self.lock:
+            if not parts:
+                self.root = value if isinstance(value, dict) else {}
+                return
+            node = self.root
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            if value is None:
+                node.pop(parts[-1], None)
+            else:
+                node[parts[-1]] = value
+
+class FakeReference:
+    def __init__(self, database, path):
+        self.database = database
+        self.path = "/" + "/".join(database.split(path))
+        self.key = database.split(path)[-1] if database.split(path) else None
+
+    def child(self, path):
+        return FakeReference(self.database, self.path.rstrip("/") + "/" + path)
+
+    def get(self):
+        time.sleep(self.database.latency.firebase_read)
+        self.database.reads += 1
+        return self.database.get(self.path)
+
+    def set(self, value):
+        time.sleep(self.database.latency.firebase_write)
+        self.database.writes += 1
+        self.database.set(self.path, value)
+
+    def update(self, values):
+        time.sleep(self.database.latency.firebase_write)
+        self.database.writes += 1
+        for key, value in values.items():
+            self.database.set(self.path.rstrip("/") + "/" + key, value)
+
+    def push(self, value=""):
+        ref = self.child(uuid.uuid4().hex[:20])
+        ref.set(value)
+        return ref
+
+    def listen(self, callback):
+        event = types.SimpleNamespace(event_type="put", path="/", data=self.database.get(self.path))
+        callback(event)
+        return types.SimpleNamespace(close=lambda: None)
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.public_url = f"https://storage.local/{name}"
+        self.size = 0
+
+    def upload_from_string(self, data, content_type=None):
+        time.sleep(self.bucket.latency.storage_upload)
+        self.size = len(data)
+        self.bucket.blobs[self.name] = data
+
+    def upload_from_file(self, file_obj, content_type=None, size=None, **kwargs):
+        self.upload_from_string(file_obj.read(), content_type)
+
+    def make_public(self):
+        pass
+
+class FakeBucket:
+    def __init__(self, latency):
+        self.latency = latency
+        self.blobs = {}
+
+    def blob(self, name, **kwargs):
+        return FakeBlob(self, name)
+
+class FakeTwilio:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = []
+        fake = self
+
+        class Messages:
+            def create(self, body=None, from_=None, to=None):
+                time.sleep(fake.latency.sms)
+                sid = "SM" + uuid.uuid4().hex
+                fake.sent.append({"sid": sid, "body": body, "from": from_, "to": to})
+                return types.SimpleNamespace(sid=sid)
+
+        class Client:
+            def __init__(self, sid=None, token=None, http_client=None, **kwargs):
+                self.messages = Messages()
+
+        class TwilioHttpClient:
+            def __init__(self, timeout=None, **kwargs):
+                self.timeout = timeout
+
+        self.Client = Client
+        self.TwilioHttpClient = TwilioHttpClient
+
+class Simulation:
+    def __init__(self, latency=None, device_tokens=("bench-device-token",)):
+        self.latency = latency or LatencyProfile()
+        self.camera = FakeCamera(fps=self.latency.camera_fps)
+        self.database = FakeDatabase(self.latency)
+        self.bucket = FakeBucket(self.latency)
+        self.twilio = FakeTwilio(self.latency)
+        self.lcds = []
+        self.fcm_sent = []
+        self.database.set("/doorcam/device_tokens", {f"t{i}": t for i, t in enumerate(device_tokens)})
+
+    def make_lcd(self, *args, **kwargs):
+        lcd = FakeCharLCD(*args, char_delay=self.latency.i2c_char, **kwargs)
+        self.lcds.append(lcd)
+        return lcd
+
+    def firebase_modules(self):
+        sim = self
+        pkg = types.ModuleType("firebase_admin")
+        pkg.initialize_app = lambda *args, **kwargs: types.SimpleNamespace(name="[DEFAULT]")
+
+        credentials = types.ModuleType("firebase_admin.credentials")
+        credentials.Certificate = lambda path: path
+
+        auth = types.ModuleType("firebase_admin.auth")
+        auth.verify_id_token = lambda token, **kwargs: {"uid": "bench", "exp": time.time() + 3600}
+        auth.create_session_cookie = lambda token, expires_in=None: "session-" + token
+        auth.verify_session_cookie = lambda cookie, **kwargs: {"uid": "bench", "exp": time.time() + 3600}
+
+        db = types.ModuleType("firebase_admin.db")
+        db.reference = self.database.reference
+
+        messaging = types.ModuleType("firebase_admin.messaging")
+
+        class Notification:
+            def __init__(self, title=None, body=None):
+                self.title = title
+                self.body = body
+
+        class MulticastMessage:
+            def __init__(self, tokens=None, notification=None, data=None):
+                self.tokens = tokens
+                self.notification = notification
+                self.data = data
+
+        def send_multicast(message):
+            time.sleep(sim.latency.fcm)
+            sim.fcm_sent.append(message)
+            return types.SimpleNamespace(success_count=len(message.tokens), failure_count=0)
+
+        messaging.Notification = Notification
+        messaging.MulticastMessage = MulticastMessage
+        messaging.send_multicast = send_multicast
+        messaging.send_each_for_multicast = send_multicast
+
+        storage = types.ModuleType("firebase_admin.storage")
+        storage.bucket = lambda name=None: self.bucket
+
+        for name, module in (("credentials", credentials), ("auth", auth), ("db", db),
+                             ("messaging", messaging), ("storage", storage)):
+            setattr(pkg, name, module)
+        return {"firebase_admin": pkg, "firebase_admin.credentials": credentials,
+                "firebase_admin.auth": auth, "firebase_admin.db": db,
+                "firebase_admin.messaging": messaging, "firebase_admin.storage": storage}
+
+    def twilio_modules(self):
+        pkg = types.ModuleType("twilio")
+        rest = types.ModuleType("twilio.rest")
+        rest.Client = self.twilio.Client
+        http = types.ModuleType("twilio.http")
+        http_client = types.ModuleType("twilio.http.http_client")
+        http_client.TwilioHttpClient = self.twilio.TwilioHttpClient
+        pkg.rest = rest
+        pkg.http = http
+        http.http_client = http_client
+        return {"twilio": pkg, "twilio.rest": rest, "twilio.http": http,
+                "twilio.http.http_client": http_client}
+
+    def i2c_modules(self):
+        smbus2 = types.ModuleType("smbus2")
+        smbus2.SMBus = FakeSMBus
+        rplcd = types.ModuleType("RPLCD")
+        i2c = types.ModuleType("RPLCD.i2c")
+        i2c.CharLCD = self.make_lcd
+        rplcd.i2c = i2c
+        return {"smbus2": smbus2, "RPLCD": rplcd, "RPLCD.i2c": i2c}
+
+    def audio_modules(self):
+        pyttsx3 = types.ModuleType("pyttsx3")
+        pyttsx3.init = lambda *args, **kwargs: types.SimpleNamespace(
+            setProperty=lambda *a: None, say=lambda *a: None, runAndWait=lambda: None)
+
+        pyaudio = types.ModuleType("pyaudio")
+        pyaudio.paInt16 = 8
+
+        class Stream:
+            def __init__(self, rate=16000, channels=1, **kwargs):
+                self.rate = rate
+                self.channels = channels
+
+            def read(self, frames, exception_on_overflow=True):
+                time.sleep(frames / self.rate)
+                return b"\0" * (2 * frames * self.channels)
+
+            def stop_stream(self):
+                pass
+
+            def close(self):
+                pass
+
+        class PyAudio:
+            def open(self, format=None, channels=1, rate=16000, **kwargs):
+                return Stream(rate=rate, channels=channels)
+
+            def get_sample_size(self, fmt):
+                return 2
+
+            def terminate(self):
+                pass
+
+        pyaudio.PyAudio = PyAudio
+        return {"pyttsx3": pyttsx3, "pyaudio": pyaudio}
+
+    def install(self):
+        modules = {}
+        modules.update(self.firebase_modules())
+        modules.update(self.twilio_modules())
+        modules.update(self.i2c_modules())
+        modules.update(self.audio_modules())
+        sys.modules.update(modules)
+
+        import cv2
+        cv2.VideoCapture = lambda source, *args: self.camera
@@ -0,0 +1,17 @@
+import warnings
+import numpy as np
+import pytest
+from audio_relay import mulaw_decode, mulaw_encode
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    audioop = pytest.importorskip("audioop")
+
+ALL_SAMPLES = np.arange(-32768, 32768, dtype='<i2').tobytes()
+
+def test_mulaw_encode_matches_audioop():
+    assert mulaw_encode(ALL_SAMPLES) == audioop.lin2ulaw(ALL_SAMPLES, 2)
+
+def test_mulaw_decode_matches_audioop():
+    codes = bytes(range(256))
+    assert mulaw_decode(codes) == audioop.ulaw2lin(codes, 2)
@@ -0,0 +1,154 @@
+import sys
+import time
+
+try:
+    import firebase_admin
+except ImportError:
+    from simulation import LatencyProfile, Simulation
+    sys.modules.update(Simulation(LatencyProfile()).firebase_modules())
+
+import firebase_client
+from firebase_client import TokenCache
+
+def claims(ttl=3600, **extra):
+    return dict(uid="owner", exp=time.time() + ttl, **extra)
+
+def test_token_cache_hit_and_miss():
+    cache = TokenCache()
+    cache.put("a", claims())
+    assert cache.get("a")["uid"] == "owner"
+    assert cache.get("b") is None
+
+def test_token_cache_keys_by_hash():
+    cache = TokenCache()
+    cache.put("secret-token", claims())
+    assert "secret-token" not in cache.entries
+    assert TokenCache.key("secret-token") in cache.entries
+
+def test_token_cache_expires_entries():
+    cache = TokenCache()
+    cache.put("a", claims(ttl=10))
+    assert cache.get("a", now=time.time() + 11) is None
+    assert len(cache) == 0
+
+def test_token_cache_skips_expired_or_unbounded_claims():
+    cache = TokenCache()
+    cache.put("expired", claims(ttl=-1))
+    cache.put("no-exp", {"uid": "owner"})
+    cache.put("not-a-dict", "claims")
+    assert len(cache) == 0
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(maxsize=2)
+    cache.put("a", claims())
+    cache.put("b", claims())
+    cache.get("a")
+    cache.put("c", claims())
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+
+def test_token_cache_invalidate():
+    cache = TokenCache()
+    cache.put("a", claims())
+    cache.invalidate("a")
+    assert cache.get("a") is None
+
+def test_verify_caches_until_forgotten(monkeypatch):
+    monkeypatch.setattr(firebase_client, "_token_cache", TokenCache())
+    calls = []
+
+    def verify(token):
+        calls.append(token)
+        return claims()
+
+    assert firebase_client._verify_cached("tok", "id_token", verify)["uid"] == "owner"
+    assert firebase_client._verify_cached("tok", "id_token", verify)["uid"] == "owner"
+    assert calls == ["tok"]
+    firebase_client.forget_token("tok")
+    firebase_client._verify_cached("tok", "id_token", verify)
+    assert calls == ["tok", "tok"]
+
+def test_verify_rejections_are_not_cached(monkeypatch):
+    monkeypatch.setattr(firebase_client, "_token_cache", TokenCache())
+
+    def reject(token):
+        raise ValueError("revoked")
+
+    assert firebase_client._verify_cached("tok", "session", reject) is None
+    assert len(firebase_client._token_cache) == 0
+
+class FlakyDb:
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def reference(self, path):
+        return self
+
+    def update(self, values):
+        if self.fail:
+            raise ConnectionError("offline")
+        self.batches.append(sorted(r["event"] for r in values.values()))
+
+def writer(tmp_path, **kwargs):
+    kwargs.setdefault("flush_interval", 0.05)
+    kwargs.setdefault("retry_interval", 0)
+    return firebase_client.EventWriter(spool_path=str(tmp_path / "spool.jsonl"), **kwargs)
+
+def test_event_writer_drops_when_queue_is_full(tmp_path):
+    events = writer(tmp_path, maxsize=2)
+    assert events.enqueue("a") and events.enqueue("b")
+    assert not events.enqueue("c")
+    assert events.stats()["dropped"] == 1
+
+def test_event_writer_batches_queued_events(tmp_path):
+    events = writer(tmp_path, batch_size=3)
+    for name in "abcde":
+        events.enqueue(name)
+    assert [r["event"] for r in events.next_batch()] == ["a", "b", "c"]
+    assert [r["event"] for r in events.next_batch()] == ["d", "e"]
+
+def test_event_writer_writes_one_update_per_batch(tmp_path, monkeypatch):
+    db = FlakyDb()
+    monkeypatch.setattr(firebase_client, "db", db)
+    events = writer(tmp_path, batch_size=10)
+    for name in "abc":
+        events.enqueue(name)
+    events.start()
+    assert events.flush(2)
+    assert db.batches == [["a", "b", "c"]]
+    assert events.stats()["written"] == 3
+
+def test_event_writer_spools_offline_and_replays(tmp_path, monkeypatch):
+    db = FlakyDb()
+    db.fail = True
+    monkeypatch.setattr(firebase_client, "db", db)
+    events = writer(tmp_path, retry_interval=0.2)
+    events.start()
+    events.enqueue("a")
+    assert events.flush(2)
+    events.enqueue("b")
+    assert events.flush(2)
+    stats = events.stats()
+    assert (stats["online"], stats["spooled"], stats["failures"]) == (False, 2, 1)
+    assert events.spool_size() > 0
+
+    db.fail = False
+    events.enqueue("c")
+    deadline = time.time() + 2
+    while not events.online and time.time() < deadline:
+        time.sleep(0.05)
+    assert events.flush(2)
+    assert events.online
+    assert sorted(e for batch in db.batches for e in batch) == ["a", "b", "c"]
+    stats = events.stats()
+    assert stats["replayed"] == stats["spooled"] >= 2
+    assert events.spool_size() == 0
+
+def test_event_writer_caps_the_spool(tmp_path):
+    events = writer(tmp_path, spool_max_bytes=200)
+    events.spool([{"event": "a" * 150, "data": None, "timestamp": 0}])
+    events.spool([{"event": "b" * 150, "data": None, "timestamp": 0}])
+    stats = events.stats()
+    assert (stats["spooled"], stats["dropped"]) == (1, 1)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from gallery_index import BruteForceIndex, IVFIndex, evaluate, index_kind, make_index
+
+def clustered(n, clusters=50, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    assigned = rng.integers(0, clusters, n)
+    vectors = centers[assigned] + 0.1 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors.astype(np.float32), [f"p{i}" for i in range(n)]
+
+def exact(vectors, probes, k):
+    d = np.linalg.norm(probes[:, None, :] - vectors[None, :, :], axis=2)
+    return np.sort(d, axis=1)[:, :k], np.argsort(d, axis=1)[:, :k]
+
+def test_brute_force_matches_numpy():
+    vectors, labels = clustered(500)
+    probes = vectors[:20] + 0.01
+    index = BruteForceIndex()
+    index.build(vectors, labels)
+    distances, ids = index.search(probes, k=5)
+    want_d, want_ids = exact(vectors, probes, 5)
+    np.testing.assert_allclose(distances, want_d, atol=1e-3)
+    assert (ids == want_ids).all()
+    assert index.label(ids[0, 0]) == "p0"
+
+def test_search_pads_short_results():
+    index = BruteForceIndex()
+    index.build(np.ones((2, 128)), ["a", "b"])
+    distances, ids = index.search(np.ones(128), k=4)
+    assert list(ids[0, 2:]) == [-1, -1]
+    assert np.isinf(distances[0, 2:]).all()
+    assert index.label(-1) is None
+
+def test_ivf_recall_against_brute_force():
+    vectors, labels = clustered(4000)
+    probes = vectors[::40] + 0.01
+    reference, ivf = BruteForceIndex(), IVFIndex()
+    reference.build(vectors, labels)
+    ivf.build(vectors, labels)
+    assert ivf.trained_size == 4000
+    assert evaluate(ivf, reference, probes)["recall"] >= 0.95
+
+def test_add_after_build_is_searchable_without_retraining():
+    vectors, labels = clustered(1000)
+    ivf = IVFIndex()
+    ivf.build(vectors, labels)
+    new = vectors[:3] + 0.001
+    ids = ivf.add(new, ["x", "y", "z"])
+    assert list(ids) == [1000, 1001, 1002]
+    assert ivf.trained_size == 1000
+    _, found = ivf.search(new, k=1)
+    assert [ivf.label(i) for i in found[:, 0]] == ["x", "y", "z"]
+    assert len(ivf) == 1003
+
+def test_needs_training_after_doubling_and_retrain():
+    vectors, labels = clustered(1200)
+    ivf = IVFIndex()
+    ivf.build(vectors[:600], labels[:600])
+    assert not ivf.needs_training()
+    ivf.add(vectors[600:], labels[600:])
+    assert ivf.needs_training()
+    ivf.train()
+    assert not ivf.needs_training()
+    assert ivf.trained_size == 1200
+    assert len(ivf.lists) == int(np.sqrt(1200))
+
+def test_copy_is_independent():
+    vectors, labels = clustered(100)
+    index = BruteForceIndex()
+    index.build(vectors[:50], labels[:50])
+    copy = index.copy()
+    copy.add(vectors[50:], labels[50:])
+    assert len(index) == 50 and len(copy) == 100
+    assert index.stats()["encodings"] == 50
+
+@pytest.mark.parametrize("size, kind", [(10, "brute"), (10 ** 6, "ivf")])
+def test_auto_kind_by_size(size, kind):
+    assert index_kind(size, "auto") == kind
+    assert make_index("auto", size).kind == kind
@@ -0,0 +1,95 @@
+from lcd_renderer import LcdRenderer
+from simulation import FakeCharLCD
+
+class RecordingLCD(FakeCharLCD):
+    def __init__(self, fail=False, **kwargs):
+        super().__init__(**kwargs)
+        self.fail = fail
+        self.writes = []
+
+    def write_string(self, text):
+        if self.fail:
+            raise OSError(121, "Remote I/O error")
+        self.writes.append((self.cursor_pos, text))
+        super().write_string(text)
+
+def renderer(display=None, **kwargs):
+    display = display or RecordingLCD()
+    return LcdRenderer(lambda: display, **kwargs), display
+
+def test_first_render_writes_every_row():
+    lcd, display = renderer()
+    lcd.show("Door Locked", "Welcome")
+    lcd.render()
+    assert display.lines() == ["Door Locked     ", "Welcome         "]
+    assert lcd.cells_written == 32
+
+def test_unchanged_text_is_not_rewritten():
+    lcd, display = renderer()
+    lcd.show("Door Locked")
+    lcd.render()
+    display.writes.clear()
+    lcd.show("Door Locked")
+    lcd.render()
+    assert display.writes == []
+
+def test_only_changed_cells_are_written():
+    lcd, display = renderer()
+    lcd.show("Dist: 120cm", "Scanning")
+    lcd.render()
+    display.writes.clear()
+    lcd.show("Dist: 95 cm", "Scanning")
+    lcd.render()
+    assert display.writes == [((0, 6), "95 ")]
+    assert display.lines()[0] == "Dist: 95 cm     "
+
+def test_nearby_changes_merge_into_one_write():
+    lcd, display = renderer(merge_gap=1)
+    lcd.show("abcdef")
+    lcd.render()
+    display.writes.clear()
+    lcd.show("XbXdef")
+    lcd.render()
+    assert display.writes == [((0, 0), "XbX")]
+
+def test_distant_changes_are_written_separately():
+    lcd, display = renderer(merge_gap=1)
+    lcd.show("abcdef")
+    lcd.render()
+    display.writes.clear()
+    lcd.show("XbcdeY")
+    lcd.render()
+    assert display.writes == [((0, 0), "X"), ((0, 5), "Y")]
+
+def test_show_truncates_and_pads():
+    lcd, display = renderer(cols=4, rows=2)
+    lcd.show("too long", "ok", "extra row")
+    lcd.render()
+    assert display.buffer[0][:4] == list("too ")
+    assert display.buffer[1][:4] == list("ok  ")
+
+def test_invalidate_forces_full_redraw():
+    lcd, display = renderer()
+    lcd.show("Hello")
+    lcd.render()
+    display.writes.clear()
+    lcd.invalidate()
+    lcd.render()
+    assert [text for _, text in display.writes] == ["Hello           ", " " * 16]
+
+def test_write_errors_reopen_the_display():
+    opened = []
+
+    def open_display():
+        opened.append(RecordingLCD(fail=len(opened) == 0))
+        return opened[-1]
+
+    lcd = LcdRenderer(open_display, max_errors=2, reopen_interval=0)
+    lcd.show("Hello")
+    lcd.render()
+    assert lcd.error_count == 1 and lcd.shown is None
+    lcd.render()
+    assert lcd.display is None
+    lcd.render()
+    assert len(opened) == 2
+    assert opened[1].lines()[0] == "Hello           "
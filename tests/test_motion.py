@@ -0,0 +1,90 @@
+import concurrent.futures
+import time
+import numpy as np
+import pytest
+import motion
+from motion import MotionDetector, MotionGate, crop_roi, parse_roi
+
+class Rig:
+    id = "test"
+    hub = None
+
+def gate(on_motion=None, **kwargs):
+    return MotionGate(Rig(), on_motion or (lambda rig, burst, score: None), **kwargs)
+
+def done(outcome):
+    future = concurrent.futures.Future()
+    future.set_result(outcome)
+    return future
+
+def frame(value=0, box=None):
+    image = np.full((120, 160, 3), value, dtype=np.uint8)
+    if box:
+        x0, y0, x1, y1 = box
+        image[y0:y1, x0:x1] = 255
+    return image
+
+def test_parse_roi_clamps_and_rejects_empty():
+    assert parse_roi("-1,0,0.5,2") == (0.0, 0.0, 0.5, 1.0)
+    with pytest.raises(ValueError):
+        parse_roi("0.5,0,0.5,1")
+
+def test_crop_roi_keeps_at_least_one_pixel():
+    assert crop_roi(np.zeros((10, 10)), (0.5, 0.5, 0.5, 0.5)).shape == (1, 1)
+
+def test_detector_ignores_global_lighting_change():
+    detector = MotionDetector(width=160)
+    detector.update(frame(80))
+    assert detector.update(frame(120)) == (False, 0.0)
+
+def test_detector_reports_local_motion_inside_roi_only():
+    detector = MotionDetector(width=160, roi="0,0,0.5,1")
+    detector.update(frame(80))
+    assert not detector.update(frame(80, box=(100, 20, 150, 100)))[0]
+    assert detector.update(frame(80, box=(10, 20, 60, 100)))[0]
+
+def test_gate_requires_confirmed_motion():
+    calls = []
+    g = gate(lambda rig, burst, score: calls.append(len(burst)) or done("unlocked"), confirm=2)
+    g.step(True, "a", 1.0)
+    assert calls == []
+    g.step(True, "b", 1.2)
+    assert calls == [2]
+
+def test_gate_backs_off_after_no_face():
+    calls = []
+    g = gate(lambda rig, burst, score: calls.append(1) or done("no_face"), confirm=1, retry=1.0, max_backoff=4.0)
+    now = time.monotonic()
+    g.step(True, "a", now)
+    g.step(True, "b", now)
+    assert (len(calls), g.backoff) == (1, 2.0)
+    g.step(True, "c", now + 0.5)
+    assert len(calls) == 1
+    g.step(True, "d", now + 1.1)
+    g.step(True, "e", now + 1.1)
+    assert (len(calls), g.backoff) == (2, 4.0)
+
+def test_gate_waits_while_recognition_is_busy():
+    calls = []
+    g = gate(lambda rig, burst, score: calls.append(1), busy=lambda: True, confirm=1)
+    g.step(True, "a", 1.0)
+    assert calls == []
+
+def test_interval_follows_activity_and_cpu_budget():
+    g = gate(fps=5, idle_fps=2, cpu_budget=0.05)
+    assert g.interval(100.0) == pytest.approx(0.5)
+    g.last_motion = 99.5
+    assert g.interval(100.0) == pytest.approx(0.2)
+    g.cost = 0.05
+    assert g.interval(100.0) == pytest.approx(1.0)
+
+def test_interval_never_divides_by_zero():
+    g = gate(cpu_budget=0.05)
+    g.cost = 1e9
+    assert g.interval(100.0) == pytest.approx(1.0 / motion.MOTION_MIN_FPS)
+
+@pytest.mark.parametrize("rates", [(0, 2), (5, 0), (-1, 2)])
+def test_rates_must_be_positive(rates):
+    fps, idle_fps = rates
+    with pytest.raises(ValueError):
+        gate(fps=fps, idle_fps=idle_fps)
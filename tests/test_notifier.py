@@ -0,0 +1,74 @@
+import threading
+import time
+from notifier import NotificationDispatcher
+
+def deliver(dispatcher, name, payload=None):
+    return dispatcher.dispatch(payload or {}, channels=[name])[name].result(5)
+
+def test_sent_on_first_attempt():
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("push", lambda payload: "ok")
+    outcome = deliver(dispatcher, "push")
+    assert (outcome["status"], outcome["attempts"], outcome["result"]) == ("sent", 1, "ok")
+    assert dispatcher.stats()["push"]["sent"] == 1
+
+def test_retries_transient_errors():
+    calls = []
+
+    def flaky(payload):
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("refused")
+        return "ok"
+
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("push", flaky, retries=2, backoff=0.01)
+    outcome = deliver(dispatcher, "push")
+    assert (outcome["status"], outcome["attempts"]) == ("sent", 3)
+
+def test_errors_that_are_not_retryable_fail_once():
+    calls = []
+
+    def ambiguous(payload):
+        calls.append(1)
+        raise TimeoutError("read timed out")
+
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("sms", ambiguous, retries=2, backoff=0.01,
+                        retryable=lambda e: not isinstance(e, TimeoutError))
+    outcome = deliver(dispatcher, "sms")
+    assert (outcome["status"], len(calls)) == ("failed", 1)
+
+def test_false_result_is_skipped():
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("sms", lambda payload: False)
+    assert deliver(dispatcher, "sms")["status"] == "skipped"
+
+def test_deadline_times_out_and_cancels_queued_sends():
+    release = threading.Event()
+    sent = []
+
+    def hang(payload):
+        release.wait(5)
+        sent.append(payload["n"])
+
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("sms", hang, deadline=0.1, retries=0, workers=1)
+    first = dispatcher.dispatch({"n": 1}, channels=["sms"])["sms"]
+    second = dispatcher.dispatch({"n": 2}, channels=["sms"])["sms"]
+    assert first.result(5)["status"] == "timeout"
+    assert second.result(5)["status"] == "timeout"
+    release.set()
+    time.sleep(0.1)
+    assert sent == [1]
+
+def test_hung_channel_does_not_block_others():
+    release = threading.Event()
+    dispatcher = NotificationDispatcher()
+    dispatcher.register("sms", lambda payload: release.wait(5), deadline=0.1, retries=0, workers=1)
+    dispatcher.register("push", lambda payload: "ok", deadline=1.0)
+    results = dispatcher.dispatch({})
+    assert results["push"].result(5)["status"] == "sent"
+    assert results["sms"].result(5)["status"] == "timeout"
+    release.set()
+    dispatcher.shutdown()
@@ -0,0 +1,66 @@
+import time
+from ranging import Rangefinder, SPEED_OF_SOUND_CM_PER_NS
+
+class EchoGPIO:
+    BOTH = "both"
+
+    def __init__(self, distances):
+        self.distances = list(distances)
+        self.callback = None
+        self.writes = []
+
+    def add_event_detect(self, pin, edge, callback):
+        self.callback = callback
+
+    def output(self, pin, value):
+        self.writes.append((value, time.monotonic()))
+        if value or not self.callback or not self.distances:
+            return
+        if len(self.writes) >= 3 and self.writes[-2][0]:
+            distance = self.distances.pop(0)
+            if distance is None:
+                return
+            finder = self.callback.__self__
+            self.callback(pin)
+            finder.edges.append(finder.edges[0] + int(distance * 2 / SPEED_OF_SOUND_CM_PER_NS))
+            finder.echo_done.set()
+
+def rangefinder(gpio=None, **kwargs):
+    return Rangefinder(gpio or EchoGPIO([]), 25, 24, sample_gap=0, **kwargs)
+
+def test_filter_takes_median():
+    assert rangefinder().filter([52.0, 50.0, 51.0]) == 51.0
+
+def test_filter_drops_outliers():
+    assert rangefinder().filter([50.0, 51.0, 300.0, 49.0, 3.0]) == 50.0
+
+def test_filter_without_readings():
+    assert rangefinder().filter([]) == -1
+
+def test_trigger_settles_low_before_pulse():
+    gpio = EchoGPIO([])
+    rangefinder(gpio).trigger()
+    (low, low_at), (high, high_at), (end, _) = gpio.writes
+    assert (low, high, end) == (False, True, False)
+    assert high_at - low_at >= 0.002
+
+def test_measure_times_echo_edges():
+    gpio = EchoGPIO([40, 40, 40])
+    finder = rangefinder(gpio, samples=3)
+    assert finder.setup()
+    assert abs(finder.measure() - 40) < 5
+
+def test_measure_ignores_missing_and_out_of_range_echoes():
+    gpio = EchoGPIO([None, 40, 1000])
+    finder = rangefinder(gpio, samples=3, echo_timeout=0.01)
+    finder.setup()
+    assert abs(finder.measure() - 40) < 5
+
+def test_read_returns_only_fresh_distances():
+    finder = rangefinder()
+    assert finder.read() == -1
+    with finder.cond:
+        finder.distance, finder.updated_at, finder.seq = 42.0, time.monotonic(), 1
+    assert finder.read() == 42.0
+    finder.updated_at -= 5
+    assert finder.read(max_age=1.0) == -1
@@ -0,0 +1,57 @@
+import threading
+import pytest
+from recognition_service import RecognitionService, StaleRequest
+
+class BlockingService(RecognitionService):
+    def __init__(self, **kwargs):
+        super().__init__(face_rec=None, workers=0, **kwargs)
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.processed = []
+
+    def process(self, request):
+        self.started.set()
+        self.release.wait(5)
+        self.processed.append((request.key, request.frames))
+        timing = dict.fromkeys(("queue", "detect", "encode", "match", "total"), 0.0)
+        return [], timing
+
+@pytest.fixture
+def service():
+    svc = BlockingService(max_age=0.2)
+    svc.start()
+    yield svc
+    svc.release.set()
+    svc.stop()
+
+def test_coalesced_request_takes_the_newest_submit_time(service):
+    first = service.submit("door", ["f1"])
+    assert service.started.wait(5)
+    queued = service.submit("door", ["f2"])
+    threading.Event().wait(0.3)
+    coalesced = service.submit("door", ["f3"])
+    assert coalesced is queued
+    service.release.set()
+    assert first.result(5) == []
+    assert queued.result(5) == []
+    assert service.processed[-1] == ("door", ["f3"])
+
+def test_one_request_per_camera_in_flight(service):
+    door = service.submit("door", ["d1"])
+    assert service.started.wait(5)
+    gate = service.submit("gate", ["g1"])
+    threading.Event().wait(0.05)
+    assert sorted(service.stats()["active"]) == ["door", "gate"]
+    service.release.set()
+    door.result(5)
+    gate.result(5)
+
+def test_full_queue_drops_the_oldest_request():
+    svc = RecognitionService(face_rec=None, workers=0, max_pending=2)
+    a = svc.submit("a", [1])
+    svc.submit("b", [1])
+    svc.submit("c", [1])
+    with pytest.raises(StaleRequest):
+        a.result(0)
+    assert list(svc.pending) == ["b", "c"]
+    svc.stop()
@@ -0,0 +1,67 @@
+import concurrent.futures
+import numpy as np
+from visitors import VisitorTracker, crop_face, dhash, hamming, thumbnail
+
+def gradient(flip=False):
+    image = np.tile(np.arange(0, 256, 2, dtype=np.uint8), (96, 1))
+    return np.ascontiguousarray(image[:, ::-1]) if flip else image
+
+def test_dhash_is_stable_under_brightness_and_scale():
+    image = gradient()
+    brighter = np.clip(image.astype(np.int16) + 40, 0, 255).astype(np.uint8)
+    larger = np.repeat(np.repeat(image, 2, axis=0), 2, axis=1)
+    assert hamming(dhash(image), dhash(brighter)) <= 2
+    assert hamming(dhash(image), dhash(larger)) <= 2
+    assert hamming(dhash(image), dhash(gradient(flip=True))) > 32
+
+def test_crop_face_pads_and_clips_to_frame():
+    frame = np.zeros((100, 100, 3), dtype=np.uint8)
+    assert crop_face(frame, (20, 60, 60, 20)).shape[:2] == (64, 64)
+    assert crop_face(frame, (0, 100, 40, 60)).shape[:2] == (52, 52)
+
+def test_thumbnail_is_bounded():
+    data, crop = thumbnail(np.zeros((480, 640, 3), dtype=np.uint8), size=160)
+    assert data.startswith(b"\xff\xd8")
+    assert max(crop.shape[:2]) == 160
+
+def test_new_visitor_then_merged_by_embedding():
+    tracker = VisitorTracker(embedding_distance=0.5)
+    first, new = tracker.check("a1", 0, encoding=np.zeros(128), now=100)
+    assert new
+    again, new = tracker.check("a2", 0xFFFF, encoding=np.full(128, 0.01), now=110)
+    assert not new and again is first
+    assert (first.count, first.last_seen, first.alert_id) == (2, 110, "a1")
+
+def test_different_embedding_is_a_new_visitor_even_if_hash_matches():
+    tracker = VisitorTracker(embedding_distance=0.5)
+    tracker.check("a1", 0, encoding=np.zeros(128), now=100)
+    _, new = tracker.check("a2", 0, encoding=np.full(128, 0.2), now=101)
+    assert new
+
+def test_hash_is_used_without_embeddings():
+    tracker = VisitorTracker(hash_distance=3)
+    tracker.check("a1", 0b1111, now=100)
+    assert not tracker.check("a2", 0b0111, now=101)[1]
+    assert tracker.check("a3", 0b11110000, now=102)[1]
+
+def test_window_expires_visits():
+    tracker = VisitorTracker(window=60)
+    tracker.check("a1", 0, now=100)
+    assert tracker.check("a2", 0, now=161)[1]
+
+def test_repeats_cannot_extend_a_visit_forever():
+    tracker = VisitorTracker(window=60, max_merge=100)
+    tracker.check("a1", 0, now=0)
+    for now in (50, 95):
+        assert not tracker.check("a", 0, now=now)[1]
+    assert tracker.check("a2", 0, now=140)[1]
+
+def test_stats_include_thumbnail_once_uploaded():
+    tracker = VisitorTracker()
+    visit, _ = tracker.check("a1", 0)
+    visit.thumbnail = concurrent.futures.Future()
+    assert tracker.stats()["visits"][0]["thumbnail_url"] is None
+    visit.thumbnail.set_result("https://storage.local/thumbnails/a1.jpg")
+    assert tracker.stats()["visits"][0]["thumbnail_url"].endswith("a1.jpg")
+    tracker.clear()
+    assert tracker.stats()["visits"] == []
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import metrics
+
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", 160))
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", 80))
+DEDUP_WINDOW = float(os.environ.get("DEDUP_WINDOW", 120))
+DEDUP_MAX_MERGE = float(os.environ.get("DEDUP_MAX_MERGE", 900))
+DEDUP_HASH_DISTANCE = int(os.environ.get("DEDUP_HASH_DISTANCE", 10))
+DEDUP_EMBEDDING_DISTANCE = float(os.environ.get("DEDUP_EMBEDDING_DISTANCE", 0.5))
+
+VISITOR_ALERTS = metrics.counter("doorcam_visitor_alerts_total", "Unknown-visitor alerts by dedup decision", ["decision"])
+VISITS_ACTIVE = metrics.gauge("doorcam_visits_active", "Unknown visitors inside the dedup window")
+
+def dhash(image, size=8):
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def crop_face(frame, location=None, margin=0.3):
+    if location is None:
+        return frame
+    top, right, bottom, left = location
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = frame.shape[:2]
+    return frame[max(0, top - pad_y):min(height, bottom + pad_y), max(0, left - pad_x):min(width, right + pad_x)]
+
+def thumbnail(frame, location=None, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    crop = crop_face(frame, location)
+    if crop.size == 0:
+        crop = frame
+    scale = size / float(max(crop.shape[:2]))
+    if scale < 1:
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        return None, crop
+    return buffer.tobytes(), crop
+
+class Visit:
+    def __init__(self, alert_id, phash, encoding, now):
+        self.alert_id = alert_id
+        self.phash = phash
+        self.encoding = None if encoding is None else np.asarray(encoding, dtype=np.float32)
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+        self.thumbnail = None
+
+    def thumbnail_url(self):
+        future = self.thumbnail
+        if future is None or not future.done() or future.exception():
+            return None
+        return future.result()
+
+    def to_dict(self):
+        return {
+            "alert_id": self.alert_id,
+            "count": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "thumbnail_url": self.thumbnail_url(),
+        }
+
+class VisitorTracker:
+    def __init__(self, window=DEDUP_WINDOW, max_merge=DEDUP_MAX_MERGE, hash_distance=DEDUP_HASH_DISTANCE,
+                 embedding_distance=DEDUP_EMBEDDING_DISTANCE):
+        self.window = window
+        self.max_merge = max_merge
+        self.hash_distance = hash_distance
+        self.embedding_distance = embedding_distance
+        self.lock = threading.Lock()
+        self.visits = []
+
+    def prune(self, now):
+        self.visits = [v for v in self.visits
+                       if now - v.last_seen <= self.window and now - v.first_seen <= self.max_merge]
+        VISITS_ACTIVE.set(len(self.visits))
+
+    def same_visitor(self, visit, phash, encoding):
+        if encoding is not None and visit.encoding is not None:
+            distance = float(np.linalg.norm(visit.encoding - np.asarray(encoding, dtype=np.float32)))
+            return distance <= self.embedding_distance
+        return hamming(visit.phash, phash) <= self.hash_distance
+
+    def check(self, alert_id, phash, encoding=None, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.prune(now)
+            for visit in reversed(self.visits):
+                if self.same_visitor(visit, phash, encoding):
+                    visit.count += 1
+                    visit.last_seen = now
+                    VISITOR_ALERTS.labels("merged").inc()
+                    return visit, False
+            visit = Visit(alert_id, phash, encoding, now)
+            self.visits.append(visit)
+            VISITS_ACTIVE.set(len(self.visits))
+        VISITOR_ALERTS.labels("new").inc()
+        return visit, True
+
+    def clear(self):
+        with self.lock:
+            self.visits = []
+        VISITS_ACTIVE.set(0)
+
+    def stats(self):
+        with self.lock:
+            self.prune(time.time())
+            return {"window": self.window, "visits": [v.to_dict() for v in self.visits]}
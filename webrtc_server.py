@@ -1,16 +1,41 @@
 import asyncio
+import fractions
 import json
 import logging
+import os
+import threading
+import time
 from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration, RTCIceServer
-from aiortc.contrib.media import MediaPlayer, MediaRelay
+from aiortc import VideoStreamTrack
+from aiortc.contrib.media import MediaPlayer, MediaRelay, MediaBlackhole
+from aiortc.rtcrtpsender import RTCRtpSender
+from aiortc.sdp import candidate_from_sdp
+from av import VideoFrame
+import cv2
 import sounddevice as sd
 import numpy as np
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-relay = MediaRelay()
-peer_connections = {}
+IDLE_TIMEOUT = float(os.environ.get("WEBRTC_IDLE_TIMEOUT", 60))
+REAP_INTERVAL = float(os.environ.get("WEBRTC_REAP_INTERVAL", 5))
+OFFER_TIMEOUT = 15.0
+VIDEO_CODEC = os.environ.get("WEBRTC_VIDEO_CODEC", "VP8")
+VIDEO_LADDER = ((640, 15), (480, 12), (320, 10), (240, 6))
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+ADAPT_DOWN_LOSS = 0.05
+ADAPT_DOWN_RTT = 0.4
+ADAPT_UP_LOSS = 0.01
+ADAPT_UP_RTT = 0.2
+ADAPT_UP_SAMPLES = 3
+
+RTC_OFFER_SECONDS = metrics.histogram("doorcam_webrtc_offer_seconds", "Time to answer a WebRTC offer")
+RTC_PEERS = metrics.gauge("doorcam_webrtc_peers", "Open WebRTC peer connections")
+RTC_CLOSED = metrics.counter("doorcam_webrtc_closed_total", "Closed WebRTC peer connections", ["reason"])
+RTC_VIDEO_FRAMES = metrics.counter("doorcam_webrtc_video_frames_total", "Frames handed to WebRTC video encoders")
 
 def create_rtc_config():
     return RTCConfiguration([
@@ -18,79 +43,376 @@ def create_rtc_config():
         RTCIceServer("stun:stun1.l.google.com:19302")
     ])
 
-async def create_local_tracks():
-    try:
-        player = MediaPlayer("/dev/null", format="alsa", options={
-            "channels": "1",
-            "sample_rate": "44100"
-        })
-        return player.audio
-    except Exception as e:
-        logger.error(f"Failed to create local audio track: {e}")
+def parse_candidate(data):
+    sdp = (data or {}).get("candidate") or ""
+    if sdp.startswith("candidate:"):
+        sdp = sdp[len("candidate:"):]
+    if not sdp:
         return None
+    candidate = candidate_from_sdp(sdp)
+    candidate.sdpMid = data.get("sdpMid")
+    candidate.sdpMLineIndex = data.get("sdpMLineIndex")
+    return candidate
 
-def handle_offer(offer_sdp, session_id):
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        result = loop.run_until_complete(_handle_offer_async(offer_sdp, session_id))
-        return result
-    except Exception as e:
-        logger.error(f"Error in handle_offer: {e}")
-        return None
-    finally:
-        if loop:
-            loop.close()
+class CameraVideoTrack(VideoStreamTrack):
+    def __init__(self, hub, ladder=VIDEO_LADDER, level=0):
+        super().__init__()
+        self.hub = hub
+        self.ladder = ladder
+        self.level = min(level, len(ladder) - 1)
+        self.last_seq = 0
+        self.last_frame = None
+        self.frames_sent = 0
+        self.good_samples = 0
 
-async def _handle_offer_async(offer_sdp, session_id):
-    try:
+    def set_level(self, level):
+        level = max(0, min(len(self.ladder) - 1, level))
+        if level != self.level:
+            width, fps = self.ladder[level]
+            logger.info(f"Video quality -> {width}px @ {fps} fps")
+            self.level = level
+        self.good_samples = 0
+
+    def adapt(self, loss, rtt):
+        if (loss is not None and loss > ADAPT_DOWN_LOSS) or (rtt is not None and rtt > ADAPT_DOWN_RTT):
+            self.set_level(self.level + 1)
+        elif (loss is None or loss < ADAPT_UP_LOSS) and (rtt is None or rtt < ADAPT_UP_RTT):
+            self.good_samples += 1
+            if self.good_samples >= ADAPT_UP_SAMPLES and self.level > 0:
+                self.set_level(self.level - 1)
+        else:
+            self.good_samples = 0
+
+    async def next_timestamp(self):
+        fps = self.ladder[self.level][1]
+        if hasattr(self, "_timestamp"):
+            self._timestamp += int(VIDEO_CLOCK_RATE / fps)
+            wait = self._start + (self._timestamp / VIDEO_CLOCK_RATE) - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        else:
+            self._start = time.time()
+            self._timestamp = 0
+        return self._timestamp, VIDEO_TIME_BASE
+
+    @staticmethod
+    def convert(frame, width):
+        if frame.shape[1] != width:
+            height = int(frame.shape[0] * width / frame.shape[1]) & ~1
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        return VideoFrame.from_ndarray(frame, format="bgr24")
+
+    async def recv(self):
+        pts, time_base = await self.next_timestamp()
+        width = self.ladder[self.level][0]
+        latest = self.hub.latest() if self.hub else None
+        if latest is not None and (latest[0] != self.last_seq or self.last_frame is None
+                                   or self.last_frame.width != width):
+            self.last_seq = latest[0]
+            loop = asyncio.get_running_loop()
+            self.last_frame = await loop.run_in_executor(None, self.convert, latest[2], width)
+        if self.last_frame is None:
+            frame = VideoFrame(width=width, height=width * 3 // 4)
+            for p in frame.planes:
+                p.update(bytes(p.buffer_size))
+        else:
+            frame = self.last_frame
+        frame.pts = pts
+        frame.time_base = time_base
+        self.frames_sent += 1
+        RTC_VIDEO_FRAMES.inc()
+        return frame
+
+def prefer_codec(transceiver, codec=VIDEO_CODEC):
+    mime = f"video/{codec}".lower()
+    codecs = RTCRtpSender.getCapabilities("video").codecs
+    preferred = [c for c in codecs if c.mimeType.lower() == mime]
+    if not preferred:
+        return
+    rest = [c for c in codecs if c.mimeType.lower() != mime]
+    transceiver.setCodecPreferences(preferred + rest)
+
+class Peer:
+    def __init__(self, session_id, pc):
+        self.session_id = session_id
+        self.pc = pc
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        self.pending_candidates = []
+        self.sinks = []
+        self.video_track = None
+        self.last_sample = None
+        self.stats = {}
+
+class RtcLoop(threading.Thread):
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, reap_interval=REAP_INTERVAL):
+        super().__init__()
+        self.daemon = True
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.loop = asyncio.new_event_loop()
+        self.peers = {}
+        self.early_candidates = {}
+        self.player = None
+        self.relay = None
+        self.reaper_task = None
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.reaper_task = self.loop.create_task(self.reaper())
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def local_audio(self):
+        if self.player is None:
+            try:
+                self.player = MediaPlayer("/dev/null", format="alsa", options={
+                    "channels": "1",
+                    "sample_rate": "44100"
+                })
+                self.relay = MediaRelay()
+            except Exception as e:
+                logger.error(f"Failed to create local audio track: {e}")
+                return None
+        if self.player.audio is None:
+            return None
+        return self.relay.subscribe(self.player.audio)
+
+    async def open_peer(self, session_id, offer_sdp, video_source=None):
+        await self.close_peer(session_id, "renegotiated")
         pc = RTCPeerConnection(create_rtc_config())
-        peer_connections[session_id] = pc
-        
+        peer = Peer(session_id, pc)
+        peer.pending_candidates = self.early_candidates.pop(session_id, [])
+        self.peers[session_id] = peer
+        RTC_PEERS.set(len(self.peers))
+
         @pc.on("connectionstatechange")
         async def on_connectionstatechange():
-            logger.info(f"Connection state: {pc.connectionState}")
-            if pc.connectionState == "closed":
-                if session_id in peer_connections:
-                    del peer_connections[session_id]
-        
+            logger.info(f"Connection {session_id} state: {pc.connectionState}")
+            if pc.connectionState in ("failed", "closed"):
+                await self.close_peer(session_id, pc.connectionState, pc)
+
         @pc.on("track")
         async def on_track(track):
-            logger.info(f"Received track: {track.kind}")
+            logger.info(f"Received track from {session_id}: {track.kind}")
             if track.kind == "audio":
-                relay.subscribe(track)
-        
-        local_audio = await create_local_tracks()
-        if local_audio:
-            pc.addTrack(local_audio)
-        
-        offer = RTCSessionDescription(sdp=offer_sdp, type="offer")
-        await pc.setRemoteDescription(offer)
-        
-        answer = await pc.createAnswer()
-        await pc.setLocalDescription(answer)
-        
-        return answer.sdp
-        
+                sink = MediaBlackhole()
+                sink.addTrack(track)
+                peer.sinks.append(sink)
+                await sink.start()
+
+        try:
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=offer_sdp, type="offer"))
+            for candidate in peer.pending_candidates:
+                await pc.addIceCandidate(candidate)
+            peer.pending_candidates = []
+
+            kinds = {t.kind for t in pc.getTransceivers()}
+            if "audio" in kinds:
+                local_audio = self.local_audio()
+                if local_audio:
+                    pc.addTrack(local_audio)
+            if "video" in kinds and video_source is not None:
+                peer.video_track = CameraVideoTrack(video_source)
+                pc.addTrack(peer.video_track)
+                for transceiver in pc.getTransceivers():
+                    if transceiver.sender.track is peer.video_track:
+                        prefer_codec(transceiver)
+
+            answer = await pc.createAnswer()
+            await pc.setLocalDescription(answer)
+            return pc.localDescription.sdp
+        except Exception:
+            await self.close_peer(session_id, "error", pc)
+            raise
+
+    async def add_candidate(self, session_id, candidate):
+        peer = self.peers.get(session_id)
+        if peer is None:
+            self.early_candidates.setdefault(session_id, []).append(candidate)
+            return
+        peer.last_activity = time.monotonic()
+        if peer.pc.remoteDescription is None:
+            peer.pending_candidates.append(candidate)
+        else:
+            await peer.pc.addIceCandidate(candidate)
+
+    async def close_peer(self, session_id, reason, pc=None):
+        if pc is None and reason != "renegotiated":
+            self.early_candidates.pop(session_id, None)
+        peer = self.peers.get(session_id)
+        if peer is None or (pc is not None and peer.pc is not pc):
+            return
+        del self.peers[session_id]
+        RTC_PEERS.set(len(self.peers))
+        RTC_CLOSED.labels(reason).inc()
+        if peer.video_track is not None:
+            peer.video_track.stop()
+        for sink in peer.sinks:
+            try:
+                await sink.stop()
+            except Exception as e:
+                logger.error(f"Error stopping sink for {session_id}: {e}")
+        try:
+            await peer.pc.close()
+        except Exception as e:
+            logger.error(f"Error closing connection {session_id}: {e}")
+        logger.info(f"Cleaned up connection for session {session_id} ({reason})")
+
+    async def sample_stats(self, peer, update=True):
+        report = await peer.pc.getStats()
+        bytes_sent = bytes_received = packets_received = packets_lost = 0
+        rtt = jitter = fraction_lost = None
+        for s in report.values():
+            if s.type == "transport":
+                bytes_sent += getattr(s, "bytesSent", 0) or 0
+                bytes_received += getattr(s, "bytesReceived", 0) or 0
+            elif s.type == "inbound-rtp":
+                packets_received += getattr(s, "packetsReceived", 0) or 0
+                packets_lost += getattr(s, "packetsLost", 0) or 0
+                jitter = getattr(s, "jitter", jitter)
+            elif s.type == "remote-inbound-rtp":
+                rtt = max(rtt or 0, getattr(s, "roundTripTime", 0) or 0)
+                fraction_lost = max(fraction_lost or 0, getattr(s, "fractionLost", 0) or 0)
+
+        now = time.monotonic()
+        stats = {
+            "state": peer.pc.connectionState,
+            "age": now - peer.created,
+            "rtt": rtt,
+            "jitter": jitter,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+            "packets_lost": packets_lost,
+            "loss_rate": packets_lost / (packets_lost + packets_received) if packets_received else None,
+            "remote_fraction_lost": fraction_lost,
+            "send_bitrate": None,
+            "receive_bitrate": None,
+        }
+        if peer.last_sample:
+            then, sent, received, packets = peer.last_sample
+            if now > then:
+                stats["send_bitrate"] = (bytes_sent - sent) * 8 / (now - then)
+                stats["receive_bitrate"] = (bytes_received - received) * 8 / (now - then)
+            if update and (packets_received > packets or bytes_received > received):
+                peer.last_activity = now
+        # Only the reaper advances the bitrate baseline and idle clock; status reads are snapshots.
+        if update:
+            peer.last_sample = (now, bytes_sent, bytes_received, packets_received)
+        stats["idle"] = now - peer.last_activity
+        if peer.video_track is not None:
+            width, fps = peer.video_track.ladder[peer.video_track.level]
+            stats["video"] = {"width": width, "fps": fps, "frames_sent": peer.video_track.frames_sent}
+        if update:
+            peer.stats = stats
+        return stats
+
+    async def reaper(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            for session_id, peer in list(self.peers.items()):
+                try:
+                    if peer.pc.connectionState in ("failed", "closed"):
+                        await self.close_peer(session_id, peer.pc.connectionState, peer.pc)
+                        continue
+                    stats = await self.sample_stats(peer)
+                    if peer.video_track is not None:
+                        peer.video_track.adapt(stats["remote_fraction_lost"], stats["rtt"])
+                    if time.monotonic() - peer.last_activity > self.idle_timeout:
+                        await self.close_peer(session_id, "idle", peer.pc)
+                except Exception as e:
+                    logger.error(f"Error checking connection {session_id}: {e}")
+
+    async def close_all(self):
+        if self.reaper_task:
+            self.reaper_task.cancel()
+        for session_id in list(self.peers):
+            await self.close_peer(session_id, "shutdown")
+        if self.player is not None:
+            for track in (self.player.audio, self.player.video):
+                if track is not None:
+                    track.stop()
+
+    def stop(self, timeout=5.0):
+        try:
+            self.submit(self.close_all()).result(timeout)
+        except Exception as e:
+            logger.error(f"Error closing WebRTC connections: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+_rtc_loop = None
+_rtc_loop_lock = threading.Lock()
+
+def get_rtc_loop():
+    global _rtc_loop
+    if _rtc_loop is None:
+        with _rtc_loop_lock:
+            if _rtc_loop is None:
+                rtc_loop = RtcLoop()
+                rtc_loop.start()
+                _rtc_loop = rtc_loop
+    return _rtc_loop
+
+def handle_offer(offer_sdp, session_id, video_source=None, timeout=OFFER_TIMEOUT):
+    start = time.perf_counter()
+    try:
+        rtc_loop = get_rtc_loop()
+        return rtc_loop.submit(rtc_loop.open_peer(session_id, offer_sdp, video_source)).result(timeout)
     except Exception as e:
         logger.error(f"Error creating WebRTC answer: {e}")
         return None
+    finally:
+        RTC_OFFER_SECONDS.observe(time.perf_counter() - start)
+
+def add_ice_candidate(session_id, data):
+    try:
+        candidate = parse_candidate(data)
+    except Exception as e:
+        logger.error(f"Invalid ICE candidate from {session_id}: {e}")
+        return False
+    if candidate is None:
+        return True
+    get_rtc_loop().submit(get_rtc_loop().add_candidate(session_id, candidate))
+    return True
 
 def cleanup_connection(session_id):
-    if session_id in peer_connections:
-        try:
-            pc = peer_connections[session_id]
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(pc.close())
-            del peer_connections[session_id]
-            logger.info(f"Cleaned up connection for session {session_id}")
-        except Exception as e:
-            logger.error(f"Error cleaning up connection: {e}")
-        finally:
-            if loop:
-                loop.close()
+    if _rtc_loop is None:
+        return None
+    return _rtc_loop.submit(_rtc_loop.close_peer(session_id, "hangup"))
+
+def cleanup_client(client_id):
+    if _rtc_loop is None:
+        return None
+
+    async def close_client():
+        for session_id in list(_rtc_loop.peers) + list(_rtc_loop.early_candidates):
+            if session_id.split("/")[0] == client_id:
+                await _rtc_loop.close_peer(session_id, "disconnected")
+
+    return _rtc_loop.submit(close_client())
 
 def get_active_connections():
-    return len(peer_connections)
\ No newline at end of file
+    return len(_rtc_loop.peers) if _rtc_loop else 0
+
+def get_connection_stats(timeout=2.0):
+    if _rtc_loop is None:
+        return {}
+
+    async def collect():
+        out = {}
+        for session_id, peer in list(_rtc_loop.peers.items()):
+            try:
+                out[session_id] = await _rtc_loop.sample_stats(peer, update=False)
+            except Exception as e:
+                out[session_id] = {"state": peer.pc.connectionState, "error": str(e)}
+        return out
+
+    return _rtc_loop.submit(collect()).result(timeout)
+
+def shutdown():
+    global _rtc_loop
+    if _rtc_loop is not None:
+        _rtc_loop.stop()
+        _rtc_loop = None